@@ -1,37 +1,110 @@
 from flask import Flask, request, jsonify
-from flask_mail import Mail
-from pymongo import MongoClient
 from flask import Flask, request
 from routes.validate import validate_route
 from routes.getdata import getdata_route
+from routes.jobs import job_status_route
+from routes.metrics import metrics_route
+from services.jobs.job_queue import JobQueue
+from services.email.mail_app import configure_mail
+from services.email.outbox import create_outbox
+from services.database.bulk_writer import BulkWriter
+from services.jobs.dedup import SubmissionDedup
+from bson import ObjectId
+from services.registry import registry
 from config import Config
+import importlib
+import json
+import threading
 
 app = Flask(__name__)
 
 # Configure Flask-Mail for Gmail
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587  # Use 465 for SSL
-app.config['MAIL_USE_TLS'] = True  # Enable TLS
-app.config['MAIL_USE_SSL'] = False  # Disable SSL when using TLS
-app.config['MAIL_USERNAME'] = Config.CONFIRMATION_SENDER_EMAIL
-app.config['MAIL_PASSWORD'] = Config.CONFIRMATION_SENDER_EMAIL_APP_PASSWORD
-app.config['MAIL_DEFAULT_SENDER'] = Config.CONFIRMATION_SENDER_EMAIL
+mail = configure_mail(app)
 
-mail = Mail(app)
+# Clients and background services are built on first use (see services/registry.py).
+# Indexes are created once with `python manage.py ensure-indexes`, not on every start.
 
-# MongoDB connection setup
-mongo_username = Config.MONGO_USERNAME
-mongo_password = Config.MONGO_PASSWORD
-mongo_cluster = Config.MONGO_CLUSTER
+# Buffered submission writes (BULK_WRITES=true), one writer per route for its write concern
+def _bulk_writer(write_concern):
+    if not Config.BULK_WRITES:
+        return None
+    return BulkWriter(
+        registry.get('webhook_collection'),
+        max_docs=Config.BULK_WRITE_MAX_DOCS,
+        max_delay=Config.BULK_WRITE_MAX_DELAY_MS / 1000,
+        write_concern=write_concern,
+    )
 
-client = MongoClient(
-    f'mongodb+srv://{mongo_username}:{mongo_password}@{mongo_cluster}/?retryWrites=true&w=majority&appName=MangoCore'
-)
-db = client['webhook_db'] 
-collection = db['webhook_data'] 
-collection.create_index({"created_at": 1}, expireAfterSeconds=2592000)  # 30 days in seconds
+registry.register('webhook_writer', lambda: _bulk_writer(Config.WEBHOOK_WRITE_CONCERN))
+registry.register('getdata_writer', lambda: _bulk_writer(Config.GETDATA_WRITE_CONCERN))
 
 
+# Background SMTP sender (EMAIL_OUTBOX=true)
+registry.register('outbox', lambda: create_outbox(app, mail, registry.get('webhook_collection')))
+
+
+# Idempotent webhook handling (WEBHOOK_DEDUP=true)
+def _dedup():
+    if not Config.WEBHOOK_DEDUP:
+        return None
+    return SubmissionDedup(
+        registry.get('webhook_collection'),
+        wait_seconds=Config.DEDUP_WAIT_SECONDS,
+        lease_seconds=Config.DEDUP_LEASE_SECONDS,
+    )
+
+registry.register('dedup', _dedup)
+
+
+# Asynchronous webhook jobs (ASYNC_WEBHOOK=true)
+def run_job(payload):
+    from services.validation.pipeline import process_submission
+    # A job that raises is marked failed and not run again, so its claim is released
+    # and the next delivery processes the submission. The claim of a job whose
+    # worker died is taken over by a later delivery after DEDUP_LEASE_SECONDS.
+    claim = (ObjectId(payload['dedup_id']), payload['dedup_key']) if payload.get('dedup_id') else None
+    try:
+        with app.app_context():
+            data = json.loads(payload['data'])
+            return process_submission(
+                data, payload['pr_amount'], payload['normal_amount'], mail,
+                registry.get('webhook_collection'), registry.get('outbox'), registry.get('webhook_writer'),
+                registry.get('dedup'), claim,
+            )
+    except Exception:
+        if claim is not None:
+            registry.get('dedup').release(*claim)
+        raise
+
+def _job_queue():
+    if not Config.ASYNC_WEBHOOK:
+        return None
+    job_queue = JobQueue(
+        registry.get('database')['webhook_jobs'],
+        run_job,
+        workers=Config.JOB_WORKERS,
+        lease_seconds=Config.JOB_LEASE_SECONDS,
+        max_attempts=Config.JOB_MAX_ATTEMPTS,
+    )
+    job_queue.start()
+    return job_queue
+
+registry.register('job_queue', _job_queue)
+
+
+def start_background_services():
+    """
+    Starts the job workers, which resume the jobs left by a previous worker, and
+    with WARM_UP imports the validation pipeline. Runs in a thread, so the worker
+    accepts requests right away and the first submission rarely waits for the
+    heavy imports.
+    """
+    registry.get('job_queue')
+    if Config.WARM_UP:
+        importlib.import_module('services.validation.pipeline')
+
+threading.Thread(target=start_background_services, name='start-up', daemon=True).start()
+
 
 @app.route('/',methods = ['GET'])
 def main():
@@ -41,11 +114,22 @@ def main():
 # Register routes
 @app.route('/',methods = ['POST'])
 def validate():
-    return validate_route(mail, collection)
+    return validate_route(
+        mail, registry.get('webhook_collection'), registry.get('job_queue'),
+        registry.get('outbox'), registry.get('webhook_writer'), registry.get('dedup'),
+    )
 
 @app.route('/getdata',methods = ['POST'])
 def getdata():
-    return getdata_route(collection)
+    return getdata_route(registry.get('webhook_collection'), registry.get('getdata_writer'))
+
+@app.route('/jobs/<job_id>',methods = ['GET'])
+def job_status(job_id):
+    return job_status_route(registry.get('job_queue'), job_id)
+
+@app.route('/metrics',methods = ['GET'])
+def metrics():
+    return metrics_route()
 
 
 if __name__ == '__main__':
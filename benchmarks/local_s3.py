@@ -0,0 +1,55 @@
+import hashlib
+from io import BytesIO
+from botocore.exceptions import ClientError
+
+
+class _Exceptions:
+    class NoSuchKey(Exception):
+        pass
+
+
+def _etag(body):
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def _client_error(status, code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+
+class LocalS3:
+    """
+    In-memory stand-in for the boto3 S3 client, with the calls the ledger and the
+    mailbox cursor use: get_object (with IfNoneMatch / IfMatch) and put_object
+    (with IfMatch / IfNoneMatch='*'). ETags are MD5 hashes like S3's, and the
+    counters show how many requests a benchmark made.
+    """
+    exceptions = _Exceptions
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = 0
+        self.puts = 0
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, IfMatch=None):
+        self.gets += 1
+        body = self.objects.get((Bucket, Key))
+        if body is None:
+            raise _Exceptions.NoSuchKey(Key)
+        etag = _etag(body)
+        if IfNoneMatch is not None and IfNoneMatch == etag:
+            raise _client_error(304, '304', 'GetObject')
+        if IfMatch is not None and IfMatch != etag:
+            raise _client_error(412, 'PreconditionFailed', 'GetObject')
+        return {'Body': BytesIO(body), 'ETag': etag, 'ContentLength': len(body)}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self.puts += 1
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        current = self.objects.get((Bucket, Key))
+        if IfMatch is not None and (current is None or _etag(current) != IfMatch):
+            raise _client_error(412, 'PreconditionFailed', 'PutObject')
+        if IfNoneMatch == '*' and current is not None:
+            raise _client_error(412, 'PreconditionFailed', 'PutObject')
+        self.objects[(Bucket, Key)] = Body
+        return {'ETag': _etag(Body)}
@@ -0,0 +1,234 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from benchmarks import synthetic
+from benchmarks.local_s3 import LocalS3
+
+BUCKET = 'benchmark-bucket'
+LEDGER_KEY = 'ledger.csv'
+
+
+def measure(function, calls, repeat):
+    """
+    Runs function() `repeat` times and returns the latency per call and the peak
+    memory allocated by one call.
+
+    Args:
+        function (callable): Called with the call number, returns nothing.
+        calls (int): Calls timed together in one sample, for very fast functions.
+        repeat (int): Number of samples.
+
+    Returns:
+        dict: min_ms, median_ms, p95_ms and peak_kb.
+    """
+    counter = iter(range(10 ** 9))
+    function(next(counter))     # warm-up
+
+    samples = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(calls):
+                function(next(counter))
+            samples.append((time.perf_counter() - start) * 1000 / calls)
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    function(next(counter))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples.sort()
+    return {
+        'min_ms': round(samples[0], 4),
+        'median_ms': round(statistics.median(samples), 4),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def bench_email_parsing():
+    from services.email.imapTools import IMAP
+    emails = synthetic.interac_emails(1000)
+    amounts = synthetic.amounts(1000)
+    return {
+        'IMAP.test_match': measure(lambda i: IMAP.test_match(emails[i % len(emails)]), calls=200, repeat=20),
+        'IMAP.clean_amount': measure(lambda i: IMAP.clean_amount(amounts[i % len(amounts)]), calls=2000, repeat=20),
+    }
+
+
+def bench_ledger(size):
+    """
+    Payment lookups on a ledger of `size` rows stored in the local S3 stand-in.
+    """
+    from services.email.imapTools import IMAP
+    from services.ledger.ledger_store import S3CsvLedger
+    from services.ledger.payer_index import PayerIndex
+    from services.registry import registry
+
+    s3 = LocalS3()
+    s3.objects[(BUCKET, LEDGER_KEY)] = synthetic.ledger_csv(size)
+    ledger = S3CsvLedger(s3, BUCKET, LEDGER_KEY)
+    registry.register('ledger', lambda: ledger)
+
+    unused = ledger.unused()
+    payers = list(zip(unused['Sent_From'], unused['Amount'].astype(str)))
+    random.Random(size).shuffle(payers)
+    rng = random.Random(7)
+    unknown = [f"{synthetic.payer_name(rng)} {synthetic.reference(rng).lower()}" for _ in range(100)]
+
+    def hit(i):
+        # Each hit claims its row, as in production
+        name, amount = payers[i % len(payers)]
+        IMAP.validate_reference_by_name(name, amount)
+
+    def miss(i):
+        IMAP.validate_reference_by_name(unknown[i % len(unknown)], '500')
+
+    repeat = 20 if size <= 10000 else 5
+    return {
+        f'PayerIndex build [{size}]': measure(lambda i: PayerIndex(unused, i), calls=1, repeat=repeat),
+        f'IMAP.validate_reference_by_name miss [{size}]': measure(miss, calls=5, repeat=repeat),
+        f'IMAP.validate_reference_by_name hit [{size}]': measure(hit, calls=1, repeat=repeat),
+    }
+
+
+def bench_pr_card():
+    import services.validation.pr_card_validator as pr_card_validator
+    submission = synthetic.jotform_submission()
+    full_name = f"{submission['q6_legalName']['first']} {submission['q6_legalName']['last']}"
+    card_number = submission['q11_prCard']
+
+    results = {}
+    original = pr_card_validator.image_to_tokens
+    try:
+        for noise_words in (40, 1000):
+            tokens = synthetic.pr_card_tokens(full_name, card_number, noise_words)
+            # The download and the OCR call are replaced by the synthetic tokens
+            pr_card_validator.image_to_tokens = lambda url: tokens
+            # check_PR_Card prints its checks
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[f'check_PR_Card [{len(tokens)} tokens]'] = measure(
+                    lambda i: pr_card_validator.check_PR_Card(card_number, full_name, 'synthetic'), calls=50, repeat=20
+                )
+    finally:
+        pr_card_validator.image_to_tokens = original
+    return results
+
+
+def bench_request_processing():
+    from services.jotForm.request_processor import process_request_data
+    submissions = [synthetic.jotform_submission(seed, pr=seed % 2 == 0) for seed in range(100)]
+    return {
+        'process_request_data': measure(lambda i: process_request_data(submissions[i % 100], '500', '546'), calls=1000, repeat=20),
+    }
+
+
+def run(sizes):
+    results = {}
+    results.update(bench_email_parsing())
+    for size in sizes:
+        results.update(bench_ledger(size))
+    results.update(bench_pr_card())
+    results.update(bench_request_processing())
+    return results
+
+
+def best_of(rounds, sizes):
+    """
+    Runs the whole suite `rounds` times and keeps the fastest round of each
+    benchmark, which is much less sensitive to a busy machine than one round.
+    """
+    best = {}
+    for _ in range(rounds):
+        for name, result in run(sizes).items():
+            if name not in best or result['min_ms'] < best[name]['min_ms']:
+                best[name] = result
+    return best
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """
+    Lists the benchmarks whose fastest sample grew by more than `tolerance`
+    (a fraction) and by at least `min_delta_ms` over the baseline. The
+    fastest sample is compared because the median moves with the machine's
+    load, while a slowdown in the code shows in every sample.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        delta = result['min_ms'] - reference['min_ms']
+        if delta > reference['min_ms'] * tolerance and delta >= min_delta_ms:
+            regressions.append((name, reference['min_ms'], result['min_ms']))
+    return regressions
+
+
+def machine():
+    """
+    Describes where the timings were taken; baselines from another machine are not comparable.
+    """
+    return {
+        'python': platform.python_version(),
+        'system': platform.system(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the validation hot paths on synthetic data.')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Ledger sizes, comma separated.')
+    parser.add_argument('--baseline', help='Baseline JSON to compare with; the run fails on a slowdown.')
+    parser.add_argument('--save-baseline', help='Write the results to this JSON file.')
+    parser.add_argument('--rounds', type=int, default=3, help='Runs of the suite; the fastest round of each benchmark is kept.')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed slowdown as a fraction of the baseline.')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help='Slowdowns smaller than this are noise.')
+    args = parser.parse_args(argv)
+
+    # Lookups log every miss
+    logging.basicConfig(level=logging.ERROR)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = best_of(args.rounds, sizes)
+
+    print(f"{'benchmark':<55}{'min ms':>12}{'median ms':>12}{'p95 ms':>12}{'peak KiB':>12}")
+    for name, result in results.items():
+        print(f"{name:<55}{result['min_ms']:>12.4f}{result['median_ms']:>12.4f}{result['p95_ms']:>12.4f}{result['peak_kb']:>12.1f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'machine': machine(), 'sizes': sizes, 'results': results}, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('machine') != machine():
+            print(f"WARNING: {args.baseline} was recorded on {baseline.get('machine')}; compare on the same machine.")
+        regressions = compare(results, baseline['results'], args.tolerance, args.min_delta_ms)
+        for name, before, after in regressions:
+            print(f"SLOWER: {name}: {before} ms -> {after} ms")
+        if regressions:
+            return 1
+        print(f"No regression beyond {args.tolerance:.0%} of {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    # python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    # python -m benchmarks.run --baseline benchmarks/baseline.json
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import random
+import string
+from io import StringIO
+import pandas as pd
+
+FIRST_NAMES = [
+    'james', 'mary', 'mohammad', 'fatima', 'wei', 'li', 'olga', 'ivan', 'priya', 'arjun',
+    'sofia', 'lucas', 'amir', 'sara', 'daniel', 'elena', 'omar', 'leila', 'chen', 'yuki',
+    'hassan', 'maria', 'john', 'anna', 'reza', 'noor', 'david', 'zahra', 'ali', 'nina',
+]
+LAST_NAMES = [
+    'smith', 'nguyen', 'farzam', 'mohajeri', 'wang', 'patel', 'kim', 'garcia', 'ivanova', 'rossi',
+    'hosseini', 'singh', 'tremblay', 'roy', 'gagnon', 'chen', 'khan', 'ahmadi', 'martin', 'lee',
+    'brown', 'wilson', 'taylor', 'ali', 'rahimi', 'sato', 'kowalski', 'haddad', 'costa', 'lopez',
+]
+
+
+def payer_name(rng):
+    words = [rng.choice(FIRST_NAMES)]
+    if rng.random() < 0.4:
+        words.append(rng.choice(FIRST_NAMES))
+    words.append(rng.choice(LAST_NAMES))
+    if rng.random() < 0.2:
+        words.append(rng.choice(LAST_NAMES))
+    return ' '.join(words)
+
+
+def reference(rng):
+    return ''.join(rng.choices(string.ascii_uppercase + string.digits, k=12))
+
+
+def ledger_rows(size, used_ratio=0.5, seed=1):
+    """
+    Ledger rows shaped like the ones IMAP.parse_payment produces.
+    """
+    rng = random.Random(seed)
+    return [
+        {
+            'Reference': reference(rng),
+            'Sent_From': payer_name(rng),
+            'Date': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'Amount': str(rng.choice([500, 546, 1000, 4000]) + rng.choice([0, 0, 0, rng.randint(1, 99)])),
+            'Used': rng.random() < used_ratio,
+        }
+        for _ in range(size)
+    ]
+
+
+def ledger_csv(size, used_ratio=0.5, seed=1):
+    buffer = StringIO()
+    pd.DataFrame(ledger_rows(size, used_ratio, seed)).to_csv(buffer, index=False)
+    return buffer.getvalue().encode('utf-8')
+
+
+def interac_email(rng):
+    """
+    Text body of an Interac e-Transfer notification.
+    """
+    amount = rng.choice([500, 546, 1000, 4000, 12500])
+    return (
+        "Hi COMMUNITY FAMILY SERVICES OF ONTARIO,\n\n"
+        f"{payer_name(rng).upper()} sent you money.\n\n"
+        "Message: course registration\n\n"
+        f"Sent From: {payer_name(rng).upper()}\n"
+        f"Amount: ${amount:,}.00\n"
+        f"Reference Number: {reference(rng)}\n\n"
+        "This email was sent to you by Interac Corp., the owner of the Interac e-Transfer service.\n"
+        + "Please do not reply to this email. " * rng.randint(5, 40)
+    )
+
+
+def interac_emails(count, seed=2):
+    rng = random.Random(seed)
+    return [interac_email(rng) for _ in range(count)]
+
+
+def amounts(count, seed=3):
+    rng = random.Random(seed)
+    return [rng.choice(['$4,000.00', '4,000.00', '4000.00', '4000', '$127.54', '$12,500.00']) for _ in range(count)]
+
+
+def pr_card_tokens(full_name, card_number, noise_words=40, seed=4):
+    """
+    OCR tokens of a PR card photo: the card text, the holder's name, the card
+    number split in groups, and noise words.
+    """
+    rng = random.Random(seed)
+    tokens = ["Government", "of", "Canada", "Gouvernement", "du", "PERMANENT", "RESIDENT", "CARD", "CARTE", "DE", "RÉSIDENT", "PERMANENT"]
+    tokens += [name.upper() for name in full_name.split(' ')]
+    tokens += [''.join(rng.choices(string.ascii_uppercase + string.digits, k=rng.randint(2, 9))) for _ in range(noise_words)]
+    rng.shuffle(tokens)
+    position = rng.randint(0, len(tokens))
+    tokens[position:position] = [card_number[i:i + 4] for i in range(0, len(card_number), 4)]
+    return [{'text': token} for token in tokens]
+
+
+def jotform_submission(seed=5, pr=True):
+    """
+    Parsed JotForm submission with the fields process_request_data reads.
+    """
+    rng = random.Random(seed)
+    first, last = rng.choice(FIRST_NAMES).title(), rng.choice(LAST_NAMES).title()
+    submission_id = rng.randint(10 ** 18, 10 ** 19 - 1)
+    form_id = rng.randint(10 ** 14, 10 ** 15 - 1)
+    return {
+        'slug': f'submit/{form_id}',
+        'q6_legalName': {'first': first, 'last': last},
+        'q8_email': f'{first.lower()}.{last.lower()}@example.com',
+        'q9_phoneNumber': {'full': '(416) 555-0100'},
+        'q26_payersName': {'first': first, 'last': last},
+        'q29_areYou': 'Yes I am a permanent resident' if pr else 'No',
+        'q11_prCard': ''.join(rng.choices(string.digits, k=10)),
+        'clearFront': [f'https://www.jotform.com/uploads/cfso/{form_id}/{submission_id}/card{i}.jpg' for i in range(2)],
+        'uploadEtransfer': [f'https://www.jotform.com/uploads/cfso/{form_id}/{submission_id}/etransfer.png'],
+    }
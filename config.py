@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from the .env file
@@ -15,6 +16,15 @@ class Config:
     AWS_SECRET_KEY = os.getenv('AWS_SECRET_KEY')
     S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
     S3_FILE_KEY = os.getenv('S3_FILE_KEY')
+    IMAP_CURSOR_KEY = os.getenv('IMAP_CURSOR_KEY', 'interac_sync_cursor.json')
+
+    # Payment ledger: 's3' (CSV at S3_FILE_KEY), 'mongo' or 'sqlite'
+    LEDGER_BACKEND = os.getenv('LEDGER_BACKEND', 's3')
+    LEDGER_COLLECTION = os.getenv('LEDGER_COLLECTION', 'payment_ledger')
+    LEDGER_SQLITE_PATH = os.getenv('LEDGER_SQLITE_PATH', 'ledger.db')
+    # S3 ledger compaction: monthly archive objects, and age of the payments kept in S3_FILE_KEY
+    LEDGER_ARCHIVE_PREFIX = os.getenv('LEDGER_ARCHIVE_PREFIX', 'ledger_archive/')
+    LEDGER_HOT_DAYS = int(os.getenv('LEDGER_HOT_DAYS', 60))
     SPONSOR_EMAIL_APP_PASSWORD = os.getenv('SPONSOR_EMAIL_APP_PASSWORD')
     SPONSOR_EMAIL_USER = os.getenv('SPONSOR_EMAIL_USER')
     ERROR_NOTIFICATION_EMAIL_RECIEVER = os.getenv('ERROR_NOTIFICATION_EMAIL_RECIEVER')
@@ -22,5 +32,91 @@ class Config:
     CONFIRMATION_SENDER_EMAIL_APP_PASSWORD = os.getenv('CONFIRMATION_SENDER_EMAIL_APP_PASSWORD')
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     OPENAI_API_MODEL = os.getenv('OPENAI_API_MODEL')
+    OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '30'))
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '1'))
+    OPENAI_DRAFT_BUDGET_SECONDS = float(os.getenv('OPENAI_DRAFT_BUDGET_SECONDS', '5'))
+    OPENAI_DRAFT_MAX_TOKENS = int(os.getenv('OPENAI_DRAFT_MAX_TOKENS', '600'))
+    OPENAI_DRAFT_CACHE_SIZE = int(os.getenv('OPENAI_DRAFT_CACHE_SIZE', '64'))
+    BACKGROUND_DRAFTS = os.getenv('BACKGROUND_DRAFTS', 'false').lower() == 'true'
+
+    # Validation pipeline
+    CONCURRENT_VALIDATION = os.getenv('CONCURRENT_VALIDATION', 'false').lower() == 'true'
+    VALIDATION_WORKERS = int(os.getenv('VALIDATION_WORKERS', '8'))
+    PR_IMAGE_CONCURRENCY = int(os.getenv('PR_IMAGE_CONCURRENCY', '3'))
+    PR_IMAGE_WORKERS = int(os.getenv('PR_IMAGE_WORKERS', '8'))
+
+    # JotForm image downloads
+    IMAGE_CONNECT_TIMEOUT = float(os.getenv('IMAGE_CONNECT_TIMEOUT', '5'))
+    IMAGE_READ_TIMEOUT = float(os.getenv('IMAGE_READ_TIMEOUT', '30'))
+    IMAGE_MAX_REDIRECTS = int(os.getenv('IMAGE_MAX_REDIRECTS', '5'))
+    IMAGE_MAX_HTML_DEPTH = int(os.getenv('IMAGE_MAX_HTML_DEPTH', '3'))
+    IMAGE_POOL_SIZE = int(os.getenv('IMAGE_POOL_SIZE', '10'))
+    IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'cfso_image_cache'))
+    IMAGE_CACHE_MAX_MB = int(os.getenv('IMAGE_CACHE_MAX_MB', '512'))
+
+    # OCR engines, tried in order: api_ninjas, local_model, aws_textract
+    NINJA_API_KEY = os.getenv('NINJA_API_KEY')
+    OCR_ENGINES = [name.strip() for name in os.getenv('OCR_ENGINES', 'api_ninjas').split(',') if name.strip()]
+    OCR_HEDGE_MS = int(os.getenv('OCR_HEDGE_MS', '0'))
+    OCR_TIMEOUT = float(os.getenv('OCR_TIMEOUT', '30'))
+    OCR_WORKERS = int(os.getenv('OCR_WORKERS', '8'))
+    OCR_LOCAL_MODEL_URL = os.getenv('OCR_LOCAL_MODEL_URL', 'http://54.81.146.167:5000/extract-text')
+
+    # Image preprocessing before OCR
+    OCR_PREPROCESS = os.getenv('OCR_PREPROCESS', 'false').lower() == 'true'
+    OCR_MAX_DIMENSION = int(os.getenv('OCR_MAX_DIMENSION', '2000'))
+    OCR_GRAYSCALE = os.getenv('OCR_GRAYSCALE', 'true').lower() == 'true'
+    OCR_JPEG_QUALITY = int(os.getenv('OCR_JPEG_QUALITY', '85'))
+
+    # OCR result cache
+    OCR_CACHE_MEMORY_ENTRIES = int(os.getenv('OCR_CACHE_MEMORY_ENTRIES', '256'))
+    OCR_CACHE_PERSISTENT = os.getenv('OCR_CACHE_PERSISTENT', 'false').lower() == 'true'
+    OCR_CACHE_COLLECTION = os.getenv('OCR_CACHE_COLLECTION', 'ocr_cache')
+    OCR_CACHE_TTL_DAYS = int(os.getenv('OCR_CACHE_TTL_DAYS', '30'))
+
+    # Asynchronous webhook jobs
+    ASYNC_WEBHOOK = os.getenv('ASYNC_WEBHOOK', 'false').lower() == 'true'
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+    JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '600'))
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+    # Duplicate webhook deliveries
+    WEBHOOK_DEDUP = os.getenv('WEBHOOK_DEDUP', 'false').lower() == 'true'
+    DEDUP_WAIT_SECONDS = float(os.getenv('DEDUP_WAIT_SECONDS', '20'))
+    DEDUP_LEASE_SECONDS = int(os.getenv('DEDUP_LEASE_SECONDS', '900'))
+
+    # Worker start-up
+    WARM_UP = os.getenv('WARM_UP', 'true').lower() == 'true'
+    IMPORT_TIME_BUDGET_MS = int(os.getenv('IMPORT_TIME_BUDGET_MS', '600'))
+
+    # Submission writes
+    BULK_WRITES = os.getenv('BULK_WRITES', 'false').lower() == 'true'
+    BULK_WRITE_MAX_DOCS = int(os.getenv('BULK_WRITE_MAX_DOCS', '100'))
+    BULK_WRITE_MAX_DELAY_MS = int(os.getenv('BULK_WRITE_MAX_DELAY_MS', '500'))
+    WEBHOOK_WRITE_CONCERN = os.getenv('WEBHOOK_WRITE_CONCERN', '')
+    GETDATA_WRITE_CONCERN = os.getenv('GETDATA_WRITE_CONCERN', '')
+
+    # Shared IMAP sessions
+    IMAP_POOL_SIZE = int(os.getenv('IMAP_POOL_SIZE', '4'))
+    IMAP_KEEPALIVE_SECONDS = int(os.getenv('IMAP_KEEPALIVE_SECONDS', '120'))
+
+    # Interac mailbox listener
+    MAILBOX_FALLBACK = os.getenv('MAILBOX_FALLBACK', 'true').lower() == 'true'
+    IMAP_IDLE_SECONDS = int(os.getenv('IMAP_IDLE_SECONDS', '600'))
+    IMAP_LISTENER_BACKOFF_MAX = int(os.getenv('IMAP_LISTENER_BACKOFF_MAX', '300'))
+    IMAP_TARGETED_LOOKUP = os.getenv('IMAP_TARGETED_LOOKUP', 'false').lower() == 'true'
+    IMAP_GMAIL_SEARCH = os.getenv('IMAP_GMAIL_SEARCH', 'true').lower() == 'true'
+    IMAP_PARTIAL_BYTES = int(os.getenv('IMAP_PARTIAL_BYTES', '4096'))
+    IMAP_PARSE_CACHE_SIZE = int(os.getenv('IMAP_PARSE_CACHE_SIZE', '4096'))
+    RECONCILE_PAYMENTS = os.getenv('RECONCILE_PAYMENTS', 'false').lower() == 'true'
+    RECONCILE_WINDOW_DAYS = int(os.getenv('RECONCILE_WINDOW_DAYS', '30'))
+    RECONCILE_REBUILD_SECONDS = int(os.getenv('RECONCILE_REBUILD_SECONDS', '3600'))
+    RECONCILE_SWEEP_SECONDS = int(os.getenv('RECONCILE_SWEEP_SECONDS', '300'))
+
+    # Background SMTP sender
+    EMAIL_OUTBOX = os.getenv('EMAIL_OUTBOX', 'false').lower() == 'true'
+    EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', '20'))
+    EMAIL_OUTBOX_KEEPALIVE_SECONDS = int(os.getenv('EMAIL_OUTBOX_KEEPALIVE_SECONDS', '60'))
+    EMAIL_OUTBOX_SEND_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_SEND_ATTEMPTS', '3'))
 
 # from config import Config
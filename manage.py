@@ -0,0 +1,231 @@
+import argparse
+import logging
+import os
+import re
+import subprocess
+import sys
+from datetime import datetime, timedelta, timezone
+from config import Config
+
+# Lifetime of the submission documents in webhook_db.webhook_data
+SUBMISSION_TTL_SECONDS = 2592000  # 30 days in seconds
+
+
+def ensure_indexes():
+    """
+    Creates the MongoDB indexes the service relies on. Safe to run again;
+    existing indexes are left unchanged.
+
+    Returns:
+        list: Names of the collections that were indexed.
+    """
+    from services.registry import registry
+    from services.jobs.job_queue import JobQueue
+    from services.jobs.dedup import SubmissionDedup
+    from services.ocr.ocr_cache import ocr_cache
+
+    db = registry.get('database')
+    done = []
+
+    db['webhook_data'].create_index({"created_at": 1}, expireAfterSeconds=SUBMISSION_TTL_SECONDS)
+    SubmissionDedup(db['webhook_data']).ensure_indexes()
+    done.append('webhook_data')
+
+    JobQueue(db['webhook_jobs'], handler=None).ensure_indexes()
+    done.append('webhook_jobs')
+
+    if Config.OCR_CACHE_PERSISTENT:
+        ocr_cache.ensure_indexes()
+        done.append(Config.OCR_CACHE_COLLECTION)
+
+    if Config.LEDGER_BACKEND == 'mongo':
+        registry.get('ledger').ensure_indexes()
+        done.append(Config.LEDGER_COLLECTION)
+
+    return done
+
+
+def import_time(module='app', budget_ms=None, top=10):
+    """
+    Measures how long a fresh interpreter takes to import a module, and lists
+    the slowest imports, using `python -X importtime`.
+
+    Args:
+        module (str): Module to import.
+        budget_ms (int): Allowed import time, Config.IMPORT_TIME_BUDGET_MS by default.
+        top (int): Number of slowest modules to report.
+
+    Returns:
+        dict: total_ms, budget_ms, within_budget and the slowest modules as (name, cumulative ms).
+    """
+    budget_ms = Config.IMPORT_TIME_BUDGET_MS if budget_ms is None else budget_ms
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env={**os.environ, 'WARM_UP': 'false'},
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    timings = []
+    for line in completed.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)', line)
+        if match:
+            timings.append((match.group(3), int(match.group(1)) / 1000, len(match.group(2))))
+
+    total_ms = sum(cumulative for _, cumulative, depth in timings if depth == 1)
+    slowest = sorted(((name, round(ms, 1)) for name, ms, _ in timings if name != module), key=lambda t: -t[1])[:top]
+    return {
+        'total_ms': round(total_ms, 1),
+        'budget_ms': budget_ms,
+        'within_budget': total_ms <= budget_ms,
+        'slowest': slowest,
+    }
+
+
+def revalidate(hours=72, limit=None, workers=None, confirm=True):
+    """
+    Re-validates the submissions of the last `hours` hours whose PR card or
+    e-transfer check failed, e.g. because the payment arrived after the form.
+    The submissions that now pass get their confirmation email unless
+    `confirm` is False.
+
+    Returns:
+        dict: The report of services.validation.revalidate.revalidate.
+    """
+    from services.registry import registry
+    from services.email.email_service import send_confirmation
+    from services.validation.revalidate import revalidate as revalidate_batch
+
+    app, mail = register_mail_services()
+    collection = registry.get('webhook_collection')
+
+    def send(submission):
+        with app.app_context():
+            send_confirmation(submission, mail, collection, registry.get('outbox'))
+
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    return revalidate_batch(collection, since, limit=limit, workers=workers, confirm=send if confirm else None)
+
+
+def register_mail_services():
+    """
+    Registers the outbox and the reconciler, so payments ingested by a command
+    (listen-mailbox, revalidate) confirm the submissions waiting for them.
+
+    Returns:
+        tuple: The Flask app holding the mail settings and its Flask-Mail instance.
+    """
+    from flask import Flask
+    from services.registry import registry
+    from services.email.mail_app import configure_mail
+    from services.email.outbox import create_outbox
+    from services.validation.reconciliation import create_reconciler
+
+    # A bare app for the mail settings: importing app.py would start the web
+    # worker's background services (job queue) in this process
+    app = Flask(__name__)
+    mail = configure_mail(app)
+    registry.register('outbox', lambda: create_outbox(app, mail, registry.get('webhook_collection')))
+    registry.register('reconciler', lambda: create_reconciler(app, mail))
+    return app, mail
+
+
+def listen_mailbox():
+    """
+    Streams the Interac emails into the ledger until interrupted.
+    """
+    import threading
+    from services.registry import registry
+    from services.email.mailbox_listener import MailboxListener
+
+    # Payments added by this process are reconciled by IMAP.add_payments; the
+    # sweep picks up the ones web workers added through the mailbox fallback
+    register_mail_services()
+    reconciler = registry.get('reconciler')
+    stopping = threading.Event()
+
+    def sweep():
+        while not stopping.wait(Config.RECONCILE_SWEEP_SECONDS):
+            try:
+                reconciler.sweep()
+            except Exception as e:
+                logging.error(f"Reconciliation sweep failed: {e}")
+
+    if reconciler is not None:
+        threading.Thread(target=sweep, name='reconcile-sweep', daemon=True).start()
+
+    listener = MailboxListener(idle_seconds=Config.IMAP_IDLE_SECONDS, backoff_max=Config.IMAP_LISTENER_BACKOFF_MAX)
+    try:
+        listener.run()
+    except KeyboardInterrupt:
+        listener.stop()
+    finally:
+        stopping.set()
+
+
+def compact_ledger(hot_days=None):
+    """
+    Moves the used and old payments of the S3 ledger to its monthly archive.
+
+    Returns:
+        dict: Rows archived and rows left, or the reason nothing was done.
+    """
+    from services.registry import registry
+
+    if Config.LEDGER_BACKEND != 's3':
+        # Mongo and SQLite read only the unused rows through their 'Used' index
+        return {'skipped': f"The {Config.LEDGER_BACKEND} ledger does not need compaction."}
+    return registry.get('ledger').compact(hot_days or Config.LEDGER_HOT_DAYS)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Maintenance commands of the CFSO webhook service.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('ensure-indexes', help='Create the MongoDB indexes (run once per deployment).')
+
+    import_time_parser = commands.add_parser('import-time', help='Check the worker import time against the budget.')
+    import_time_parser.add_argument('--module', default='app')
+    import_time_parser.add_argument('--budget-ms', type=int, default=None)
+
+    revalidate_parser = commands.add_parser('revalidate', help='Re-check failed submissions against the mailbox and ledger.')
+    revalidate_parser.add_argument('--hours', type=int, default=72, help='Window of submissions to re-check.')
+    revalidate_parser.add_argument('--limit', type=int, default=None)
+    revalidate_parser.add_argument('--workers', type=int, default=None)
+    revalidate_parser.add_argument('--no-confirm', action='store_true', help='Do not email the submissions that now pass.')
+
+    commands.add_parser('listen-mailbox', help='Keep the ledger current from the Interac mailbox (long-running).')
+
+    compact_parser = commands.add_parser('compact-ledger', help='Move used and old payments out of the S3 ledger.')
+    compact_parser.add_argument('--hot-days', type=int, default=None, help='Age of the unused payments kept in the ledger.')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'ensure-indexes':
+        print({'indexed': ensure_indexes()})
+        return 0
+
+    if args.command == 'import-time':
+        result = import_time(args.module, args.budget_ms)
+        for name, ms in result['slowest']:
+            print(f"{ms:>10.1f} ms  {name}")
+        print(f"import {args.module}: {result['total_ms']} ms (budget {result['budget_ms']} ms)")
+        return 0 if result['within_budget'] else 1
+
+    if args.command == 'revalidate':
+        report = revalidate(args.hours, args.limit, args.workers, confirm=not args.no_confirm)
+        print(report)
+        return 1 if report['errors'] else 0
+
+    if args.command == 'listen-mailbox':
+        listen_mailbox()
+        return 0
+
+    if args.command == 'compact-ledger':
+        print(compact_ledger(args.hot_days))
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,5 +3,6 @@
 
 from .validate import validate_route
 from .getdata import getdata_route
+from .jobs import job_status_route
 
-__all__ = ["validate_route", "getdata_route"]
\ No newline at end of file
+__all__ = ["validate_route", "getdata_route", "job_status_route"]
\ No newline at end of file
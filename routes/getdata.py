@@ -1,9 +1,10 @@
 import json
 from flask import request, jsonify
 from services.database.mongodb import save_to_mongodb
+from config import Config
 
 
-def getdata_route(collection):
+def getdata_route(collection, writer=None):
     try:
         # Extract rawRequest if it exists
         raw_request = request.form.get('rawRequest')
@@ -13,7 +14,7 @@ def getdata_route(collection):
             data = request.get_json(force=True)
 
         # Save to MongoDB
-        save_result = save_to_mongodb(collection, data)
+        save_result = save_to_mongodb(collection, data, writer, Config.GETDATA_WRITE_CONCERN)
         return jsonify(save_result), 201
 
     except Exception as e:
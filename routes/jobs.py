@@ -0,0 +1,12 @@
+from flask import jsonify
+
+
+def job_status_route(job_queue, job_id):
+    if job_queue is None:
+        return jsonify({'error': 'Asynchronous job mode is not enabled'}), 404
+
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+
+    return jsonify(job), 200
@@ -0,0 +1,7 @@
+from flask import Response
+from services import metrics
+
+
+def metrics_route():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
@@ -1,14 +1,11 @@
 from flask import request, jsonify
-from services.jotForm.request_processor import process_request_data
-from services.validation.pr_card_validator import validate_pr_card
-from services.validation.e_transfer_validator import validate_e_transfer
-from services.email.email_service import send_email, create_email_draft
-from services.database.mongodb import save_to_mongodb
+from config import Config
 
 import json
 
 
-def validate_route(mail, collection):
+def validate_route(mail, collection, job_queue=None, outbox=None, writer=None, dedup=None):
+    claim = None
     try:
         # Extract query parameters
         pr_amount = request.args.get('pr_amount')
@@ -21,40 +18,38 @@ def validate_route(mail, collection):
         else:
             data = request.get_json(force=True)
 
-        # Process request data
-        res = process_request_data(data, pr_amount, normal_amount)
-
-
-        # Validate PR card
-        pr_validation_result = validate_pr_card(
-            res.get('PR_Status'),
-            res.get('PR_Card_Number'),
-            res.get('Full_Name'),
-            res.get('PR_File_Upload_URLs'),
-        )
-        res.update(pr_validation_result)
-
-
-        # Validate e-transfer
-        e_transfer_validation_result = validate_e_transfer(
-            res.get('Payer_Full_Name'),
-            res.get('Amount_of_Payment'),
-            res.get('E_Transfer_File_Upload_URLs'),
-        )
-        res.update(e_transfer_validation_result)
-
-        # Send email
-        send_email(res.get('PR_Status'), mail, res)
-
-        # Generate a professional email draft in Sponsor email to inform a customer about issues with their course registration submitted
-        if res['PR_Success'] == False or res['E_Transfer_Success'] == False:
-            create_email_draft(res)
-
-        # print(res) #TEST
-
-        # Save to MongoDB
-        save_result = save_to_mongodb(collection, res)
+        async_mode = request.args.get('async', str(Config.ASYNC_WEBHOOK)).lower() == 'true'
+        async_mode = async_mode and job_queue is not None
+
+        # Re-delivered webhooks and double submissions get the first result back
+        if dedup is not None:
+            from services.jobs.dedup import submission_key
+            key = submission_key(data, request.form.get('submissionID'))
+            document_id, duplicate = dedup.claim(key, local=not async_mode)
+            if duplicate is not None:
+                return jsonify(duplicate), 200 if duplicate['status'] == 'done' else 202
+            claim = (document_id, key)
+
+        # Asynchronous mode: persist the submission as a job and answer right away
+        if async_mode:
+            job = {
+                'data': json.dumps(data),
+                'pr_amount': pr_amount,
+                'normal_amount': normal_amount,
+            }
+            if claim is not None:
+                job['dedup_id'], job['dedup_key'] = str(claim[0]), claim[1]
+            job_id = job_queue.enqueue(job)
+            return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+
+        # Process, validate, notify and save the submission. Imported here because the
+        # pipeline pulls in pandas, boto3 and openai, which workers should not load at start.
+        from services.validation.pipeline import process_submission
+        save_result = process_submission(data, pr_amount, normal_amount, mail, collection, outbox, writer, dedup, claim)
         return jsonify(save_result), 201
 
     except Exception as e:
+        if claim is not None:
+            # Let the next delivery process the submission again
+            dedup.release(*claim)
         return jsonify({"error": str(e)}), 400
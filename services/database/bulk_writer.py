@@ -0,0 +1,156 @@
+import atexit
+import logging
+import threading
+import time
+import bson
+from bson import ObjectId
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+
+def parse_write_concern(value):
+    """
+    Builds a WriteConcern from a setting such as '0', '1' or 'majority'.
+
+    :param value (str): The setting; empty keeps the collection's own write concern.
+    :return: WriteConcern or None.
+    """
+    if not value:
+        return None
+    return WriteConcern(w=int(value) if value.isdigit() else value)
+
+
+def with_write_concern(collection, value):
+    write_concern = parse_write_concern(value)
+    return collection if write_concern is None else collection.with_options(write_concern=write_concern)
+
+
+class BulkWriter:
+    """
+    Buffers documents in process and writes them with insert_many(ordered=False).
+
+    A batch is written when max_docs documents are buffered or the oldest one has
+    waited max_delay seconds. Documents get their _id on the client when they are
+    buffered, so callers know the id before the write happens and a batch retried
+    after a connection error cannot create duplicates. A batch that still fails
+    after retry_attempts is put back at the front of the buffer and retried by
+    the next flush, never dropped; the buffered documents are only durable once
+    written, whatever the write concern. close(), registered with atexit, writes
+    what is still buffered and raises if that fails.
+
+    Methods:
+        insert(document): Buffers a document and returns its _id.
+        flush(): Writes the buffered documents now.
+        close(): Stops the flusher thread after a final flush.
+    """
+    def __init__(self, collection, max_docs=100, max_delay=0.5, write_concern=None, retry_attempts=3):
+        """
+        Args:
+            collection (Collection): Target MongoDB collection.
+            max_docs (int): Buffer size that triggers a write.
+            max_delay (float): Seconds a document may wait in the buffer.
+            write_concern (str): '0', '1', 'majority'... or None for the collection's default.
+            retry_attempts (int): Tries of a batch that failed with a connection error.
+        """
+        self.collection = with_write_concern(collection, write_concern)
+        self.max_docs = max_docs
+        self.max_delay = max_delay
+        self.retry_attempts = retry_attempts
+        self._buffer = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._failures = 0
+        self._thread = threading.Thread(target=self._run, name='bulk-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def insert(self, document):
+        """
+        Args:
+            document (dict): The document to write; an _id is added if missing.
+
+        Returns:
+            ObjectId: The document id.
+
+        Raises:
+            InvalidDocument: If the document cannot be encoded, instead of failing its whole batch later.
+        """
+        document.setdefault('_id', ObjectId())
+        bson.encode(document)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('BulkWriter is closed')
+            self._buffer.append(document)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._buffer) >= self.max_docs
+        if full:
+            self._wakeup.set()
+        return document['_id']
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer, self._oldest = self._buffer, [], None
+            if batch:
+                self._write(batch)
+
+    def close(self, timeout=30):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while not self._closed:
+            with self._lock:
+                waited = time.monotonic() - self._oldest if self._oldest is not None else 0
+                due = len(self._buffer) >= self.max_docs or (self._oldest is not None and waited >= self.max_delay)
+            if due:
+                try:
+                    self.flush()
+                    self._failures = 0
+                except Exception as e:
+                    logging.error(f"Bulk write failed: {e}")
+                    # Back off while MongoDB is unreachable; the batch is still buffered
+                    self._failures += 1
+                    self._wakeup.wait(min(2 ** self._failures, 60))
+                    self._wakeup.clear()
+                continue
+            self._wakeup.wait(self.max_delay - waited if self._oldest is not None else self.max_delay)
+            self._wakeup.clear()
+
+    def _write(self, batch):
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                self.collection.insert_many(batch, ordered=False)
+                return
+            except BulkWriteError as e:
+                # Duplicate ids come from a retried batch that was partly written already
+                errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != 11000]
+                if errors:
+                    logging.error(f"Bulk write rejected {len(errors)} of {len(batch)} documents: {errors[0].get('errmsg')}")
+                return
+            except ConnectionFailure as e:
+                if attempt == self.retry_attempts:
+                    self._requeue(batch)
+                    logging.error(f"Bulk write of {len(batch)} documents failed, kept for the next flush: {e}")
+                    raise
+                logging.warning(f"Bulk write failed ({e}), retrying.")
+                time.sleep(attempt)
+            except Exception as e:
+                # Auth, write concern timeout, quota...: the documents were accepted, keep them
+                self._requeue(batch)
+                logging.error(f"Bulk write of {len(batch)} documents failed, kept for the next flush: {e}")
+                raise
+
+    def _requeue(self, batch):
+        with self._lock:
+            self._buffer = batch + self._buffer
+            self._oldest = time.monotonic()
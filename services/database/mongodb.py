@@ -1,18 +1,52 @@
 from datetime import datetime, timezone
+from pymongo import MongoClient
+from services.database.bulk_writer import with_write_concern
+from services import metrics
+from config import Config
 
-def save_to_mongodb(collection, data):
+_client = None
+
+
+def get_database():
+    """
+    Returns the webhook_db database, sharing one MongoClient per process.
+
+    :return: MongoDB database instance.
+    """
+    global _client
+    if _client is None:
+        _client = MongoClient(
+            f'mongodb+srv://{Config.MONGO_USERNAME}:{Config.MONGO_PASSWORD}@{Config.MONGO_CLUSTER}/?retryWrites=true&w=majority&appName=MangoCore'
+        )
+    return _client['webhook_db']
+
+
+def save_to_mongodb(collection, data, writer=None, write_concern=None):
     """
     Saves data to MongoDB.
 
+    With a BulkWriter the document is only buffered and written with the next
+    batch; its id is generated client-side, so it is returned right away.
+
     :param collection: MongoDB collection instance.
     :param data: Data dictionary to store.
+    :param writer: BulkWriter to buffer the document in, or None to insert it now.
+    :param write_concern: Write concern of a direct insert ('0', '1', 'majority'), None for the default.
     :return: MongoDB insertion result.
     """
 
     # Add a timestamp for TTL
     data['created_at'] = datetime.now(timezone.utc)  # Use timezone-aware UTC datetime
 
-    result = collection.insert_one(data)
+    if writer is not None:
+        return {
+            'success': True,
+            'message': 'Data queued for MongoDB',
+            'document_id': str(writer.insert(data))
+        }
+
+    with metrics.call('mongo_insert'):
+        result = with_write_concern(collection, write_concern).insert_one(data)
     return {
         'success': True,
         'message': 'Data saved to MongoDB',
@@ -0,0 +1,175 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from services.openai.openai import OpenAIService
+from services import metrics
+from config import Config
+
+FALLBACK_TEMPLATE = """We reviewed the course registration form you submitted to the Community Family Services of Ontario (CFSO) and found the following issue(s):
+{issues}
+
+Please review your form and resubmit it if needed. If you have any questions or concerns, simply reply to this email and we will be happy to help.
+
+Best regards,
+Jannelle
+Community Family Services of Ontario (CFSO)
+jleung@cfso.care"""
+
+PROMPT = """
+        Generate a professional email message to inform a customer about issues with their course registration submitted to the Community Family Services of Ontario (CFSO).
+
+        Use the following details:
+        {issues}
+
+        Include the following:
+        1. A short explanation of the issues.
+        2. A request for the customer to review and resubmit their form if needed.
+        3. An offer to assist further if they have any questions or concerns.
+
+        Sender Information:
+        1. Jannelle
+        2. Community Family Services of Ontario (CFSO)
+        3. jleung@cfso.care
+        Ensure the output is clear, concise, and customer-friendly. Output only the email content message without "subject" section.
+        Keep the placeholders in double square brackets, such as [[payer]] or [[number1]], exactly as written; they are replaced with this customer's details.
+        Do not start with a greeting line, it is added separately.
+        """
+
+# Generated bodies by error combination, with placeholders for the submission's
+# names and numbers; the greeting with the customer name is added per draft
+_bodies = OrderedDict()
+_in_flight = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='draft-writer')
+
+
+def draft_issues(res):
+    """
+    Lists the failed validations of a submission.
+
+    Returns:
+        list: (label, error message) pairs, in the order PR card, e-transfer.
+    """
+    issues = []
+    if res.get('PR_Success') == False:
+        issues.append(('PR Card Validation', res.get('PR_Error')))
+    if res.get('E_Transfer_Success') == False:
+        issues.append(('E-Transfer Validation', res.get('E_Transfer_Error')))
+    return issues
+
+
+_PLACEHOLDER = re.compile(r'\[\[(\w+)\]\]')
+
+
+def error_type(message, names, values):
+    """
+    Reduces an error message to its type by replacing the names and the numbers
+    in it with placeholders, so submissions with the same problem share a draft.
+
+    Args:
+        message (str): The error message.
+        names (dict): Placeholder -> name to mask, e.g. {'payer': 'john doe'}.
+        values (dict): Receives placeholder -> masked value; numbers are
+            numbered after the ones already in it.
+
+    Returns:
+        str: The message with [[placeholder]] in place of each value.
+    """
+    message = str(message)
+    for placeholder, name in names.items():
+        if name:
+            pattern = re.compile(re.escape(name), flags=re.IGNORECASE)
+            if pattern.search(message):
+                values.setdefault(placeholder, name)
+                message = pattern.sub(f'[[{placeholder}]]', message)
+
+    def number(match):
+        placeholder = f"number{sum(1 for key in values if key.startswith('number')) + 1}"
+        values[placeholder] = match.group(0)
+        return f'[[{placeholder}]]'
+
+    return re.sub(r'\d[\d,.]*\d|\d', number, message)
+
+
+def fill_placeholders(body, values):
+    """
+    Puts the submission's values in a cached body.
+
+    Returns:
+        str: The body, or None if it has a placeholder the submission has no value for.
+    """
+    body = _PLACEHOLDER.sub(lambda match: values.get(match.group(1), match.group(0)), body)
+    return None if _PLACEHOLDER.search(body) else body
+
+
+def compose_draft_body(res):
+    """
+    Returns the body of the draft for a failed submission.
+
+    Bodies are generated once per error combination and cached with
+    placeholders, which are filled with this submission's values. A combination
+    seen for the first time waits at most Config.OPENAI_DRAFT_BUDGET_SECONDS for
+    OpenAI; past that budget, or if the call fails, the fallback template is used
+    and the generation keeps running in the background to fill the cache.
+
+    Args:
+        res (dict): The processed submission.
+
+    Returns:
+        str: The draft body, starting with the greeting.
+    """
+    issues = draft_issues(res)
+    names = {'customer': res.get('Full_Name'), 'payer': res.get('Payer_Full_Name')}
+    values = {}
+    key = tuple((label, error_type(message, names, values)) for label, message in issues)
+
+    template = _cached(key)
+    metrics.cache_event('draft', 'miss' if template is None else 'hit')
+    if template is None:
+        future = _generation(key)
+        try:
+            with metrics.call('openai_draft'):
+                template = future.result(timeout=Config.OPENAI_DRAFT_BUDGET_SECONDS)
+        except Exception as e:
+            logging.warning(f"Draft generation not used ({type(e).__name__}: {e}), using the template.")
+
+    body = fill_placeholders(template, values) if template is not None else None
+    if body is None:
+        body = FALLBACK_TEMPLATE.format(issues='\n'.join(f"- {label}: {message}" for label, message in issues))
+
+    return f"Dear {res.get('Full_Name')},\n\n{body}"
+
+
+def _cached(key):
+    with _lock:
+        body = _bodies.get(key)
+        if body is not None:
+            _bodies.move_to_end(key)
+        return body
+
+
+def _generation(key):
+    # One OpenAI call per combination, shared by concurrent submissions
+    with _lock:
+        future = _in_flight.get(key)
+        if future is None:
+            future = _executor.submit(_generate, key)
+            _in_flight[key] = future
+        return future
+
+
+def _generate(key):
+    try:
+        issues = '\n        '.join(f"{label}: False - Error: {message}" for label, message in key)
+        body = OpenAIService.generate_completion(PROMPT.format(issues=issues), max_tokens=Config.OPENAI_DRAFT_MAX_TOKENS)
+        with _lock:
+            _bodies[key] = body.strip()
+            _bodies.move_to_end(key)
+            while len(_bodies) > Config.OPENAI_DRAFT_CACHE_SIZE:
+                _bodies.popitem(last=False)
+        return body.strip()
+    finally:
+        with _lock:
+            _in_flight.pop(key, None)
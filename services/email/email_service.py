@@ -1,30 +1,75 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
 from flask_mail import Message
-from services.openai.openai import OpenAIService
+from services.email.draft_writer import compose_draft_body
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import imaplib
+from services.email.imap_pool import imap_pool, DraftAppender
+from services.jobs.dedup import SAVED
+from services import metrics
 from config import Config
 
 error_notification_email_address = Config.ERROR_NOTIFICATION_EMAIL_RECIEVER
 
-def send_email(pr_status, mail, res):
+draft_appender = DraftAppender(imap_pool, Config.CONFIRMATION_SENDER_EMAIL, Config.CONFIRMATION_SENDER_EMAIL_APP_PASSWORD)
+_draft_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='draft')
+
+def send_email(pr_status, mail, res, outbox=None):
     """
     Sends an email and updates the response dictionary with the status.
 
+    With an outbox the message is only queued: res gets a pre-generated _id and
+    Email_Status 'queued', and the outbox writes the delivery status onto the
+    saved document once the message has been sent.
+
     :param pr_status: Boolean indicating PR status.
     :param email_service: Email service to create the email.
     :param mail: Mail sending service.
     :param res: Response dictionary to update with email status.
+    :param outbox: EmailOutbox to send through, or None to send inline.
     """
     msg = create_email_message(pr_status, res)
+    if outbox is not None:
+        res.setdefault('_id', ObjectId())
+        outbox.enqueue(msg, res['_id'])
+        res['Email_Send'] = None
+        res['Email_Status'] = 'queued'
+        return
+
     try:
-        mail.send(msg)
+        with metrics.call('smtp_send'):
+            mail.send(msg)
         res['Email_Send'] = True
     except Exception as e:
         res['Email_Send'] = False
         res['Email_Error_Message'] = str(e)
 
 
+def send_confirmation(submission, mail, collection, outbox=None):
+    """
+    Sends the email of a saved submission whose checks passed later (see
+    services/validation/reconciliation.py) and records its status on the document.
+
+    Without an outbox, Flask-Mail needs an application context.
+
+    :param submission: The saved submission document, with its updated results.
+    :param mail: Flask-Mail instance.
+    :param collection: MongoDB collection of the submission.
+    :param outbox: EmailOutbox to queue the message in, or None to send it now.
+    """
+    res = dict(submission)
+    if outbox is not None:
+        # Recorded before the outbox can write the delivery status
+        collection.update_one({'_id': res['_id']}, {'$set': {'Email_Send': None, 'Email_Status': 'queued'}})
+        send_email(res.get('PR_Status'), mail, res, outbox)
+        return
+
+    send_email(res.get('PR_Status'), mail, res)
+    fields = {field: res[field] for field in ('Email_Send', 'Email_Error_Message') if field in res}
+    collection.update_one({'_id': res['_id']}, {'$set': fields})
+
 
 def create_email_message(pr_status, res):
     """
@@ -90,36 +135,8 @@ def create_email_message(pr_status, res):
 
 def create_email_draft(res):
     try:
-        # Check PR Card validation and create the corresponding message only if PR_Success is False
-        pr_card_validation = ""
-        if res['PR_Success'] == False:
-            pr_card_validation = f"PR Card Validation: {res['PR_Success']} - Error: {res['PR_Error']}"
-
-        # Check E-Transfer validation and create the corresponding message only if E_Transfer_Success is False
-        e_transfer_validation = ""
-        if res['E_Transfer_Success'] == False:
-            e_transfer_validation = f"E-Transfer Validation: {res['E_Transfer_Success']} - Error: {res['E_Transfer_Error']}"
-
-        prompt = f"""
-        Generate a professional email message to inform a customer about issues with their course registration submitted to the Community Family Services of Ontario (CFSO). 
-
-        Use the following details:
-        - Customer Name: {res['Full_Name']}
-        {pr_card_validation}
-        {e_transfer_validation}
-
-        Include the following:
-        1. A polite introduction addressing the customer by name.
-        2. A request for the customer to review and resubmit their form if needed.
-        3. An offer to assist further if they have any questions or concerns.
-
-        Sender Information:
-        1. Jannelle
-        2. Community Family Services of Ontario (CFSO)
-        3. jleung@cfso.care
-        Ensure the output is clear, concise, and customer-friendly. Output only the email content message without "subject" section.
-        """
-        body = OpenAIService.generate_completion(prompt)
+        # Generated once per error combination, with a template fallback (see services/email/draft_writer.py)
+        body = compose_draft_body(res)
         subject = "Action Required: Issue with Your Course Registration Form"
         recipient = res['Email']
 
@@ -133,6 +150,42 @@ def create_email_draft(res):
         res['Email_draft_Error_Message'] = str(e)
 
 
+def create_email_draft_later(res, collection):
+    """
+    Creates the customer draft in the background instead of on the request path.
+
+    res gets a pre-generated _id and Email_draft_Status 'queued'; the outcome is
+    written onto the saved submission document once the draft was created.
+
+    :param res: Response dictionary of the submission.
+    :param collection: MongoDB collection the submission is saved to.
+    """
+    res.setdefault('_id', ObjectId())
+    res['Email_draft'] = None
+    res['Email_draft_Status'] = 'queued'
+    _draft_executor.submit(_create_and_record_draft, dict(res), collection)
+
+
+def _create_and_record_draft(res, collection, attempts=30, delay=2):
+    create_email_draft(res)
+    fields = {
+        'Email_draft': res['Email_draft'],
+        'Email_draft_Status': 'created' if res['Email_draft'] else 'failed',
+    }
+    if 'Email_draft_Error_Message' in res:
+        fields['Email_draft_Error_Message'] = res['Email_draft_Error_Message']
+
+    # The submission may not be saved yet
+    for _ in range(attempts):
+        try:
+            if collection.update_one({'_id': res['_id'], **SAVED}, {'$set': fields}).matched_count:
+                return
+        except Exception as e:
+            logging.warning(f"Could not record draft status for {res['_id']}: {e}")
+        time.sleep(delay)
+    logging.error(f"Dropped draft status for {res['_id']}: {fields['Email_draft_Status']}")
+
+
 def create_draft(body, subject, recipient):
     """
     Creates a draft email in the Sponsor Email system when an error is found in the form submission.
@@ -156,24 +209,9 @@ def create_draft(body, subject, recipient):
     mime_msg.attach(MIMEText(body, 'plain'))
  
     raw_message = mime_msg.as_bytes()
- 
-    try:
-        mailbox = imaplib.IMAP4_SSL('imap.gmail.com',)
-        mailbox.login(Config.CONFIRMATION_SENDER_EMAIL, Config.CONFIRMATION_SENDER_EMAIL_APP_PASSWORD)
-        mailbox.select('"[Gmail]/Drafts"')
-        res = mailbox.append(
-            '"[Gmail]/Drafts"',
-            '\\Draft',
-            None,
-            raw_message
-        )
-        mailbox.logout()
-        print({"Email_draft_status" :True ,'message': res})
- 
-        return True 
-   
-    except Exception as e:
-        print({"Email_draft_status" :False,'error': str(e)})
-        return False
-    
 
+    # Appended over a pooled IMAP session, together with drafts of concurrent submissions
+    with metrics.call('imap_draft_append'):
+        created = draft_appender.append(raw_message)
+    print({"Email_draft_status": created})
+    return created
@@ -1,19 +1,33 @@
-from imap_tools import MailBox, AND, NOT
+from imap_tools import AND, NOT, OR, UidRange
 import logging
+import json
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import re
-import pandas as pd
-from io import StringIO
-from thefuzz import fuzz
-from thefuzz import process
-from services.database.aws_s3 import AWSService
+from services.ledger.ledger_store import LedgerNotFound
+from services.registry import registry
+from services.email.imap_pool import imap_pool
+from services.email.partial_fetch import fetch_partial
+from services import metrics
 from config import Config
 
+# The three lines of an Interac notification, found in one pass over the text. The
+# payer name is captured in a lookahead, so a value that runs into the next line
+# gives the same fields as three separate searches.
+PAYMENT_FIELDS = re.compile(r"Sent From:(?=\s*(.*))|Amount: (\$[\d,]+\.\d{2})|Reference Number: (\w+)")
+
+# (UIDVALIDITY, UID) -> parsed ledger row, or None for an email without payment details
+_parsed = OrderedDict()
+_parsed_lock = threading.Lock()
+_MISSING = object()
+
 class IMAP():
     
-    aws_service = AWSService()
     bucket_name = Config.S3_BUCKET_NAME
     file_key = Config.S3_FILE_KEY
+    cursor_key = Config.IMAP_CURSOR_KEY
+    claim_attempts = 3
 
     sender_email = Config.INTERAC_EMAIL
     email_user = Config.SPONSOR_EMAIL_USER
@@ -32,15 +46,18 @@ class IMAP():
             tuple: A tuple containing Payer name (str), Amount (str), and Reference Number (str).
                 If any information is not found, the respective value will be None.
         """
-        sent_from = re.search(r"Sent From:\s*(.*)", data, re.MULTILINE)
-        sent_from = sent_from.group(1).strip() if sent_from else None
+        sent_from = amount = reference_number = None
+        for match in PAYMENT_FIELDS.finditer(data):
+            found_sent_from, found_amount, found_reference = match.groups()
+            if sent_from is None and found_sent_from is not None:
+                sent_from = found_sent_from.strip()
+            elif amount is None and found_amount is not None:
+                amount = found_amount
+            elif reference_number is None and found_reference is not None:
+                reference_number = found_reference
+            if sent_from is not None and amount is not None and reference_number is not None:
+                break
 
-        amount = re.search(r"Amount: (\$[\d,]+\.\d{2})", data)
-        amount = amount.group(1) if amount else None
-
-        reference_number = re.search(r"Reference Number: (\w+)", data)
-        reference_number = reference_number.group(1) if reference_number else None
-        
         return sent_from, amount, reference_number
 
     @classmethod
@@ -88,7 +105,7 @@ class IMAP():
             1. How long should the code check the mailbox(Default 14 days).
 
         Returns:
-            1. A JSON file containing success and error fields, e.g., { 'success': False, 'error': 'description of the error }.
+            1. A list of payment rows found in the mailbox, or None if an error occurred.
 
         Main function to process emails:
         - Loads credentials
@@ -101,24 +118,259 @@ class IMAP():
         Logs errors if any issues occur during the execution.
         """
         try:
-            with MailBox('imap.gmail.com').login(clf.email_user, clf.email_password) as mailbox:
-                # logging.info("Successfully logged in to the mailbox.")
+            result, _, _ = clf.fetch_new_payments(days)
+            return result
+
+        except Exception as e:
+            logging.error("An error occurred: {}".format(e))
+
+    @classmethod
+    def parse_payment(clf, msg):
+        """
+        Builds a ledger row from an Interac notification email.
+
+        Args:
+            msg (MailMessage): The fetched email.
+
+        Returns:
+            dict: The ledger row, or None if the email does not contain a payer and an amount.
+        """
+        row = clf.payment_row(msg.text, msg.date_str)
+        if row is None:
+            logging.warning(f"Skipped email {msg.uid}: payment details not found.")
+        return row
+
+    @classmethod
+    def payment_row(clf, text, date):
+        """
+        Builds a ledger row from the text of an Interac notification.
+
+        Returns:
+            dict: The ledger row, or None if the text does not contain a payer and an amount.
+        """
+        sent_from, amount, reference_number = clf.test_match(text)
+        if sent_from is None or amount is None:
+            return None
+
+        sent_from = sent_from.lower()
+        amount = clf.clean_amount(amount)
+        logging.info(f"Processed email from {sent_from} with amount {amount} and reference number {reference_number}")
+        return {"Reference" : reference_number , "Sent_From":sent_from, "Date":date, "Amount":amount, "Used":False}
+
+    @classmethod
+    def fetch_new_payments(clf, days=44, cursor=None):
+        """
+        Fetches Interac emails from the mailbox.
+
+        With a valid cursor only emails with a UID above cursor['last_uid'] are fetched.
+        Without a cursor, or when the mailbox UIDVALIDITY changed since the cursor was
+        saved, it falls back to the emails received in the last `days` days.
+
+        Args:
+            days (int): Size of the date window used without a valid cursor.
+            cursor (dict): {'uidvalidity': int, 'last_uid': int} from a previous call, or None.
+
+        Returns:
+            tuple: (list of ledger rows, updated cursor, {(uidvalidity, uid): row}
+            of the parsed emails, to remember once the rows are saved)
+        """
+        def fetch(mailbox):
+            status = mailbox.folder.status('INBOX', ['UIDVALIDITY', 'UIDNEXT'])
+            uidvalidity = status['UIDVALIDITY']
+
+            if cursor and cursor.get('uidvalidity') == uidvalidity:
+                last_uid = cursor['last_uid']
+                criteria = AND(from_=clf.sender_email, uid=UidRange(last_uid + 1, '*'))
+            else:
+                last_uid = 0
                 last_week_date = (datetime.now() - timedelta(days=days)).date()
-                messages = mailbox.fetch(AND(from_=clf.sender_email, date_gte=last_week_date))
+                criteria = AND(from_=clf.sender_email, date_gte=last_week_date)
+
+            # Every message below UIDNEXT existed when the search ran, so it is covered by this sync
+            new_last_uid = max(last_uid, status['UIDNEXT'] - 1)
 
-                result = []
-                for msg in messages:
-                    sent_from, amount, reference_number = clf.test_match(msg.text)
-                    sent_from = sent_from.lower()
-                    amount = clf.clean_amount(amount)
-                    date = msg.date_str
-                    result.append({"Reference" : reference_number , "Sent_From":sent_from, "Date":date, "Amount":amount, "Used":False})
-                    logging.info(f"Processed email from {sent_from} with amount {amount} and reference number {reference_number}")
+            result, parsed = [], {}
+            for msg in mailbox.fetch(criteria):
+                uid = int(msg.uid)
+                # A "N:*" range always returns the newest message, even when it is below N
+                if uid <= last_uid:
+                    continue
+                new_last_uid = max(new_last_uid, uid)
+                metrics.IMAP_FETCHED_BYTES.labels('full').inc(msg.size_rfc822)
 
-                return result
+                row = clf.parse_payment(msg)
+                parsed[(uidvalidity, msg.uid)] = row
+                if row is not None:
+                    result.append(row)
 
+            return result, {'uidvalidity': uidvalidity, 'last_uid': new_last_uid}, parsed
+
+        # Pooled session, see services/email/imap_pool.py
+        with metrics.call('imap_fetch'):
+            return imap_pool.run(clf.email_user, clf.email_password, fetch)
+
+    @classmethod
+    def find_payer_payments(clf, name, days=21):
+        """
+        Looks up the Interac emails of one payer without downloading the mailbox.
+
+        The server searches the notifications of the last `days` days that contain
+        any word of the name (Gmail X-GM-RAW, or IMAP TEXT with
+        Config.IMAP_GMAIL_SEARCH off). Only the first Config.IMAP_PARTIAL_BYTES of
+        each candidate body are downloaded; an email whose payer, amount and
+        reference number are not all in that part is fetched whole. Emails whose
+        rows were saved are remembered by UID (see lookup_payer), so a repeated
+        lookup only downloads, and returns, the new candidates.
+
+        Args:
+            name (str): Payer name of the submission.
+            days (int): Age of the oldest email searched.
+
+        Returns:
+            tuple: (ledger rows of the candidate emails not seen before,
+            {(uidvalidity, uid): row} of the parsed emails, to remember once the rows are saved)
+        """
+        words = [word for word in re.findall(r"[a-z0-9]+", name.lower()) if len(word) > 1]
+        if not words:
+            return [], {}
+
+        def lookup(mailbox):
+            uidvalidity = mailbox.folder.status('INBOX', ['UIDVALIDITY'])['UIDVALIDITY']
+            if Config.IMAP_GMAIL_SEARCH:
+                criteria = f'X-GM-RAW "from:{clf.sender_email} newer_than:{days}d ({" OR ".join(words)})"'
+            else:
+                since = (datetime.now() - timedelta(days=days)).date()
+                text = OR(text=words) if len(words) > 1 else AND(text=words[0])
+                criteria = AND(text, from_=clf.sender_email, date_gte=since)
+
+            # Remembered emails were saved to the ledger when they were parsed
+            uids = mailbox.uids(criteria)
+            missing = [uid for uid in uids if clf._recall(uidvalidity, uid) is _MISSING]
+            metrics.cache_event('imap_parse', 'hit', len(uids) - len(missing))
+            metrics.cache_event('imap_parse', 'miss', len(missing))
+
+            fetched, received = fetch_partial(mailbox, missing, Config.IMAP_PARTIAL_BYTES)
+            metrics.IMAP_FETCHED_BYTES.labels('partial').inc(received)
+            rows, parsed = [], {}
+            for uid in missing:
+                text, date = fetched.get(uid, (None, ''))
+                row = clf.payment_row(text, date) if text else None
+                if row is None or row['Reference'] is None:
+                    # Payment lines beyond the partial body, or no text part
+                    for msg in mailbox.fetch(AND(uid=uid), mark_seen=False):
+                        metrics.IMAP_FETCHED_BYTES.labels('full').inc(msg.size_rfc822)
+                        row = clf.parse_payment(msg)
+                parsed[(uidvalidity, uid)] = row
+                if row is not None:
+                    rows.append(row)
+            return rows, parsed
+
+        with metrics.call('imap_lookup'):
+            return imap_pool.run(clf.email_user, clf.email_password, lookup)
+
+    @classmethod
+    def lookup_payer(clf, name, days=21):
+        """
+        Adds the payments of one payer found by find_payer_payments to the ledger.
+
+        Returns:
+            list: The rows added to the ledger, or None if the lookup failed.
+        """
+        try:
+            rows, parsed = clf.find_payer_payments(name, days)
+            added = clf.add_payments(rows)
         except Exception as e:
             logging.error("An error occurred: {}".format(e))
+            return None
+
+        if added is None:
+            logging.error("Payer lookup not saved: CSV file not found in S3.")
+            return None
+        # Only now that the rows are saved may later lookups skip these emails
+        clf._remember_all(parsed)
+        return added
+
+    @classmethod
+    def _recall(clf, uidvalidity, uid):
+        with _parsed_lock:
+            row = _parsed.get((uidvalidity, str(uid)), _MISSING)
+            if row is not _MISSING:
+                _parsed.move_to_end((uidvalidity, str(uid)))
+            return row
+
+    @classmethod
+    def _remember_all(clf, parsed):
+        with _parsed_lock:
+            for (uidvalidity, uid), row in parsed.items():
+                _parsed[(uidvalidity, str(uid))] = row
+                _parsed.move_to_end((uidvalidity, str(uid)))
+            while len(_parsed) > Config.IMAP_PARSE_CACHE_SIZE:
+                _parsed.popitem(last=False)
+
+    @classmethod
+    def s3_client(clf):
+        """
+        Returns the shared S3 client, created on first use.
+        """
+        return registry.get('aws').s3_client
+
+    @classmethod
+    def load_cursor(clf):
+        """
+        Loads the mailbox sync cursor stored in S3.
+
+        Returns:
+            dict: {'uidvalidity': int, 'last_uid': int}, or None if no cursor was saved yet.
+        """
+        try:
+            response = clf.s3_client().get_object(Bucket=clf.bucket_name, Key=clf.cursor_key)
+            return json.loads(response['Body'].read().decode('utf-8'))
+        except clf.s3_client().exceptions.NoSuchKey:
+            return None
+
+    @classmethod
+    def save_cursor(clf, cursor):
+        """
+        Stores the mailbox sync cursor in S3.
+        """
+        clf.s3_client().put_object(Bucket=clf.bucket_name, Key=clf.cursor_key, Body=json.dumps(cursor))
+
+    @classmethod
+    def sync_mailbox(clf, days=44):
+        """
+        Adds the Interac emails received since the last sync to the ledger.
+
+        The cursor is only advanced after the new rows were written, so a failed
+        sync is retried from the same point next time.
+
+        Args:
+            days (int): Size of the date window used when no valid cursor exists.
+
+        Returns:
+            list: The rows added to the ledger, or None if the sync failed.
+        """
+        try:
+            rows, cursor, parsed = clf.fetch_new_payments(days, clf.load_cursor())
+            added = clf.add_payments(rows)
+        except Exception as e:
+            logging.error("An error occurred: {}".format(e))
+            metrics.IMAP_SYNCS.labels('error').inc()
+            return None
+
+        if added is None:
+            logging.error("Mailbox sync not saved: CSV file not found in S3.")
+            metrics.IMAP_SYNCS.labels('error').inc()
+            return None
+        metrics.IMAP_SYNCS.labels('ok').inc()
+        clf._remember_all(parsed)
+
+        try:
+            clf.save_cursor(cursor)
+        except Exception as e:
+            # The rows are saved; the next sync re-reads them and skips the duplicates
+            logging.error("Could not save the mailbox sync cursor: {}".format(e))
+        logging.info(f"Mailbox synced up to UID {cursor['last_uid']} with {len(added)} new payments.")
+        return added
 
     @classmethod
     def check_reference_in_csv(clf, reference_number, df ):
@@ -130,99 +382,106 @@ class IMAP():
         return exists
     
     @classmethod
-    def add_unique_rows_to_csv(clf, new_data_list):
+    def ledger(clf):
         """
-        Adds only unique rows to an existing CSV file in S3 based on ReferenceNumber.
+        Returns the payment ledger selected by Config.LEDGER_BACKEND.
         """
+        return registry.get('ledger')
+
+    @classmethod
+    def add_payments(clf, rows):
+        """
+        Adds the payments of new Interac emails to the ledger, skipping the
+        reference numbers it already has, and hands the added ones to the
+        reconciler (services/validation/reconciliation.py) when it is enabled.
+        Every sync path goes through here, so a payment is reconciled whichever
+        process ingested it.
+
+        Returns:
+            list: The rows added, or None if the ledger does not exist.
+        """
+        # Without a reference number a payment cannot be deduplicated or claimed safely
+        for row in rows:
+            if row['Reference'] is None:
+                logging.warning(f"Skipped payment from {row['Sent_From']}: no reference number.")
+        rows = [row for row in rows if row['Reference'] is not None]
+        if not rows:
+            return []
         try:
-            response = clf.aws_service.s3_client.get_object(Bucket=clf.bucket_name, Key=clf.file_key)
-            csv_content = response['Body'].read().decode('utf-8')
-            df = pd.read_csv(StringIO(csv_content))
-            # logging.info("CSV file loaded from S3 successfully.")
-        except clf.aws_service.s3_client.exceptions.NoSuchKey:
+            added = clf.ledger().add_unique_rows(rows)
+        except LedgerNotFound:
             # logging.warning("CSV file not found in S3.")
-            return "CSV file not found in S3."
-        
-        unique_rows = []
-        for data in new_data_list:
-            if not clf.check_reference_in_csv(data["Reference"], df):
-                unique_rows.append(data)
-                # logging.info(f"Adding new row for reference number {data['Reference']}.")
-            # else:
-                # logging.info(f"Reference number {data['Reference']} already exists. Skipping addition.")
-
-        if unique_rows:
-            df = pd.concat([df, pd.DataFrame(unique_rows)], ignore_index=True)
-            csv_buffer = StringIO()
-            df.to_csv(csv_buffer, index=False)
-            clf.aws_service.s3_client.put_object(Bucket=clf.bucket_name, Key=clf.file_key, Body=csv_buffer.getvalue())
-            logging.info("Unique rows added to CSV file in S3.")
+            return None
+
+        if added:
+            logging.info(f"{len(added)} unique rows added to the payment ledger.")
         else:
             logging.info("No new unique rows to add.")
 
+        reconciler = registry.get('reconciler')
+        if added and reconciler is not None:
+            try:
+                reconciler.reconcile(added)
+            except Exception as e:
+                # The rows are in the ledger; `manage.py revalidate` picks up what was missed
+                logging.error(f"Reconciliation of new payments failed: {e}")
+        return added
+
     @classmethod
     def validate_reference_by_name(clf, name, amount):
         """
-        Function to validate if the given name matches a record in the CSV file stored in S3
+        Function to validate if the given name matches a record in the payment ledger
         among rows where 'Used' is not True. If a match is found, it validates the amount and
-        updates the 'Used' column to True.
-        
+        claims the row by setting 'Used' to True.
+
+        The claim is retried on a fresh read of the ledger if another worker
+        used the same payment in the meantime.
+
         Args:
             name (str): The name to search for in the 'Sent_From' column.
             amount (float): The amount to validate.
-            s3 (boto3.client): The S3 client.
-            bucket_name (str): The S3 bucket name.
-            file_key (str): The file key of the CSV in the bucket.
 
         Returns:
             dict: A status and message indicating the result.
         """
-        try:
-            response = clf.aws_service.s3_client.get_object(Bucket=clf.bucket_name, Key=clf.file_key) 
-            csv_content = response['Body'].read().decode('utf-8')
-            df = pd.read_csv(StringIO(csv_content))
-            # logging.info("CSV file loaded from S3 successfully for validation.")
-        except clf.aws_service.s3_client.exceptions.NoSuchKey:
-            # logging.error("CSV file not found in S3.")
-            return {'success': False, "message": "CSV file not found in S3."}
+        ledger = clf.ledger()
+        amount = clf.clean_amount(amount)
 
+        for _ in range(clf.claim_attempts):
+            try:
+                # Built once per ledger version, see services/ledger/payer_index.py
+                payer_index = ledger.payer_index()
+                # logging.info("Ledger loaded successfully for validation.")
+            except LedgerNotFound as e:
+                # logging.error("CSV file not found in S3.")
+                return {'success': False, "message": str(e)}
 
-        df_unused = df[df['Used'] != True]
-        if df_unused.empty:
-            # logging.warning("No unused records found in the CSV.")
-            return {'success': False, "message": "No unused records found."}
+            if len(payer_index) == 0:
+                # logging.warning("No unused records found in the CSV.")
+                return {'success': False, "message": "No unused records found."}
 
 
-        best_match = process.extractOne(name, df_unused['Sent_From'], scorer=fuzz.token_set_ratio)
-        amount = clf.clean_amount(amount)
+            best_match = payer_index.best_match(name)  # Same result and threshold (95) as process.extractOne with fuzz.token_set_ratio
+
+            if best_match:
+                found_amount = str(best_match['amount'])
+                if found_amount == amount:
 
-        if best_match and best_match[1] >= 95:  # Threshold for a good match
-             matching_row = df_unused[df_unused['Sent_From'] == best_match[0]]
-             if not matching_row.empty:
-                matching_index = matching_row.index[0]
-                df.loc[matching_index, 'Amount'] = str(df.loc[matching_index, 'Amount'])
-                if df.loc[matching_index, 'Amount'] == amount:
-
-                    df.loc[matching_index, 'Used'] = True
-                    # logging.info(f"Record with name {name} and amount {amount} validated.")
-                    
-                    csv_buffer = StringIO()
-                    df.to_csv(csv_buffer, index=False)
-                    clf.aws_service.s3_client.put_object(Bucket=clf.bucket_name, Key=clf.file_key, Body=csv_buffer.getvalue())
-                    # logging.info("CSV file updated in S3 with 'Used' set to True.")
-                    
-                    return {'success': True, "message": "Record found and validated successfully."}
+                    if ledger.claim(best_match['row_key'], best_match['reference']):
+                        # logging.info(f"Record with name {name} and amount {amount} validated.")
+                        return {'success': True, "message": "Record found and validated successfully.", 'reference': best_match['reference']}
+                    # Another worker used this payment first, look again
+                    continue
                 else:
-                    # logging.warning(f"Amount mismatch for {name}. Expected: {amount}, Found: {df.loc[matching_index, 'Amount']}.")
-                    return {'success': False, "message": f"Payment amount mismatch. Expected: {amount}, Found: {df.loc[matching_index, 'Amount']}."}
-             else:
-                # logging.warning(f"Amount mismatch for {name}. Expected: {amount}, Found: {df.loc[matching_index, 'Amount']}.")
-                return {'success': False, "message": f"Names didn't match. Expected: {df_unused['Sent_From']}, Found: {best_match[0]}."}
+                    # logging.warning(f"Amount mismatch for {name}. Expected: {amount}, Found: {found_amount}.")
+                    return {'success': False, "message": f"Payment amount mismatch. Expected: {amount}, Found: {found_amount}."}
+
+            else:
+                logging.warning(f"No payment found for {name}.")
+                return {'success': False, "message": f"No payment found for {name}."}
+
+        return {'success': False, "message": f"Payment for {name} was used by another submission."}
 
-        else:
-            logging.warning(f"No payment found for {name}.")
-            return {'success': False, "message": f"No payment found for {name}."}
-        
 
     @classmethod
     def validator(clf, payerName: str, amount, days=21):
@@ -237,12 +496,16 @@ class IMAP():
         """
         payerName = payerName.lower()
         result = clf.validate_reference_by_name(payerName, amount)
-        if result["success"]:
+        if result["success"] or not Config.MAILBOX_FALLBACK:
+            # Without the fallback the ledger is kept current by `python manage.py listen-mailbox`
             return result
         else:
-            data_from_email = clf.find_in_email(days)
-            if data_from_email != None:
-                clf.add_unique_rows_to_csv(data_from_email)
+            # Only re-check the ledger if the mailbox had new payments
+            if Config.IMAP_TARGETED_LOOKUP:
+                data_from_email = clf.lookup_payer(payerName, days)
+            else:
+                data_from_email = clf.sync_mailbox(days)
+            if data_from_email:
                 result = clf.validate_reference_by_name(payerName, amount)
             return result
 
@@ -0,0 +1,228 @@
+import imaplib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from imap_tools import MailBox, MailMessageFlags
+from config import Config
+
+# Errors after which a session is dropped and the command is retried once on a new one
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+class ImapSessionPool:
+    """
+    Authenticated IMAP sessions, kept open per account and shared by the draft
+    appends and the Interac mailbox syncs.
+
+    A borrowed session is returned to the pool afterwards instead of logging out.
+    A background thread sends NOOP to sessions idle for keepalive_seconds, so the
+    server keeps them open, and drops the ones that stopped answering. Sessions
+    are logged in with INBOX selected; callers that select another folder must
+    select INBOX again before returning the session.
+
+    Methods:
+        session(user, password): Context manager that borrows a session.
+        run(user, password, action): Calls action(mailbox), retrying once on a new session if the connection broke.
+        close(): Logs out every idle session.
+    """
+    def __init__(self, host='imap.gmail.com', max_sessions=4, keepalive_seconds=120):
+        """
+        Args:
+            host (str): IMAP server.
+            max_sessions (int): Most sessions open at the same time for one account.
+            keepalive_seconds (int): Idle time after which a session is checked with NOOP.
+        """
+        self.host = host
+        self.max_sessions = max_sessions
+        self.keepalive_seconds = keepalive_seconds
+        self._idle = {}         # user -> [(mailbox, last used)]
+        self._slots = {}        # user -> BoundedSemaphore of max_sessions
+        self._lock = threading.Lock()
+        self._keepalive_thread = None
+
+    @contextmanager
+    def session(self, user, password):
+        slot = self._slot(user)
+        slot.acquire()
+        mailbox = None
+        try:
+            mailbox = self._take_idle(user) or MailBox(self.host).login(user, password)
+            yield mailbox
+        except CONNECTION_ERRORS:
+            self._logout(mailbox)
+            mailbox = None
+            raise
+        finally:
+            if mailbox is not None:
+                with self._lock:
+                    self._idle.setdefault(user, []).append((mailbox, time.monotonic()))
+            slot.release()
+            self._start_keepalive()
+
+    def run(self, user, password, action):
+        """
+        Args:
+            user (str): IMAP account.
+            password (str): App password of the account.
+            action (callable): Called with the borrowed MailBox.
+
+        Returns:
+            The return value of action.
+        """
+        try:
+            with self.session(user, password) as mailbox:
+                return action(mailbox)
+        except CONNECTION_ERRORS as e:
+            # Usually a session the server closed while it was idle
+            logging.warning(f"IMAP session for {user} lost ({e}), retrying on a new one.")
+            with self.session(user, password) as mailbox:
+                return action(mailbox)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for sessions in idle.values():
+            for mailbox, _ in sessions:
+                self._logout(mailbox)
+
+    def _slot(self, user):
+        with self._lock:
+            slot = self._slots.get(user)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_sessions)
+                self._slots[user] = slot
+            return slot
+
+    def _take_idle(self, user):
+        with self._lock:
+            sessions = self._idle.get(user)
+            if not sessions:
+                return None
+            # Most recently used first, it is the least likely to have timed out
+            mailbox, last_used = sessions.pop()
+
+        if time.monotonic() - last_used < self.keepalive_seconds:
+            return mailbox
+        if self._noop(mailbox):
+            return mailbox
+        self._logout(mailbox)
+        return None
+
+    def _start_keepalive(self):
+        with self._lock:
+            if self._keepalive_thread is not None:
+                return
+            self._keepalive_thread = threading.Thread(target=self._keepalive, name='imap-keepalive', daemon=True)
+        self._keepalive_thread.start()
+
+    def _keepalive(self):
+        while True:
+            time.sleep(self.keepalive_seconds)
+            now = time.monotonic()
+            with self._lock:
+                stale = []
+                for user, sessions in self._idle.items():
+                    keep = [entry for entry in sessions if now - entry[1] < self.keepalive_seconds]
+                    stale.extend((user, mailbox) for mailbox, last_used in sessions if now - last_used >= self.keepalive_seconds)
+                    self._idle[user] = keep
+
+            # Checked outside the lock; a session in use is never touched here
+            for user, mailbox in stale:
+                if self._noop(mailbox):
+                    with self._lock:
+                        self._idle.setdefault(user, []).insert(0, (mailbox, time.monotonic()))
+                else:
+                    self._logout(mailbox)
+
+    @staticmethod
+    def _noop(mailbox):
+        try:
+            return mailbox.client.noop()[0] == 'OK'
+        except Exception:
+            return False
+
+    @staticmethod
+    def _logout(mailbox):
+        if mailbox is None:
+            return
+        try:
+            mailbox.logout()
+        except Exception:
+            pass
+
+
+class DraftAppender:
+    """
+    Appends drafts to the sender account, several at a time over one session.
+
+    append() blocks until its draft was stored. While one caller is appending,
+    drafts from other callers queue up and are appended together by the next
+    pass over a single borrowed session, so a burst of failed submissions does
+    not log in once per draft.
+    """
+    folder = '[Gmail]/Drafts'
+
+    def __init__(self, pool, user, password):
+        self.pool = pool
+        self.user = user
+        self.password = password
+        self._pending = []
+        self._lock = threading.Lock()
+        self._appending = False
+
+    def append(self, raw_message):
+        """
+        Args:
+            raw_message (bytes): The MIME message.
+
+        Returns:
+            bool: True if the draft was created.
+        """
+        entry = {'message': raw_message, 'done': threading.Event(), 'ok': False}
+        with self._lock:
+            self._pending.append(entry)
+            if self._appending:
+                leader = False
+            else:
+                self._appending = leader = True
+
+        if not leader:
+            entry['done'].wait()
+            return entry['ok']
+
+        while True:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                if not batch:
+                    self._appending = False
+                    break
+            self._append_batch(batch)
+        return entry['ok']
+
+    def _append_batch(self, batch):
+        def append_all(mailbox):
+            for entry in batch:
+                if entry['done'].is_set():
+                    # Already handled before the session was lost
+                    continue
+                try:
+                    mailbox.append(entry['message'], self.folder, flag_set=[MailMessageFlags.DRAFT])
+                    entry['ok'] = True
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    logging.error(f"Draft append rejected: {e}")
+                entry['done'].set()
+
+        try:
+            self.pool.run(self.user, self.password, append_all)
+            logging.info(f"Appended {len(batch)} drafts over one IMAP session.")
+        except Exception as e:
+            logging.error(f"Draft append failed: {e}")
+        finally:
+            for entry in batch:
+                entry['done'].set()
+
+
+imap_pool = ImapSessionPool(max_sessions=Config.IMAP_POOL_SIZE, keepalive_seconds=Config.IMAP_KEEPALIVE_SECONDS)
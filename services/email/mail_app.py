@@ -0,0 +1,22 @@
+from flask_mail import Mail
+from config import Config
+
+
+def configure_mail(app):
+    """
+    Configures Flask-Mail on an app for Gmail, sending as the confirmation sender.
+
+    Args:
+        app (Flask): The application; the web app, or a bare one in manage.py commands.
+
+    Returns:
+        Mail: The Flask-Mail instance bound to the app.
+    """
+    app.config['MAIL_SERVER'] = 'smtp.gmail.com'
+    app.config['MAIL_PORT'] = 587  # Use 465 for SSL
+    app.config['MAIL_USE_TLS'] = True  # Enable TLS
+    app.config['MAIL_USE_SSL'] = False  # Disable SSL when using TLS
+    app.config['MAIL_USERNAME'] = Config.CONFIRMATION_SENDER_EMAIL
+    app.config['MAIL_PASSWORD'] = Config.CONFIRMATION_SENDER_EMAIL_APP_PASSWORD
+    app.config['MAIL_DEFAULT_SENDER'] = Config.CONFIRMATION_SENDER_EMAIL
+    return Mail(app)
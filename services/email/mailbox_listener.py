@@ -0,0 +1,106 @@
+import logging
+import random
+import threading
+import time
+from imap_tools import MailBox
+from services.email.imap_pool import CONNECTION_ERRORS
+from services.email.imapTools import IMAP
+from services import metrics
+
+
+class MailboxListener:
+    """
+    Keeps the payment ledger current by holding an IMAP IDLE connection on the
+    sponsor mailbox.
+
+    Every time the server reports new mail, the new Interac notifications are
+    parsed with IMAP.test_match and appended to the ledger through
+    IMAP.sync_mailbox, which works from the UID cursor so only the new emails
+    are fetched. A sync also runs after every (re)connection to catch up on the
+    emails received while the listener was away. Connection failures are
+    retried with exponential backoff and jitter.
+
+    Methods:
+        run(): Listens until stop() is called.
+        start(): Runs the listener in a daemon thread.
+        stop(): Ends the listener after the current wait.
+    """
+    def __init__(self, host='imap.gmail.com', idle_seconds=600, backoff_initial=1, backoff_max=300, days=44, on_rows=None):
+        """
+        Args:
+            host (str): IMAP server.
+            idle_seconds (int): Length of one IDLE wait; IDLE is re-issued after it (at most 29 minutes).
+            backoff_initial (float): Seconds to wait after the first failed connection.
+            backoff_max (float): Longest wait between connection attempts.
+            days (int): Size of the mailbox window used when no sync cursor exists.
+            on_rows (callable): Called with the rows of every sync that added payments.
+        """
+        self.host = host
+        self.idle_seconds = idle_seconds
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.days = days
+        self.on_rows = on_rows
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, name='mailbox-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        backoff = self.backoff_initial
+        while not self._stopping.is_set():
+            connected_at = None
+            try:
+                with MailBox(self.host).login(IMAP.email_user, IMAP.email_password) as mailbox:
+                    logging.info("Mailbox listener connected.")
+                    connected_at = time.monotonic()
+                    self.sync()
+                    self._listen(mailbox)
+            except CONNECTION_ERRORS as e:
+                logging.warning(f"Mailbox listener disconnected ({e}), reconnecting in {backoff:.0f}s.")
+            except Exception as e:
+                logging.error(f"Mailbox listener failed ({type(e).__name__}: {e}), reconnecting in {backoff:.0f}s.")
+            else:
+                continue
+
+            # A connection that held for a while starts the backoff over; one dropped
+            # right after login keeps growing it
+            if connected_at is not None and time.monotonic() - connected_at > self.backoff_max:
+                backoff = self.backoff_initial
+            # Jitter keeps several listeners from reconnecting in step
+            self._stopping.wait(backoff * random.uniform(0.5, 1))
+            backoff = min(backoff * 2, self.backoff_max)
+
+    def _listen(self, mailbox):
+        while not self._stopping.is_set():
+            responses = mailbox.idle.wait(timeout=self.idle_seconds)
+            if any(b'EXISTS' in response for response in responses):
+                self.sync()
+
+    def sync(self):
+        """
+        Adds the emails received since the last sync to the ledger.
+
+        Returns:
+            list: The new rows, or None if the sync failed.
+        """
+        with metrics.stage('mailbox_listener_sync'):
+            rows = IMAP.sync_mailbox(self.days)
+        if rows:
+            logging.info(f"Mailbox listener added {len(rows)} payments to the ledger.")
+            if self.on_rows is not None:
+                try:
+                    self.on_rows(rows)
+                except Exception as e:
+                    # The rows are in the ledger; `manage.py revalidate` picks up what was missed
+                    logging.error(f"Processing of new payments failed: {e}")
+        return rows
@@ -0,0 +1,206 @@
+import atexit
+import logging
+import queue
+import smtplib
+import threading
+import time
+from datetime import datetime, timezone
+from services.jobs.dedup import SAVED
+from config import Config
+
+
+def create_outbox(app, mail, collection):
+    """
+    Returns a started EmailOutbox with the EMAIL_OUTBOX_* settings, or None when EMAIL_OUTBOX is off.
+    """
+    if not Config.EMAIL_OUTBOX:
+        return None
+    outbox = EmailOutbox(
+        app,
+        mail,
+        collection,
+        batch_size=Config.EMAIL_OUTBOX_BATCH_SIZE,
+        keepalive_seconds=Config.EMAIL_OUTBOX_KEEPALIVE_SECONDS,
+        send_attempts=Config.EMAIL_OUTBOX_SEND_ATTEMPTS,
+    )
+    outbox.start()
+    return outbox
+
+
+class EmailOutbox:
+    """
+    Sends Flask-Mail messages from a background thread over one long-lived SMTP session.
+
+    Webhook requests only enqueue their message. The sender thread keeps the SMTP
+    connection open between messages (with a NOOP every keepalive_seconds), sends
+    whatever is queued in batches over that session, reconnects when the server
+    drops it, and writes the delivery status back onto the submission document.
+
+    The queue lives in memory: stop() (also registered with atexit) drains it on a
+    clean shutdown, but messages still queued when the process is killed are lost.
+
+    Methods:
+        enqueue(message, document_id): Queues a message for the given submission document.
+        start(): Starts the sender thread.
+        stop(timeout): Sends what is queued and closes the SMTP session.
+    """
+    status_retry_seconds = 2
+
+    def __init__(self, app, mail, collection, batch_size=20, keepalive_seconds=60, send_attempts=3, status_timeout=300):
+        """
+        Args:
+            app (Flask): Application whose context the sender thread runs in.
+            mail (Mail): Flask-Mail instance with the SMTP settings.
+            collection (Collection): MongoDB collection of the submission documents.
+            batch_size (int): Most messages sent in one pass over the session.
+            keepalive_seconds (int): Idle time after which the session is checked with NOOP.
+            send_attempts (int): Connections tried for one message before it is marked failed.
+            status_timeout (int): Seconds to keep retrying a status update whose document is not saved yet.
+        """
+        self.app = app
+        self.mail = mail
+        self.collection = collection
+        self.batch_size = batch_size
+        self.keepalive_seconds = keepalive_seconds
+        self.send_attempts = send_attempts
+        self.status_timeout = status_timeout
+        self._queue = queue.Queue()
+        self._connection = None
+        self._pending_status = []   # (document_id, fields, give up at)
+        self._last_used = time.monotonic()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def enqueue(self, message, document_id):
+        """
+        Args:
+            message (Message): The Flask-Mail message.
+            document_id (ObjectId): _id of the submission document that receives the delivery status.
+        """
+        self._queue.put((message, document_id))
+
+    def start(self):
+        """
+        Starts the sender thread. Calling it more than once has no effect.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=30):
+        if self._thread is None or self._stopping.is_set():
+            return
+        self._stopping.set()
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                # Wake up sooner while statuses wait for their document to be saved
+                timeout = self.status_retry_seconds if self._pending_status else self.keepalive_seconds
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    self._flush_status()
+                    if time.monotonic() - self._last_used >= self.keepalive_seconds:
+                        self._keepalive()
+                    continue
+
+                batch = []
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+
+                for message, document_id in batch:
+                    self._deliver(message, document_id)
+                self._flush_status()
+
+                if item is None and self._stopping.is_set():
+                    self._flush_status(final=True)
+                    self._close()
+                    return
+
+    def _deliver(self, message, document_id):
+        error = None
+        for attempt in range(self.send_attempts):
+            try:
+                if self._connection is None:
+                    self._connect()
+                self._connection.send(message)
+                self._last_used = time.monotonic()
+                error = None
+                break
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError) as e:
+                # Dropped or stale session: reconnect and try again
+                error = e
+                self._close()
+            except smtplib.SMTPException as e:
+                # Rejected by the server (recipient, sender, content, login); retrying
+                # will not help. Checked before OSError, which SMTPException subclasses.
+                error = e
+                break
+            except OSError as e:
+                # Socket error: reconnect and try again
+                error = e
+                self._close()
+            except Exception as e:
+                error = e
+                break
+
+        if error is None:
+            fields = {'Email_Send': True, 'Email_Status': 'sent', 'Email_Sent_At': datetime.now(timezone.utc)}
+        else:
+            logging.error(f"Email for {document_id} not sent: {error}")
+            fields = {'Email_Send': False, 'Email_Status': 'failed', 'Email_Error_Message': str(error)}
+        self._pending_status.append((document_id, fields, time.monotonic() + self.status_timeout))
+
+    def _flush_status(self, final=False):
+        """
+        Writes delivery statuses. The submission is saved after its message was
+        queued, so an update that matches nothing is kept and retried later.
+        """
+        remaining = []
+        for document_id, fields, give_up_at in self._pending_status:
+            try:
+                matched = self.collection.update_one({'_id': document_id, **SAVED}, {'$set': fields}).matched_count
+            except Exception as e:
+                logging.warning(f"Could not record email status for {document_id}: {e}")
+                matched = 0
+            if not matched:
+                if final or time.monotonic() > give_up_at:
+                    logging.error(f"Dropped email status for {document_id}: {fields['Email_Status']}")
+                else:
+                    remaining.append((document_id, fields, give_up_at))
+        self._pending_status = remaining
+
+    def _connect(self):
+        self._connection = self.mail.connect().__enter__()
+
+    def _close(self):
+        connection, self._connection = self._connection, None
+        if connection is None or connection.host is None:
+            return
+        try:
+            connection.host.quit()
+        except Exception:
+            connection.host.close()
+
+    def _keepalive(self):
+        if self._connection is None or self._connection.host is None:
+            return
+        try:
+            status, _ = self._connection.host.noop()
+            self._last_used = time.monotonic()
+            if status != 250:
+                self._close()
+        except Exception:
+            # Reconnect lazily with the next message
+            self._close()
@@ -0,0 +1,91 @@
+import email
+import email.policy
+import re
+
+# The headers needed to decode the start of a body, and the date of the ledger row
+HEADER_FIELDS = 'DATE CONTENT-TYPE CONTENT-TRANSFER-ENCODING'
+
+_UID = re.compile(rb'UID (\d+)')
+_MESSAGE_START = re.compile(rb'^\d+ \(')
+
+
+def fetch_partial(mailbox, uids, max_bytes):
+    """
+    Fetches the first max_bytes of the body of each message, with the few
+    headers needed to decode it, instead of the whole MIME message.
+
+    Args:
+        mailbox (MailBox): Logged in, with the folder selected.
+        uids (list): Message UIDs (str).
+        max_bytes (int): Bytes of each body to download.
+
+    Returns:
+        dict: uid -> (text of the first text/plain part or None, date header), and
+        the number of bytes received.
+    """
+    if not uids:
+        return {}, 0
+    status, data = mailbox.client.uid(
+        'FETCH', ','.join(uids),
+        f'(UID BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})] BODY.PEEK[TEXT]<0.{max_bytes}>)',
+    )
+    if status != 'OK':
+        raise RuntimeError(f"Partial fetch failed: {status} {data}")
+
+    messages, received = parse_fetch_response(data)
+    return {uid: decode(parts.get('header', b''), parts.get('text', b'')) for uid, parts in messages.items()}, received
+
+
+def parse_fetch_response(data):
+    """
+    Groups the literals of an imaplib FETCH response by message.
+
+    Returns:
+        tuple: ({uid: {'header': bytes, 'text': bytes}}, bytes received)
+    """
+    messages = {}
+    current, uid, received = None, None, 0
+    for item in data:
+        meta = item[0] if isinstance(item, tuple) else item
+        if not isinstance(meta, bytes):
+            continue
+        if _MESSAGE_START.match(meta):
+            if current is not None and uid is not None:
+                messages[uid] = current
+            current, uid = {}, None
+        if current is None:
+            continue
+
+        # The UID may come before or after the literals
+        match = _UID.search(meta)
+        if match:
+            uid = match.group(1).decode()
+        if isinstance(item, tuple):
+            received += len(item[1])
+            current['header' if b'HEADER' in meta else 'text'] = item[1]
+
+    if current is not None and uid is not None:
+        messages[uid] = current
+    return messages, received
+
+
+def decode(header, body):
+    """
+    Decodes the first text/plain part found in the start of a body.
+
+    Returns:
+        tuple: (text or None, date header or '')
+    """
+    message = email.message_from_bytes(header.rstrip(b'\r\n') + b'\r\n\r\n' + body, policy=email.policy.compat32)
+    date = message.get('Date', '')
+    for part in message.walk():
+        if part.get_content_type() != 'text/plain':
+            continue
+        try:
+            payload = part.get_payload(decode=True)
+        except Exception:
+            return None, date
+        if payload is None:
+            return None, date
+        return payload.decode(part.get_content_charset() or 'utf-8', 'replace'), date
+    return None, date
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from services.jotForm.id_extraction import extract_submission_id
+from services.database.bulk_writer import with_write_concern
+from services import metrics
+
+# Filter of the submission documents that were saved, as opposed to a claim still
+# being processed. Status updates written after the response (email delivery,
+# background drafts) wait for it, so the final save does not overwrite them.
+SAVED = {'Dedup_Status': {'$ne': 'processing'}}
+
+
+def submission_key(data, submission_id=None):
+    """
+    Deduplication key of a webhook delivery: the JotForm submission id, or a
+    hash of the submission content when the id is missing.
+
+    Args:
+        data (dict): The parsed rawRequest.
+        submission_id (str): The submissionID field posted by JotForm, if any.
+
+    Returns:
+        str: The key.
+    """
+    submission_id = submission_id or extract_submission_id(data.get('uploadEtransfer'))
+    if submission_id:
+        return f"submission:{submission_id}"
+    content = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return f"sha256:{hashlib.sha256(content.encode('utf-8')).hexdigest()}"
+
+
+class SubmissionDedup:
+    """
+    Makes webhook processing idempotent. The first delivery of a submission
+    claims it by inserting its document in webhook_data with a unique
+    Dedup_Key; the pipeline result later replaces that document. Re-deliveries
+    and double submissions get the saved result back instead of running OCR,
+    the mailbox checks, the emails and the ledger update again. A duplicate
+    that arrives while the original is still running waits for it, up to
+    wait_seconds, unless the original runs as a job: the duplicate is then
+    answered as still processing right away.
+
+    A claim whose process died is taken over once it is older than
+    lease_seconds; a claim whose processing failed is released, so the next
+    delivery runs again.
+
+    Methods:
+        claim(key, local): Claims a submission, or returns the result of its first delivery.
+        complete(document_id, res, write_concern): Saves the pipeline result on the claim.
+        release(document_id, key): Drops the claim of a failed submission.
+    """
+    def __init__(self, collection, wait_seconds=20, lease_seconds=900):
+        """
+        Args:
+            collection (Collection): The webhook_data collection.
+            wait_seconds (float): Longest time a duplicate waits for the original.
+            lease_seconds (int): Age after which a claim still processing is taken over.
+        """
+        self.collection = collection
+        self.wait_seconds = wait_seconds
+        self.lease_seconds = lease_seconds
+        # Claims of this process, to wake local duplicates without polling
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        self.collection.create_index(
+            [('Dedup_Key', ASCENDING)], unique=True,
+            partialFilterExpression={'Dedup_Key': {'$type': 'string'}},
+        )
+
+    def claim(self, key, local=True):
+        """
+        Args:
+            key (str): The submission_key of the delivery.
+            local (bool): False when the submission is processed by a job, possibly
+                in another process; a duplicate then does not wait for it.
+
+        Returns:
+            tuple: (document_id, None) when this delivery must be processed, or
+            (None, result) for a duplicate, where result describes the first
+            delivery and its 'status' is 'done' or 'processing'.
+        """
+        deadline = time.monotonic() + (self.wait_seconds if local else 0)
+        delay = 0.05
+        while True:
+            document_id = self._insert_claim(key, local)
+            if document_id is not None:
+                metrics.cache_event('dedup', 'claimed')
+                return document_id, None
+
+            document = self.collection.find_one({'Dedup_Key': key}, {'Dedup_Status': 1, 'Dedup_Claimed_At': 1})
+            if document is None:
+                # Released in the meantime; claim it again
+                continue
+
+            if document.get('Dedup_Status') != 'processing':
+                metrics.cache_event('dedup', 'duplicate')
+                return None, self._result(document, 'done')
+
+            document_id = self._take_over(document, local)
+            if document_id is not None:
+                metrics.cache_event('dedup', 'taken_over')
+                return document_id, None
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.cache_event('dedup', 'duplicate')
+                return None, self._result(document, 'processing')
+
+            with self._lock:
+                event = self._in_flight.get(key)
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 1)
+
+    def complete(self, document_id, res, write_concern=None):
+        """
+        Replaces the claim with the pipeline result.
+
+        Returns:
+            dict: The save result, shaped like save_to_mongodb's.
+        """
+        key = res.get('Dedup_Key')
+        res['_id'] = document_id
+        res['Dedup_Status'] = 'done'
+        res['created_at'] = datetime.now(timezone.utc)
+        try:
+            result = with_write_concern(self.collection, write_concern).replace_one({'_id': document_id}, res)
+            if not result.matched_count:
+                # The claim expired and was dropped; keep the result anyway
+                logging.warning(f"Claim {document_id} of {key} no longer exists, saving a new document.")
+                res.pop('Dedup_Key', None)
+                with_write_concern(self.collection, write_concern).insert_one(res)
+        finally:
+            self._done(key)
+        return {
+            'success': True,
+            'message': 'Data saved to MongoDB',
+            'document_id': str(document_id)
+        }
+
+    def release(self, document_id, key=None):
+        try:
+            self.collection.delete_one({'_id': document_id, 'Dedup_Status': 'processing'})
+        except Exception as e:
+            # The claim expires after lease_seconds
+            logging.error(f"Could not release claim {document_id}: {e}")
+        finally:
+            self._done(key)
+
+    def _insert_claim(self, key, local):
+        now = datetime.now(timezone.utc)
+        try:
+            document_id = self.collection.insert_one({
+                'Dedup_Key': key,
+                'Dedup_Status': 'processing',
+                'Dedup_Claimed_At': now,
+                'created_at': now,
+            }).inserted_id
+        except DuplicateKeyError:
+            return None
+        if local:
+            with self._lock:
+                self._in_flight[key] = threading.Event()
+        return document_id
+
+    def _take_over(self, document, local):
+        claimed_at = document.get('Dedup_Claimed_At')
+        if claimed_at is None:
+            return None
+        if claimed_at.tzinfo is None:
+            claimed_at = claimed_at.replace(tzinfo=timezone.utc)
+        now = datetime.now(timezone.utc)
+        if now - claimed_at < timedelta(seconds=self.lease_seconds):
+            return None
+
+        taken = self.collection.find_one_and_update(
+            {'_id': document['_id'], 'Dedup_Status': 'processing', 'Dedup_Claimed_At': document['Dedup_Claimed_At']},
+            {'$set': {'Dedup_Claimed_At': now}},
+            projection={'Dedup_Key': 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if taken is None:
+            return None
+        logging.warning(f"Took over the expired claim {taken['_id']} of {taken['Dedup_Key']}")
+        if local:
+            with self._lock:
+                self._in_flight[taken['Dedup_Key']] = threading.Event()
+        return taken['_id']
+
+    def _done(self, key):
+        with self._lock:
+            event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    @staticmethod
+    def _result(document, status):
+        return {
+            'success': True,
+            'message': 'Duplicate submission, already processed' if status == 'done' else 'Duplicate submission, still processing',
+            'document_id': str(document['_id']),
+            'duplicate': True,
+            'status': status,
+        }
@@ -0,0 +1,149 @@
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, ReturnDocument
+
+
+class JobQueue:
+    """
+    Durable job queue for webhook submissions, stored in a MongoDB collection.
+
+    Jobs move through the statuses queued -> running -> done | failed. A worker
+    claims a job atomically and holds it for a lease; if the process dies, the
+    lease expires and another worker picks the job up again, so a restart does
+    not lose queued or in-progress submissions.
+
+    Methods:
+        enqueue(payload): Persists a new job and returns its id.
+        get(job_id): Returns the public status document of a job.
+        start(): Starts the local worker threads.
+    """
+    def __init__(self, collection, handler, workers=2, lease_seconds=600, max_attempts=3, poll_interval=2.0):
+        """
+        Args:
+            collection (Collection): MongoDB collection that stores the jobs.
+            handler (callable): Called with the job payload; its return value is stored as the job result.
+            workers (int): Number of worker threads.
+            lease_seconds (int): How long a running job is reserved for its worker.
+            max_attempts (int): How many times a job is claimed before it is abandoned.
+            poll_interval (float): Seconds an idle worker waits before polling the collection again.
+        """
+        self.collection = collection
+        self.handler = handler
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def ensure_indexes(self):
+        self.collection.create_index([('status', ASCENDING), ('created_at', ASCENDING)])
+
+    def enqueue(self, payload):
+        """
+        Persists a new job.
+
+        Args:
+            payload (dict): Data passed to the handler.
+
+        Returns:
+            str: The job id.
+        """
+        now = datetime.now(timezone.utc)
+        result = self.collection.insert_one({
+            'status': 'queued',
+            'payload': payload,
+            'attempts': 0,
+            'created_at': now,
+            'updated_at': now,
+        })
+        self._wakeup.set()
+        return str(result.inserted_id)
+
+    def get(self, job_id):
+        """
+        Returns the status of a job, or None if it does not exist.
+        """
+        try:
+            job = self.collection.find_one({'_id': ObjectId(job_id)}, {'payload': 0})
+        except InvalidId:
+            return None
+        if job is None:
+            return None
+
+        job['job_id'] = str(job.pop('_id'))
+        return job
+
+    def start(self):
+        """
+        Starts the worker threads. Calling it more than once has no effect.
+        """
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _claim(self):
+        now = datetime.now(timezone.utc)
+        return self.collection.find_one_and_update(
+            {
+                'attempts': {'$lt': self.max_attempts},
+                '$or': [
+                    {'status': 'queued'},
+                    {'status': 'running', 'lease_until': {'$lt': now}},
+                ],
+            },
+            {
+                '$set': {
+                    'status': 'running',
+                    'lease_until': now + timedelta(seconds=self.lease_seconds),
+                    'updated_at': now,
+                },
+                '$inc': {'attempts': 1},
+            },
+            sort=[('created_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _abandon_expired(self):
+        # Jobs that crashed their worker too many times are never claimed again
+        now = datetime.now(timezone.utc)
+        self.collection.update_many(
+            {'status': 'running', 'lease_until': {'$lt': now}, 'attempts': {'$gte': self.max_attempts}},
+            {'$set': {'status': 'failed', 'error': f'Job abandoned after {self.max_attempts} attempts', 'updated_at': now}},
+        )
+
+    def _finish(self, job_id, fields):
+        fields['updated_at'] = datetime.now(timezone.utc)
+        self.collection.update_one({'_id': job_id}, {'$set': fields, '$unset': {'lease_until': ''}})
+
+    def _worker(self):
+        while True:
+            try:
+                job = self._claim()
+                if job is None:
+                    self._abandon_expired()
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+            except Exception as e:
+                logging.error(f"Job queue polling failed: {e}")
+                self._wakeup.wait(self.poll_interval)
+                continue
+
+            try:
+                fields = {'status': 'done', 'result': self.handler(job['payload'])}
+            except Exception as e:
+                logging.error(f"Job {job['_id']} failed: {e}")
+                fields = {'status': 'failed', 'error': str(e)}
+
+            try:
+                self._finish(job['_id'], fields)
+            except Exception as e:
+                # The lease will expire and the job will be retried
+                logging.error(f"Could not record the outcome of job {job['_id']}: {e}")
@@ -1,15 +1,50 @@
 import requests
 import json
+import logging
+import threading
+from collections import OrderedDict
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 import os
 from PIL import Image
 from io import BytesIO
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+from services.jotForm.image_cache import DiskImageCache
+from services import metrics
+from config import Config
 
 load_dotenv()
 
 api_key = os.getenv('JOTFORM_API_KEY')
 
+# One pooled session per process so uploads reuse TLS connections to jotform.com
+session = requests.Session()
+session.headers.update({
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+})
+session.max_redirects = Config.IMAGE_MAX_REDIRECTS
+adapter = HTTPAdapter(pool_connections=4, pool_maxsize=Config.IMAGE_POOL_SIZE)
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+
+timeout = (Config.IMAGE_CONNECT_TIMEOUT, Config.IMAGE_READ_TIMEOUT)
+
+# Upload URL -> direct image URL found behind the HTML wrapper page
+resolved_urls = OrderedDict()
+resolved_urls_lock = threading.Lock()
+resolved_urls_max = 1024
+
+
+class StaleResolvedUrl(Exception):
+    '''
+    Raised when a remembered direct image URL answers with an HTTP error.
+    '''
+
+
+image_cache = DiskImageCache(Config.IMAGE_CACHE_DIR, Config.IMAGE_CACHE_MAX_MB * 1024 * 1024) if Config.IMAGE_CACHE_DIR else None
+
+
 def extract_image_url_from_html(html_content):
     '''
     Extracts the direct image URL from an HTML page.
@@ -28,11 +63,37 @@ def extract_image_url_from_html(html_content):
         raise ValueError("No image URL found in the provided HTML.")
 
 
+def get_resolved_url(image_url):
+    with resolved_urls_lock:
+        resolved = resolved_urls.get(image_url)
+        if resolved is not None:
+            resolved_urls.move_to_end(image_url)
+        return resolved
+
+
+def set_resolved_url(image_url, resolved):
+    with resolved_urls_lock:
+        resolved_urls[image_url] = resolved
+        resolved_urls.move_to_end(image_url)
+        while len(resolved_urls) > resolved_urls_max:
+            resolved_urls.popitem(last=False)
+
+
+def forget_resolved_url(image_url):
+    with resolved_urls_lock:
+        resolved_urls.pop(image_url, None)
+
+
 # Function to download the image from the extracted URL.
 def get_image_from_url(image_url):
     '''
     Downloads the image from the provided URL. If the URL points to an HTML page, 
-    recursively extracts the image URL and fetches the image.
+    follows the image URL it contains, up to Config.IMAGE_MAX_HTML_DEPTH pages.
+
+    Downloaded images are kept in the disk cache, and the direct image URL found
+    behind an HTML page is remembered, so retries and re-validations of the same
+    upload do not download it again. If the remembered URL has expired, the
+    upload URL is resolved again.
     
     :param image_url (str): URL of the image or an HTML page containing the image.
     
@@ -40,26 +101,64 @@ def get_image_from_url(image_url):
     
     :raises: ValueError: If unable to handle the content type of the response.
     '''
+    if image_cache is not None:
+        content = image_cache.get(image_url)
+        metrics.cache_event('image', 'miss' if content is None else 'hit')
+        if content is not None:
+            return content
+
+    content = None
+    resolved = get_resolved_url(image_url)
+    if resolved is not None:
+        try:
+            content = fetch_image(resolved, image_url, remembered=True)
+        except StaleResolvedUrl as e:
+            logging.warning(f"Fetching {image_url} again: {e}")
+            forget_resolved_url(image_url)
+    if content is None:
+        content = fetch_image(image_url, image_url)
+
+    if image_cache is not None:
+        image_cache.put(image_url, content)
+    return content
+
+
+def fetch_image(image_url, source_url, depth=0, remembered=False):
+    '''
+    Downloads an image, following HTML wrapper pages.
+
+    :param image_url (str): URL to download.
+    :param source_url (str): The upload URL the download started from.
+    :param depth (int): Number of HTML pages followed so far.
+    :param remembered (bool): image_url is the direct URL remembered for source_url.
+
+    :return: bytes: Image content in binary format.
+
+    :raises: StaleResolvedUrl: If a remembered URL answers with an HTTP error.
+    '''
     full_url = f"{image_url}?apiKey={api_key}"
     
     print('Retrieve image from this url: ', full_url)
     
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
-    }
-    response = requests.get(full_url, headers=headers)
+    with metrics.call('jotform_download'):
+        response = session.get(full_url, timeout=timeout)
+    if remembered and response.status_code >= 400:
+        raise StaleResolvedUrl(f"Remembered image URL for {source_url} returned {response.status_code}")
     content_type = response.headers.get('Content-Type', '')
     if 'image' in content_type:
+        if image_url != source_url:
+            set_resolved_url(source_url, image_url)
         return response.content
 
     elif 'text/html' in content_type:
+        if depth >= Config.IMAGE_MAX_HTML_DEPTH:
+            raise ValueError(f"No image found after following {depth} HTML pages from {source_url}")
         image_page_url = extract_image_url_from_html(response.content)
         # If the extracted image URL is relative, make it absolute.
         if not image_page_url.startswith('http'):
-            from urllib.parse import urljoin
             image_page_url = urljoin(image_url, image_page_url)
-        # Recursively call this function with the new image URL.
-        return get_image_from_url(image_page_url)
+        # Follow the extracted image URL.
+        return fetch_image(image_page_url, source_url, depth + 1)
     else:
         if response.status_code == 200: # If the image format is jpg
             image = Image.open(BytesIO(response.content))
@@ -67,6 +166,8 @@ def get_image_from_url(image_url):
             image_bytes = BytesIO()
             image.save(image_bytes, format='JPEG')
             image_bytes = image_bytes.getvalue()
+            if image_url != source_url:
+                set_resolved_url(source_url, image_url)
             return image_bytes
         else:
-            raise ValueError(f"Unable to handle content type: {content_type}")
\ No newline at end of file
+            raise ValueError(f"Unable to handle content type: {content_type}")
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import threading
+
+
+class DiskImageCache:
+    """
+    Content-addressed, size-bounded cache of downloaded images on local disk.
+
+    Image bytes are stored once under their SHA-256 in `<directory>/blobs`, and
+    each source URL points to its blob through a small file in `<directory>/urls`.
+    Reading a blob refreshes its modification time; when the cache grows past
+    max_bytes the least recently used blobs are deleted first, together with
+    the URL pointers to them.
+
+    Methods:
+        get(url): Returns the cached bytes for a URL, or None.
+        put(url, content): Stores the bytes downloaded from a URL.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(directory, 'blobs')
+        self.url_dir = os.path.join(directory, 'urls')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.url_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(entry.stat().st_size for entry in os.scandir(self.blob_dir) if entry.is_file())
+
+    def get(self, url):
+        url_path = self._url_path(url)
+        try:
+            with open(url_path) as f:
+                digest = f.read().strip()
+        except OSError:
+            return None
+        blob_path = os.path.join(self.blob_dir, digest)
+        try:
+            with open(blob_path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            # Blob evicted while a put wrote this pointer
+            self._remove(url_path)
+            return None
+        except OSError:
+            return None
+
+        if hashlib.sha256(content).hexdigest() != digest:
+            logging.warning(f"Discarded corrupt cached image {digest}.")
+            return None
+
+        os.utime(blob_path)
+        return content
+
+    def put(self, url, content):
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = os.path.join(self.blob_dir, digest)
+        try:
+            if not os.path.exists(blob_path):
+                self._write(blob_path, content)
+                with self._lock:
+                    self._size += len(content)
+            self._write(self._url_path(url), digest.encode())
+        except OSError as e:
+            logging.warning(f"Could not cache image {url}: {e}")
+            return
+
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _url_path(self, url):
+        return os.path.join(self.url_dir, hashlib.sha256(url.encode()).hexdigest())
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _write(path, content):
+        # Write then rename so readers never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _evict(self):
+        with self._lock:
+            blobs = []
+            for entry in os.scandir(self.blob_dir):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    blobs.append((stat.st_mtime, stat.st_size, entry.path))
+            blobs.sort()
+
+            size = sum(blob_size for _, blob_size, _ in blobs)
+            removed = set()
+            for _, blob_size, path in blobs:
+                if size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    size -= blob_size
+                    removed.add(os.path.basename(path))
+                except OSError:
+                    continue
+            self._size = size
+
+            if removed:
+                self._remove_pointers(removed)
+
+    def _remove_pointers(self, digests):
+        for entry in os.scandir(self.url_dir):
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            try:
+                with open(entry.path) as f:
+                    if f.read().strip() in digests:
+                        os.remove(entry.path)
+            except OSError:
+                continue
@@ -0,0 +1,138 @@
+import gzip
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from io import StringIO
+import pandas as pd
+from botocore.exceptions import ClientError
+
+
+def payment_dates(values):
+    """
+    Parses the Date column of the ledger: email Date headers (RFC 2822) or ISO dates.
+
+    Returns:
+        DatetimeIndex: UTC dates, NaT where a value could not be parsed.
+    """
+    def parse(value):
+        if not isinstance(value, str):
+            return None
+        try:
+            return parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            pass
+        try:
+            return pd.Timestamp(value)
+        except ValueError:
+            return None
+
+    return pd.to_datetime([parse(value) for value in values], utc=True, errors='coerce')
+
+
+def content_key(row):
+    # Identifies a ledger row without a reference number; the amount may
+    # come back from a CSV as '50', 50, 50.0 or '50.00'
+    amount = str(row['Amount'])
+    if '.' in amount:
+        amount = amount.rstrip('0').rstrip('.')
+    return (' '.join(str(row['Sent_From']).lower().split()), str(row['Date']), amount)
+
+
+class LedgerArchive:
+    """
+    Cold part of the S3 CSV ledger: one CSV object per month of payment date
+    under `prefix` (e.g. ledger_archive/2024-05.csv), and a gzip list of every
+    archived reference number, so duplicates can still be detected without
+    reading the monthly objects.
+
+    Only `python manage.py compact-ledger` writes the archive; run one at a time.
+
+    Methods:
+        references(): Returns the archived reference numbers.
+        add(df, dates): Moves rows into their monthly objects.
+        load_month(month): Returns the archived rows of one month ('YYYY-MM').
+    """
+    def __init__(self, s3_client, bucket_name, prefix='ledger_archive/'):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.references_key = f'{prefix}references.txt.gz'
+        self._lock = threading.Lock()
+        self._etag = None
+        self._references = frozenset()
+
+    def month_key(self, month):
+        return f'{self.prefix}{month}.csv'
+
+    def references(self):
+        """
+        Returns the archived reference numbers, re-read only when the object changed.
+        """
+        with self._lock:
+            etag, references = self._etag, self._references
+
+        kwargs = {'IfNoneMatch': etag} if etag else {}
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.references_key, **kwargs)
+        except self.s3_client.exceptions.NoSuchKey:
+            return frozenset()
+        except ClientError as e:
+            if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304:
+                return references
+            raise
+
+        text = gzip.decompress(response['Body'].read()).decode('utf-8')
+        references = frozenset(text.split('\n')) - {''}
+        with self._lock:
+            self._etag, self._references = response['ETag'], references
+        return references
+
+    def load_month(self, month):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.month_key(month))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return pd.read_csv(StringIO(response['Body'].read().decode('utf-8')))
+
+    def add(self, df, dates):
+        """
+        Merges rows into their monthly objects, then records their references.
+        Rows already archived are skipped (same reference, or for rows without
+        one, same payer, date and amount), so a compaction interrupted before
+        the hot ledger was saved can simply be run again.
+
+        Args:
+            df (DataFrame): Ledger rows to archive.
+            dates (DatetimeIndex): Their parsed payment dates; undated rows go to 'undated'.
+
+        Returns:
+            int: Number of rows written to the archive.
+        """
+        months = pd.Series(dates.strftime('%Y-%m'), index=df.index).fillna('undated')
+        added = 0
+        references = set(self.references())
+        for month, rows in df.groupby(months):
+            rows = rows[~rows['Reference'].isin(references)]
+            if rows.empty:
+                continue
+            existing = self.load_month(month)
+            new_rows = rows
+            unreferenced = rows['Reference'].isna()
+            if existing is not None and unreferenced.any():
+                archived = {content_key(row) for _, row in existing[existing['Reference'].isna()].iterrows()}
+                repeated = [unreferenced[i] and content_key(row) in archived for i, row in rows.iterrows()]
+                new_rows = rows[~pd.Series(repeated, index=rows.index, dtype=bool)]
+            if new_rows.empty:
+                continue
+            merged = new_rows if existing is None else pd.concat([existing, new_rows], ignore_index=True)
+            csv_buffer = StringIO()
+            merged.to_csv(csv_buffer, index=False)
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=self.month_key(month), Body=csv_buffer.getvalue())
+            references.update(new_rows['Reference'].dropna().astype(str))
+            added += len(new_rows)
+            logging.info(f"Archived {len(new_rows)} ledger rows in {self.month_key(month)}.")
+
+        if added:
+            body = gzip.compress('\n'.join(sorted(references)).encode('utf-8'))
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=self.references_key, Body=body)
+        return added
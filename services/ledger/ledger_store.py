@@ -0,0 +1,523 @@
+import logging
+import sqlite3
+import threading
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from botocore.exceptions import ClientError
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from services.ledger.ledger_archive import LedgerArchive, payment_dates
+from services.ledger.payer_index import PayerIndexCache
+from services import metrics
+from config import Config
+
+LEDGER_COLUMNS = ['Reference', 'Sent_From', 'Date', 'Amount', 'Used']
+
+
+def normalize_name(name):
+    """
+    Normalizes a payer name for indexing: lowercase with single spaces.
+    """
+    return ' '.join(str(name).lower().split())
+
+
+class LedgerNotFound(Exception):
+    """
+    Raised when the ledger storage does not exist.
+    """
+
+
+class S3CsvLedger(PayerIndexCache):
+    """
+    Payment ledger stored as a single CSV file in S3.
+
+    The parsed DataFrame is cached in the process together with the object's
+    ETag. Every read is a conditional GET (IfNoneMatch), so an unchanged ledger
+    costs a 304 round-trip with no transfer and no CSV parse. Writes are
+    conditional on the ETag that was read (IfMatch) and refresh the cache with
+    the ETag S3 returns, so our own writes never force a download. A write that
+    loses a race with another process is retried on the fresh ledger.
+
+    With an archive, compact() moves used and old payments out to monthly
+    archive objects, so the object read and rewritten by every request only
+    holds the payments that can still be claimed. References of archived rows
+    are still checked by add_unique_rows.
+
+    Methods:
+        load(): Returns the whole ledger as a DataFrame.
+        unused(): Returns the rows whose 'Used' flag is not set.
+        payer_index(): Returns the PayerIndex of the unused rows.
+        add_unique_rows(rows): Appends rows whose reference is not in the ledger yet, returns them.
+        claim(row_key, reference): Sets 'Used' on an unused row.
+        claim_many(claims): Sets 'Used' on several unused rows with one write.
+        claim_reference(reference): Sets 'Used' on the unused row of a reference number.
+        unclaim(reference): Clears 'Used' on the row of a reference number.
+        compact(hot_days): Moves used rows and rows older than hot_days to the archive.
+    """
+    not_found_message = "CSV file not found in S3."
+    write_attempts = 5
+
+    def __init__(self, s3_client, bucket_name, file_key, archive=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.file_key = file_key
+        self.archive = archive
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._etag = None
+        self._df = None
+        self._init_payer_index_cache()
+
+    def load(self):
+        """
+        Returns the ledger DataFrame. The frame is shared with the cache and must not be modified.
+        """
+        return self._fetch()[1]
+
+    def version(self):
+        """
+        Returns the ETag of the current ledger object.
+        """
+        return self._fetch()[0]
+
+    def _fetch(self):
+        with self._cache_lock:
+            etag, df = self._etag, self._df
+
+        kwargs = {'IfNoneMatch': etag} if etag else {}
+        try:
+            with metrics.call('s3_get'):
+                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.file_key, **kwargs)
+        except self.s3_client.exceptions.NoSuchKey:
+            raise LedgerNotFound(self.not_found_message)
+        except ClientError as e:
+            if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304:
+                return etag, df
+            raise
+
+        csv_content = response['Body'].read().decode('utf-8')
+        df = pd.read_csv(StringIO(csv_content))
+        self._store(response['ETag'], df)
+        return response['ETag'], df
+
+    def _store(self, etag, df):
+        with self._cache_lock:
+            self._etag, self._df = etag, df
+
+    def save(self, df, etag):
+        """
+        Uploads the ledger if it still has the given ETag.
+
+        Returns:
+            str: The new ETag, or None if another process changed the ledger since it was read.
+        """
+        csv_buffer = StringIO()
+        df.to_csv(csv_buffer, index=False)
+        try:
+            with metrics.call('s3_put'):
+                response = self.s3_client.put_object(Bucket=self.bucket_name, Key=self.file_key, Body=csv_buffer.getvalue(), IfMatch=etag)
+        except ClientError as e:
+            if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') in (409, 412):
+                return None
+            raise
+        self._store(response['ETag'], df)
+        return response['ETag']
+
+    def unused(self):
+        df = self.load()
+        return df[df['Used'] != True]
+
+    def payer_index(self):
+        etag, df = self._fetch()
+        return self._cached_payer_index(etag, lambda: df[df['Used'] != True])
+
+    def add_unique_rows(self, rows):
+        with self._lock:
+            for _ in range(self.write_attempts):
+                etag, df = self._fetch()
+                known = set(df['Reference'].values)
+                if self.archive is not None:
+                    known |= self.archive.references()
+                unique_rows = [row for row in rows if row['Reference'] not in known]
+                if not unique_rows:
+                    return []
+                df = pd.concat([df, pd.DataFrame(unique_rows)], ignore_index=True)
+                new_etag = self.save(df, etag)
+                if new_etag:
+                    new_keys = df.index[len(df) - len(unique_rows):]
+                    self._advance_payer_index(etag, new_etag, lambda index: _index_rows(index, new_keys, unique_rows))
+                    return unique_rows
+            raise RuntimeError("The ledger kept changing while adding rows.")
+
+    def claim(self, row_key, reference):
+        with self._lock:
+            for _ in range(self.write_attempts):
+                etag, df = self._fetch()
+                if row_key not in df.index or df.loc[row_key, 'Used'] == True:
+                    return False
+                if not _same_reference(df.loc[row_key, 'Reference'], reference):
+                    return False
+                df = df.copy()
+                df.loc[row_key, 'Used'] = True
+                new_etag = self.save(df, etag)
+                if new_etag:
+                    self._advance_payer_index(etag, new_etag, lambda index: index.discard(row_key))
+                    return True
+            return False
+
+    def claim_many(self, claims):
+        """
+        Args:
+            claims (list): (row_key, reference) pairs.
+
+        Returns:
+            set: The row keys that were claimed; the others were used already.
+        """
+        with self._lock:
+            for _ in range(self.write_attempts):
+                etag, df = self._fetch()
+                keys = [
+                    row_key for row_key, reference in claims
+                    if row_key in df.index and df.loc[row_key, 'Used'] != True and _same_reference(df.loc[row_key, 'Reference'], reference)
+                ]
+                if not keys:
+                    return set()
+                df = df.copy()
+                df.loc[keys, 'Used'] = True
+                new_etag = self.save(df, etag)
+                if new_etag:
+                    self._advance_payer_index(etag, new_etag, lambda index: _discard_rows(index, keys))
+                    return set(keys)
+            return set()
+
+    def claim_reference(self, reference):
+        df = self.load()
+        rows = df.index[(df['Reference'] == reference) & (df['Used'] != True)]
+        return len(rows) > 0 and self.claim(rows[0], reference)
+
+    def unclaim(self, reference):
+        """
+        Gives back a payment claimed for a submission whose processing failed.
+
+        Returns:
+            bool: True if the row was used and is now unused.
+        """
+        with self._lock:
+            for _ in range(self.write_attempts):
+                etag, df = self._fetch()
+                rows = df.index[(df['Reference'] == reference) & (df['Used'] == True)]
+                if len(rows) == 0:
+                    return False
+                row_key = rows[0]
+                df = df.copy()
+                df.loc[row_key, 'Used'] = False
+                new_etag = self.save(df, etag)
+                if new_etag:
+                    row = df.loc[row_key]
+                    self._advance_payer_index(etag, new_etag, lambda index: index.add(row_key, row['Sent_From'], row['Amount'], reference))
+                    return True
+            return False
+
+    def compact(self, hot_days, now=None):
+        """
+        Moves used rows, and unused rows dated more than hot_days ago, to the
+        archive. The archive is written first, so a failure leaves the rows in
+        both places and the next run finishes the move.
+
+        Returns:
+            dict: Rows archived and rows left in the ledger.
+        """
+        if self.archive is None:
+            raise ValueError("The ledger has no archive.")
+        cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=hot_days)
+
+        with self._lock:
+            for _ in range(self.write_attempts):
+                etag, df = self._fetch()
+                dates = payment_dates(df['Date'])
+                # Undated rows stay in the ledger until they are used
+                cold = (df['Used'] == True) | (dates < cutoff)
+                if not cold.any():
+                    return {'archived': 0, 'hot_rows': len(df)}
+                self.archive.add(df[cold], dates[cold.values])
+                hot = df[~cold].reset_index(drop=True)
+                if self.save(hot, etag):
+                    logging.info(f"Compacted the ledger: {int(cold.sum())} rows archived, {len(hot)} left.")
+                    return {'archived': int(cold.sum()), 'hot_rows': len(hot)}
+            raise RuntimeError("The ledger kept changing during compaction.")
+
+
+class MongoLedger(PayerIndexCache):
+    """
+    Payment ledger stored in a MongoDB collection, one document per payment.
+
+    The collection is indexed on 'Reference' (unique) and on the normalized payer
+    name, and a claim is a single conditional update, so two workers can never
+    use the same payment. A counter in the '<collection>_meta' collection is
+    incremented after every change and serves as the ledger version.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.meta = collection.database[f'{collection.name}_meta']
+        self._init_payer_index_cache()
+
+    def ensure_indexes(self):
+        self.collection.create_index('Reference', unique=True, partialFilterExpression={'Reference': {'$type': 'string'}})
+        self.collection.create_index('Sent_From_Norm')
+        self.collection.create_index('Used')
+
+    def load(self):
+        return self._frame(self.collection.find({}).sort('_id', 1))
+
+    def unused(self):
+        return self._frame(self.collection.find({'Used': False}).sort('_id', 1))
+
+    def version(self):
+        document = self.meta.find_one({'_id': 'version'})
+        return document['value'] if document else 0
+
+    def payer_index(self):
+        return self._cached_payer_index(self.version(), self.unused)
+
+    def add_unique_rows(self, rows):
+        if not rows:
+            return []
+        documents = [_ledger_document(row) for row in rows]
+        try:
+            inserted_ids = self.collection.insert_many(documents, ordered=False).inserted_ids
+        except BulkWriteError as e:
+            # Duplicate references are expected and skipped
+            errors = [error for error in e.details['writeErrors'] if error['code'] != 11000]
+            if errors:
+                raise
+            if e.details['nInserted']:
+                # The index is rebuilt on next use
+                self._bump_version()
+            skipped = {error['index'] for error in e.details['writeErrors']}
+            return [row for i, row in enumerate(rows) if i not in skipped]
+
+        new_version = self._bump_version()
+        self._advance_payer_index(new_version - 1, new_version, lambda index: _index_rows(index, inserted_ids, documents))
+        return list(rows)
+
+    def claim(self, row_key, reference):
+        result = self.collection.update_one({'_id': row_key, 'Used': False}, {'$set': {'Used': True}})
+        if result.modified_count != 1:
+            return False
+        new_version = self._bump_version()
+        self._advance_payer_index(new_version - 1, new_version, lambda index: index.discard(row_key))
+        return True
+
+    def claim_many(self, claims):
+        # Each claim is one conditional update already, there is no file to rewrite
+        return {row_key for row_key, reference in claims if self.claim(row_key, reference)}
+
+    def claim_reference(self, reference):
+        document = self.collection.find_one({'Reference': reference, 'Used': False}, {'_id': 1})
+        return document is not None and self.claim(document['_id'], reference)
+
+    def unclaim(self, reference):
+        document = self.collection.find_one_and_update({'Reference': reference, 'Used': True}, {'$set': {'Used': False}})
+        if document is None:
+            return False
+        new_version = self._bump_version()
+        self._advance_payer_index(new_version - 1, new_version, lambda index: index.add(document['_id'], document['Sent_From'], document['Amount'], reference))
+        return True
+
+    def _bump_version(self):
+        document = self.meta.find_one_and_update(
+            {'_id': 'version'}, {'$inc': {'value': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return document['value']
+
+    @staticmethod
+    def _frame(cursor):
+        documents = list(cursor)
+        index = [document.pop('_id') for document in documents]
+        return pd.DataFrame(documents, index=index, columns=LEDGER_COLUMNS)
+
+
+class SqliteLedger(PayerIndexCache):
+    """
+    Payment ledger stored in a local SQLite file.
+
+    Same guarantees as MongoLedger for workers sharing the file: unique
+    references, an index on the normalized payer name and atomic claims.
+    The ledger version is a counter updated in the same transaction as
+    every change.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._init_payer_index_cache()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS ledger ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "reference TEXT UNIQUE, "
+                "sent_from TEXT, "
+                "sent_from_norm TEXT, "
+                "date TEXT, "
+                "amount TEXT, "
+                "used INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS ledger_sent_from_norm ON ledger (sent_from_norm)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS ledger_used ON ledger (used, id)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS ledger_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._connection.execute("INSERT OR IGNORE INTO ledger_meta (key, value) VALUES ('version', 0)")
+
+    def load(self):
+        return self._frame("SELECT id, reference, sent_from, date, amount, used FROM ledger ORDER BY id")
+
+    def unused(self):
+        return self._frame("SELECT id, reference, sent_from, date, amount, used FROM ledger WHERE used = 0 ORDER BY id")
+
+    def version(self):
+        with self._lock:
+            return self._connection.execute("SELECT value FROM ledger_meta WHERE key = 'version'").fetchone()[0]
+
+    def payer_index(self):
+        return self._cached_payer_index(self.version(), self.unused)
+
+    def add_unique_rows(self, rows):
+        documents = [_ledger_document(row) for row in rows]
+        inserted_keys, inserted, added = [], [], []
+        with self._lock, self._connection:
+            for row, document in zip(rows, documents):
+                cursor = self._connection.execute(
+                    "INSERT OR IGNORE INTO ledger (reference, sent_from, sent_from_norm, date, amount, used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (document['Reference'], document['Sent_From'], document['Sent_From_Norm'],
+                     document['Date'], document['Amount'], int(document['Used'])),
+                )
+                if cursor.rowcount == 1:
+                    inserted_keys.append(cursor.lastrowid)
+                    inserted.append(document)
+                    added.append(row)
+            if not inserted:
+                return []
+            new_version = self._bump_version()
+
+        self._advance_payer_index(new_version - 1, new_version, lambda index: _index_rows(index, inserted_keys, inserted))
+        return added
+
+    def claim(self, row_key, reference):
+        with self._lock, self._connection:
+            cursor = self._connection.execute("UPDATE ledger SET used = 1 WHERE id = ? AND used = 0", (int(row_key),))
+            if cursor.rowcount != 1:
+                return False
+            new_version = self._bump_version()
+
+        self._advance_payer_index(new_version - 1, new_version, lambda index: index.discard(row_key))
+        return True
+
+    def claim_many(self, claims):
+        claimed = []
+        with self._lock, self._connection:
+            for row_key, _ in claims:
+                cursor = self._connection.execute("UPDATE ledger SET used = 1 WHERE id = ? AND used = 0", (int(row_key),))
+                if cursor.rowcount == 1:
+                    claimed.append(row_key)
+            if not claimed:
+                return set()
+            new_version = self._bump_version()
+
+        self._advance_payer_index(new_version - 1, new_version, lambda index: _discard_rows(index, claimed))
+        return set(claimed)
+
+    def claim_reference(self, reference):
+        with self._lock:
+            row = self._connection.execute("SELECT id FROM ledger WHERE reference = ? AND used = 0", (reference,)).fetchone()
+        return row is not None and self.claim(row[0], reference)
+
+    def unclaim(self, reference):
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT id, sent_from, amount FROM ledger WHERE reference = ? AND used = 1", (reference,)).fetchone()
+            if row is None:
+                return False
+            self._connection.execute("UPDATE ledger SET used = 0 WHERE id = ?", (row[0],))
+            new_version = self._bump_version()
+
+        self._advance_payer_index(new_version - 1, new_version, lambda index: index.add(row[0], row[1], row[2], reference))
+        return True
+
+    def _bump_version(self):
+        self._connection.execute("UPDATE ledger_meta SET value = value + 1 WHERE key = 'version'")
+        return self._connection.execute("SELECT value FROM ledger_meta WHERE key = 'version'").fetchone()[0]
+
+    def _frame(self, query):
+        with self._lock:
+            rows = self._connection.execute(query).fetchall()
+        df = pd.DataFrame(rows, columns=['id'] + LEDGER_COLUMNS).set_index('id')
+        df['Used'] = df['Used'].astype(bool)
+        return df
+
+
+def _same_reference(a, b):
+    # A row without a reference cannot be told apart from another one, e.g.
+    # after compaction renumbered the ledger, so it is never claimed by key
+    if pd.isna(a) or pd.isna(b):
+        return False
+    return a == b
+
+
+def _index_rows(index, row_keys, rows):
+    # Adds newly written rows to a PayerIndex, skipping the ones already used
+    for row_key, row in zip(row_keys, rows):
+        if row['Used'] != True:
+            index.add(row_key, row['Sent_From'], row['Amount'], row['Reference'])
+
+
+def _discard_rows(index, row_keys):
+    for row_key in row_keys:
+        index.discard(row_key)
+
+
+def _ledger_document(row):
+    amount = str(row['Amount'])
+    if '.' in amount:
+        amount = amount.split('.')[0]
+    return {
+        'Reference': None if pd.isna(row['Reference']) else str(row['Reference']),
+        'Sent_From': row['Sent_From'],
+        'Sent_From_Norm': normalize_name(row['Sent_From']),
+        'Date': row['Date'],
+        'Amount': amount,
+        'Used': bool(row['Used']) if not pd.isna(row['Used']) else False,
+    }
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def create_ledger(backend):
+    """
+    Builds a ledger for the given backend name: 's3', 'mongo' or 'sqlite'.
+    """
+    from services.registry import registry
+    if backend == 's3':
+        s3_client = registry.get('aws').s3_client
+        archive = LedgerArchive(s3_client, Config.S3_BUCKET_NAME, Config.LEDGER_ARCHIVE_PREFIX)
+        return S3CsvLedger(s3_client, Config.S3_BUCKET_NAME, Config.S3_FILE_KEY, archive)
+    if backend == 'mongo':
+        # Indexes are created by `python manage.py ensure-indexes`
+        return MongoLedger(registry.get('database')[Config.LEDGER_COLLECTION])
+    if backend == 'sqlite':
+        return SqliteLedger(Config.LEDGER_SQLITE_PATH)
+    raise ValueError(f"Unknown ledger backend: {backend}")
+
+
+def get_ledger():
+    """
+    Returns the process-wide ledger selected by Config.LEDGER_BACKEND.
+    """
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = create_ledger(Config.LEDGER_BACKEND)
+                logging.info(f"Using the {Config.LEDGER_BACKEND} payment ledger.")
+    return _ledger
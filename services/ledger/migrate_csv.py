@@ -0,0 +1,64 @@
+import argparse
+import logging
+from collections import Counter
+import pandas as pd
+from services.ledger.ledger_archive import content_key
+from services.ledger.ledger_store import create_ledger
+
+
+def migrate_csv(target_backend):
+    """
+    Copies every row of the S3 CSV ledger into another ledger backend.
+
+    Rows whose reference already exists in the target are skipped, and so
+    are rows without a reference already copied with the same payer, date
+    and amount, so the migration can be run again safely. The 'Used' flag is
+    preserved.
+
+    Args:
+        target_backend (str): 'mongo' or 'sqlite'.
+
+    Returns:
+        dict: Number of rows read from the CSV, inserted, and skipped as
+            reference-less rows already in the target.
+    """
+    source = create_ledger('s3')
+    target = create_ledger(target_backend)
+    if hasattr(target, 'ensure_indexes'):
+        # The unique reference index is what skips the rows migrated before
+        target.ensure_indexes()
+
+    df = source.load()
+    rows = df.to_dict('records')
+    rows, skipped = _skip_copied_unreferenced(rows, target.load())
+    inserted = len(target.add_unique_rows(rows))
+    logging.info(f"Migrated {inserted} of {len(df)} ledger rows to {target_backend}.")
+    return {'read': len(df), 'inserted': inserted, 'skipped_unreferenced': skipped}
+
+
+def _skip_copied_unreferenced(rows, existing):
+    """
+    Drops the rows without a reference that a previous run copied already:
+    the unique reference index does not catch them. Identical rows are
+    counted, so a payer who paid the same amount twice keeps both payments.
+    """
+    copied = Counter(content_key(row) for _, row in existing[existing['Reference'].isna()].iterrows())
+    kept, skipped = [], 0
+    for row in rows:
+        if pd.isna(row['Reference']):
+            key = content_key(row)
+            if copied[key] > 0:
+                copied[key] -= 1
+                skipped += 1
+                continue
+        kept.append(row)
+    return kept, skipped
+
+
+if __name__ == '__main__':
+    # python -m services.ledger.migrate_csv --backend mongo
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Import the S3 CSV payment ledger into another ledger backend.')
+    parser.add_argument('--backend', choices=['mongo', 'sqlite'], required=True)
+    args = parser.parse_args()
+    print(migrate_csv(args.backend))
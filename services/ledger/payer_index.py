@@ -0,0 +1,177 @@
+import threading
+from rapidfuzz import fuzz as rfuzz
+from rapidfuzz import process as rprocess
+from thefuzz import fuzz, process, utils
+from services import metrics
+
+
+def _process(name):
+    # The preprocessing thefuzz applies to both sides of token_set_ratio in extractOne
+    return utils.full_process(name, force_ascii=True)
+
+
+class PayerIndex:
+    """
+    Fuzzy-match index over the payer names of the unused ledger rows.
+
+    best_match() gives the same answer as
+    process.extractOne(name, df_unused['Sent_From'], scorer=fuzz.token_set_ratio)
+    whenever that answer reaches the threshold, but it only scores a shortlist:
+
+    - names sharing at least one word with the query (looked up in a word index), and
+    - names sharing no word whose whole word string is within typo distance of the
+      query. Without a shared word token_set_ratio is a plain ratio of the two word
+      strings, so one vectorized rapidfuzz pass over precomputed strings finds them.
+
+    The shortlist is scored with the same thefuzz scorer in ledger order, so scores
+    and tie-breaking are unchanged.
+
+    Methods:
+        best_match(name): Returns the best unused row for a payer name, or None.
+        add(row_key, name, amount, reference): Indexes a new unused row.
+        discard(row_key): Removes a row that was used.
+    """
+    threshold = 95
+
+    def __init__(self, df_unused, version=None):
+        """
+        Args:
+            df_unused (DataFrame): Unused ledger rows in ledger order, indexed by row key.
+            version: Ledger version the rows were read from.
+        """
+        self.version = version
+        self._lock = threading.Lock()
+        self._names = []        # name id -> payer name
+        self._words = []        # name id -> set of processed words
+        self._joined = []       # name id -> sorted words joined by spaces, '' once removed
+        self._ids = {}          # payer name -> name id
+        self._postings = {}     # word -> set of name ids
+        self._rows = {}         # name id -> row keys in ledger order
+        self._row_info = {}     # row key -> (name id, amount, reference)
+
+        for row_key, name, amount, reference in zip(df_unused.index, df_unused['Sent_From'], df_unused['Amount'], df_unused['Reference']):
+            self._add(row_key, name, amount, reference)
+
+    def __len__(self):
+        return len(self._row_info)
+
+    def add(self, row_key, name, amount, reference):
+        with self._lock:
+            self._add(row_key, name, amount, reference)
+
+    def discard(self, row_key):
+        with self._lock:
+            info = self._row_info.pop(row_key, None)
+            if info is None or info[0] is None:
+                return
+
+            name_id = info[0]
+            rows = self._rows[name_id]
+            rows.remove(row_key)
+            if rows:
+                return
+
+            # No unused row left for this payer name
+            del self._rows[name_id]
+            del self._ids[self._names[name_id]]
+            for word in self._words[name_id]:
+                self._postings[word].discard(name_id)
+            self._joined[name_id] = ''
+
+    def best_match(self, name):
+        """
+        Finds the best unused row for a payer name.
+
+        Args:
+            name (str): The payer name to look up.
+
+        Returns:
+            dict: {'name', 'score', 'row_key', 'amount', 'reference'} of the first unused
+                row of the best matching payer, or None if no payer reaches the threshold.
+        """
+        words = set(_process(utils.full_process(name)).split())
+        if not words:
+            return None
+
+        with self._lock:
+            candidates = set()
+            for word in words:
+                candidates.update(self._postings.get(word, ()))
+
+            best = self._score(name, candidates)
+            if best is None or best[1] < 100:
+                # Only a perfect score rules out a better payer sharing no word with the query
+                joined = ' '.join(sorted(words))
+                typo_matches = {
+                    name_id for _, _, name_id in rprocess.extract_iter(
+                        joined, self._joined, scorer=rfuzz.ratio, processor=None, score_cutoff=self.threshold - 1
+                    )
+                }
+                if typo_matches - candidates:
+                    best = self._score(name, candidates | typo_matches)
+
+            if best is None or best[1] < self.threshold:
+                return None
+
+            row_key = self._rows[self._ids[best[0]]][0]
+            _, amount, reference = self._row_info[row_key]
+            return {'name': best[0], 'score': best[1], 'row_key': row_key, 'amount': amount, 'reference': reference}
+
+    def _score(self, name, candidates):
+        if not candidates:
+            return None
+        shortlist = sorted(candidates, key=lambda name_id: self._rows[name_id][0])
+        return process.extractOne(name, [self._names[name_id] for name_id in shortlist], scorer=fuzz.token_set_ratio)
+
+    def _add(self, row_key, name, amount, reference):
+        if not isinstance(name, str):
+            # extractOne skips missing names, keep the row only for the count
+            self._row_info[row_key] = (None, amount, reference)
+            return
+
+        name_id = self._ids.get(name)
+        if name_id is None:
+            name_id = len(self._names)
+            words = set(_process(name).split())
+            self._names.append(name)
+            self._words.append(words)
+            self._joined.append(' '.join(sorted(words)))
+            self._ids[name] = name_id
+            self._rows[name_id] = []
+            for word in words:
+                self._postings.setdefault(word, set()).add(name_id)
+
+        self._rows[name_id].append(row_key)
+        self._row_info[row_key] = (name_id, amount, reference)
+
+
+class PayerIndexCache:
+    """
+    Mixin for ledgers that keeps one PayerIndex per ledger version.
+
+    The index is rebuilt when the ledger changed elsewhere. The ledger's own
+    writes are applied to it in place through _advance_payer_index.
+    """
+    def _init_payer_index_cache(self):
+        self._payer_index = None
+        self._payer_index_lock = threading.Lock()
+
+    def _cached_payer_index(self, version, load_unused):
+        with self._payer_index_lock:
+            index = self._payer_index
+            if index is None or index.version != version:
+                index = PayerIndex(load_unused(), version)
+                self._payer_index = index
+                metrics.LEDGER_UNUSED_ROWS.set(len(index))
+            return index
+
+    def _advance_payer_index(self, old_version, new_version, change):
+        """
+        Applies one of our own writes to the cached index if it was built from
+        the version the write started from; otherwise it is rebuilt on next use.
+        """
+        with self._payer_index_lock:
+            index = self._payer_index
+            if index is not None and index.version == old_version:
+                change(index)
+                index.version = new_version
@@ -0,0 +1,114 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+
+STAGE_SECONDS = Histogram('cfso_stage_seconds', 'Time spent in each stage of a submission.', ['stage'], buckets=_LATENCY_BUCKETS)
+CALL_SECONDS = Histogram('cfso_outbound_call_seconds', 'Latency of outbound calls.', ['service', 'outcome'], buckets=_LATENCY_BUCKETS)
+OCR_CALLS = Counter('cfso_ocr_calls_total', 'OCR engine calls (cache misses).', ['engine', 'outcome'])
+IMAP_SYNCS = Counter('cfso_imap_syncs_total', 'Interac mailbox syncs.', ['outcome'])
+IMAP_FETCHED_BYTES = Counter('cfso_imap_fetched_bytes_total', 'Message bytes downloaded from the Interac mailbox.', ['mode'])
+CACHE_EVENTS = Counter('cfso_cache_events_total', 'Cache lookups.', ['cache', 'result'])
+LEDGER_UNUSED_ROWS = Gauge('cfso_ledger_unused_rows', 'Unused payments in the ledger when the payer index was last built.')
+
+_current = contextvars.ContextVar('cfso_timings', default=None)
+
+
+class Timings:
+    """
+    Durations collected for one submission, saved as its `timings` sub-document.
+
+    Stages are the steps of the pipeline; calls are the outbound requests made
+    while handling the submission (downloads, OCR, S3, IMAP, SMTP, OpenAI,
+    MongoDB), summed per service with their count.
+    """
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._stages = {}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self._stages[name] = round(self._stages.get(name, 0) + seconds * 1000, 1)
+
+    def add_call(self, service, seconds):
+        with self._lock:
+            call = self._calls.setdefault(service, {'count': 0, 'ms': 0})
+            call['count'] += 1
+            call['ms'] = round(call['ms'] + seconds * 1000, 1)
+
+    def as_document(self):
+        with self._lock:
+            return {
+                'total_ms': round((time.perf_counter() - self._start) * 1000, 1),
+                'stages': dict(self._stages),
+                'calls': {service: dict(call) for service, call in self._calls.items()},
+            }
+
+
+@contextmanager
+def track_submission():
+    """
+    Collects the timings of the stages and calls made inside the block,
+    including those run by propagate()-wrapped functions on other threads.
+    """
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(seconds)
+        timings = _current.get()
+        if timings is not None:
+            timings.add_stage(name, seconds)
+
+
+@contextmanager
+def call(service):
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        seconds = time.perf_counter() - start
+        CALL_SECONDS.labels(service, outcome).observe(seconds)
+        timings = _current.get()
+        if timings is not None:
+            timings.add_call(service, seconds)
+
+
+def propagate(function):
+    """
+    Binds function to the current timings, for work submitted to a thread pool.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+
+def cache_event(cache, result, count=1):
+    CACHE_EVENTS.labels(cache, result).inc(count)
+
+
+def render():
+    """
+    Returns the metrics of this process in the Prometheus text format.
+
+    Returns:
+        tuple: (body, content type)
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
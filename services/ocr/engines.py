@@ -0,0 +1,215 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import boto3
+import requests
+from config import Config
+from services.ocr.ocr_cache import ocr_cache
+from services.ocr.preprocess import preprocess_image, signature as preprocess_signature
+from services import metrics
+
+
+class OcrError(Exception):
+    """
+    Raised when an OCR engine cannot read an image.
+    """
+
+
+class OcrEngine:
+    """
+    Interface of an OCR engine.
+
+    recognize() takes the image bytes and returns the words found in reading
+    order, normalized to [{'text': 'WORD'}, ...] whatever the engine's own
+    response format is.
+    """
+    name = None
+
+    def recognize(self, image):
+        raise NotImplementedError
+
+
+class ApiNinjasEngine(OcrEngine):
+    name = 'api_ninjas'
+    api_url = 'https://api.api-ninjas.com/v1/imagetotext'
+
+    def __init__(self, session):
+        self.session = session
+
+    def recognize(self, image):
+        r = self.session.post(
+            self.api_url,
+            files={'image': image},
+            headers={'X-Api-Key': Config.NINJA_API_KEY},
+            timeout=Config.OCR_TIMEOUT,
+        )
+        data = r.json()
+        if isinstance(data, dict):
+            raise OcrError(f"api-ninjas: {data.get('error', data)}")
+        return [{'text': entry['text']} for entry in data]
+
+
+class LocalModelEngine(OcrEngine):
+    name = 'local_model'
+
+    def __init__(self, session):
+        self.session = session
+
+    def recognize(self, image):
+        r = self.session.post(
+            Config.OCR_LOCAL_MODEL_URL,
+            files={'file': ('image.jpg', image, 'image/jpeg')},
+            timeout=Config.OCR_TIMEOUT,
+        )
+        data = r.json()
+        if isinstance(data, dict):
+            if 'error' in data:
+                raise OcrError(f"local model: {data['error']}")
+            data = data.get('text', '')
+        if isinstance(data, str):
+            return [{'text': word} for word in data.split()]
+        return [{'text': entry['text'] if isinstance(entry, dict) else str(entry)} for entry in data]
+
+
+class TextractEngine(OcrEngine):
+    name = 'aws_textract'
+
+    def __init__(self):
+        self.client = boto3.client(
+            'textract',
+            aws_access_key_id=Config.AWS_ACCESS_KEY,
+            aws_secret_access_key=Config.AWS_SECRET_KEY,
+            region_name='us-east-1'
+        )
+
+    def recognize(self, image):
+        response = self.client.detect_document_text(
+            Document={'Bytes': image}
+        )
+        return [{'text': word} for block in response['Blocks'] if block['BlockType'] == 'LINE'
+                for word in block.get('Text', '').split()]
+
+
+# Shared HTTP session for the HTTP based engines
+session = requests.Session()
+
+_engine_factories = {
+    'api_ninjas': lambda: ApiNinjasEngine(session),
+    'local_model': lambda: LocalModelEngine(session),
+    'aws_textract': TextractEngine,
+}
+_engines = {}
+_engines_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=Config.OCR_WORKERS, thread_name_prefix='ocr')
+
+
+def get_engine(name):
+    """
+    Returns the engine with the given name, built once per process.
+    """
+    with _engines_lock:
+        engine = _engines.get(name)
+        if engine is None:
+            if name not in _engine_factories:
+                raise ValueError(f"Unknown OCR engine: {name}")
+            engine = _engine_factories[name]()
+            _engines[name] = engine
+        return engine
+
+
+class PreparedImage:
+    """
+    An uploaded image and, once requested, its preprocessed version.
+
+    Preprocessing runs at most once even when several engines (fallback or
+    hedging) read the same image, and not at all when the OCR cache answers.
+    """
+    def __init__(self, image):
+        self.image = image
+        self._processed = None
+        self._lock = threading.Lock()
+
+    def processed(self):
+        if not Config.OCR_PREPROCESS:
+            return self.image
+        with self._lock:
+            if self._processed is None:
+                self._processed, _ = preprocess_image(self.image)
+            return self._processed
+
+
+def recognize_with(engine, image):
+    """
+    Runs one engine on an image through the OCR cache.
+
+    The cache is keyed by the downloaded bytes, so a hit skips preprocessing too.
+
+    :param engine (OcrEngine): The engine to run.
+    :param image (bytes | PreparedImage): The downloaded image.
+    """
+    if not isinstance(image, PreparedImage):
+        image = PreparedImage(image)
+    cache_name = f"{engine.name}:{preprocess_signature}" if Config.OCR_PREPROCESS else engine.name
+    return ocr_cache.cached(cache_name, image.image, lambda: _timed_recognize(engine, image.processed()))
+
+
+def _timed_recognize(engine, image):
+    outcome = 'error'
+    try:
+        with metrics.call(f'ocr_{engine.name}'):
+            tokens = engine.recognize(image)
+        outcome = 'ok'
+        return tokens
+    finally:
+        metrics.OCR_CALLS.labels(engine.name, outcome).inc()
+
+
+def recognize_image(image, engine_names=None):
+    """
+    Reads an image with the configured engine chain, after preprocessing it
+    (see services/ocr/preprocess.py) when Config.OCR_PREPROCESS is set.
+
+    Engines are tried in order and the next one is used when an engine fails.
+    When Config.OCR_HEDGE_MS is set and an engine has not answered within that
+    budget, the next engine is started as well and the first successful answer
+    wins; the slower call is left to finish in the background.
+
+    :param image (bytes): The image to read.
+    :param engine_names (list): Engine names to use instead of Config.OCR_ENGINES.
+
+    :return: list: Normalized tokens, [{'text': 'WORD'}, ...].
+
+    :raises: OcrError: If every engine failed.
+    """
+    engines = [get_engine(name) for name in (engine_names or Config.OCR_ENGINES)]
+    image = PreparedImage(image)
+    hedge_seconds = Config.OCR_HEDGE_MS / 1000 if Config.OCR_HEDGE_MS > 0 else None
+    errors = []
+
+    next_engine = 0
+    pending = {}
+    while next_engine < len(engines) or pending:
+        if not pending:
+            engine = engines[next_engine]
+            next_engine += 1
+            pending[_executor.submit(metrics.propagate(recognize_with), engine, image)] = engine
+
+        can_hedge = hedge_seconds is not None and next_engine < len(engines) and len(pending) == 1
+        done, _ = wait(pending, timeout=hedge_seconds if can_hedge else None, return_when=FIRST_COMPLETED)
+
+        if not done:
+            # The running engine is over its latency budget, start the next one alongside it
+            engine = engines[next_engine]
+            next_engine += 1
+            logging.info(f"OCR hedged with {engine.name} after {Config.OCR_HEDGE_MS} ms.")
+            pending[_executor.submit(metrics.propagate(recognize_with), engine, image)] = engine
+            continue
+
+        for future in done:
+            engine = pending.pop(future)
+            if future.exception() is None:
+                return future.result()
+            errors.append(f"{engine.name}: {future.exception()}")
+            logging.warning(f"OCR engine {engine.name} failed: {future.exception()}")
+
+    raise OcrError('All OCR engines failed - ' + ' / '.join(errors))
@@ -1,27 +1,13 @@
-import requests
-from dotenv import load_dotenv
-import os
 from services.jotForm.get_image import get_image_from_url
-import boto3
-from config import Config
+from services.ocr.engines import get_engine, recognize_with, recognize_image
 
-ninja_api_key = os.getenv('NINJA_API_KEY')
 
 def image_To_Text(imgURL):
     """
     Converts the image at img_url to text using the API.
     """
     image = get_image_from_url(imgURL)
-
-    api_url = 'https://api.api-ninjas.com/v1/imagetotext'
-    files = {'image': image}
-
-    # Add the API key to the headers
-    headers = {
-        'X-Api-Key': ninja_api_key
-    }
-    r = requests.post(api_url, files=files, headers=headers)
-    return r.json()
+    return recognize_with(get_engine('api_ninjas'), image)
 
 
 
@@ -30,39 +16,27 @@ def image_To_Text_Local_Model(imgURL):
     Converts the image at img_url to text using our local model.
     """
     image = get_image_from_url(imgURL)
-
-    api_url = 'http://54.81.146.167:5000/extract-text'
-    
-    files = {'file': ('image.jpg', image, 'image/jpeg')}
-
-    r = requests.post(api_url, files=files)
-    return r.json()
+    return recognize_with(get_engine('local_model'), image)
 
 
 def image_To_Text_aws_textract(imgURL):
     """
     Converts the image at img_url to text using aws texteract.
     """
-    textract = boto3.client(
-        'textract',
-        aws_access_key_id=Config.AWS_ACCESS_KEY,
-        aws_secret_access_key=Config.AWS_SECRET_KEY,
-        region_name='us-east-1'
-    )
-
     image = get_image_from_url(imgURL)
+    return recognize_with(get_engine('aws_textract'), image)
 
-    response = textract.detect_document_text(
-        Document={'Bytes': image}
-    )
-    
-    result = [{'text': word} for block in response['Blocks'] if block['BlockType'] == 'LINE'
-              for word in block.get('Text', '').split()]
-   
-    return result
+
+def image_to_tokens(imgURL):
+    """
+    Converts the image at img_url to text with the engine chain configured in
+    Config.OCR_ENGINES (with fallback and hedging, see services/ocr/engines.py).
+    """
+    image = get_image_from_url(imgURL)
+    return recognize_image(image)
 
 
 # url = 'https://www.jotform.com/uploads/javanroodiz/243138058138255/6070135805971446099/card.jpg'
 # print(image_To_Text_Local_Model(url))
 
-# python -m services.ocr
\ No newline at end of file
+# python -m services.ocr
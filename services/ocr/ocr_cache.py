@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from services import metrics
+from config import Config
+
+
+class OcrCache:
+    """
+    Two-tier cache of OCR results keyed by engine name and SHA-256 of the image bytes.
+
+    The first tier is an in-process LRU, the second a MongoDB collection shared by
+    all workers, whose documents expire through a TTL index. The index is
+    ensured before the first use of the collection in each process, so OCR text
+    is never stored without it. Failures of the persistent tier are logged and
+    treated as misses, so the cache never breaks OCR.
+
+    Methods:
+        cached(engine, image, compute): Returns the cached result or computes and stores it.
+        stats(): Returns the hit and miss counters of this process.
+        ensure_indexes(): Creates the TTL index of the persistent tier.
+    """
+    def __init__(self, max_entries=256, ttl_seconds=30 * 24 * 3600, collection_getter=None):
+        """
+        Args:
+            max_entries (int): Size of the in-process LRU.
+            ttl_seconds (int): Lifetime of a cached result in both tiers.
+            collection_getter (callable): Returns the MongoDB collection of the persistent tier, or None to disable it.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.collection_getter = collection_getter
+        self._collection = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'errors': 0}
+
+    @staticmethod
+    def key(engine, image):
+        return f"{engine}:{hashlib.sha256(image).hexdigest()}"
+
+    def cached(self, engine, image, compute):
+        """
+        Args:
+            engine (str): Name of the OCR engine, part of the cache key.
+            image (bytes): The image sent to the engine.
+            compute (callable): Runs the OCR call on a miss.
+
+        Returns:
+            The OCR result.
+        """
+        key = self.key(engine, image)
+
+        result = self._memory_get(key)
+        if result is not None:
+            self._count('memory_hits')
+            metrics.cache_event('ocr', 'memory_hit')
+            return result
+
+        result = self._persistent_get(key)
+        if result is not None:
+            self._count('persistent_hits')
+            metrics.cache_event('ocr', 'persistent_hit')
+            self._memory_put(key, result)
+            return result
+
+        self._count('misses')
+        metrics.cache_event('ocr', 'miss')
+        result = compute()
+        if self._cacheable(result):
+            self._memory_put(key, result)
+            self._persistent_put(key, engine, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    @staticmethod
+    def _cacheable(result):
+        # API error payloads must be retried, not cached
+        if isinstance(result, dict):
+            return 'error' not in result
+        return result is not None
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def _memory_put(self, key, result):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_collection(self):
+        if self.collection_getter is None:
+            return None
+        if self._collection is None:
+            collection = self.collection_getter()
+            # Cached OCR text is personal data: only written with its expiry in place
+            collection.create_index('created_at', expireAfterSeconds=self.ttl_seconds)
+            self._collection = collection
+        return self._collection
+
+    def ensure_indexes(self):
+        """
+        Creates the TTL index of the persistent tier (see manage.py ensure-indexes).
+        """
+        self._get_collection()
+
+    def _persistent_get(self, key):
+        try:
+            collection = self._get_collection()
+            if collection is None:
+                return None
+            document = collection.find_one({'_id': key}, {'result': 1})
+            return document['result'] if document else None
+        except Exception as e:
+            self._count('errors')
+            logging.warning(f"OCR cache lookup failed: {e}")
+            return None
+
+    def _persistent_put(self, key, engine, result):
+        try:
+            collection = self._get_collection()
+            if collection is None:
+                return
+            collection.replace_one(
+                {'_id': key},
+                {'engine': engine, 'result': result, 'created_at': datetime.now(timezone.utc)},
+                upsert=True,
+            )
+        except Exception as e:
+            self._count('errors')
+            logging.warning(f"OCR cache write failed: {e}")
+
+
+def _ocr_cache_collection():
+    from services.registry import registry
+    return registry.get('database')[Config.OCR_CACHE_COLLECTION]
+
+
+ocr_cache = OcrCache(
+    max_entries=Config.OCR_CACHE_MEMORY_ENTRIES,
+    ttl_seconds=Config.OCR_CACHE_TTL_DAYS * 24 * 3600,
+    collection_getter=_ocr_cache_collection if Config.OCR_CACHE_PERSISTENT else None,
+)
@@ -0,0 +1,49 @@
+def digits_only(text):
+    return ''.join(filter(str.isdigit, text))
+
+
+class OcrDocument:
+    """
+    Lookup structure built once per OCR response.
+
+    Holds the exact tokens, the digit-only form of every token and the digit
+    strings of up to max_join adjacent numeric tokens, so that a number the OCR
+    split into several words ("0012 3456 789") is still found. Every lookup is a
+    set membership test.
+
+    Methods:
+        has_token(text): True if a token is exactly text.
+        has_number(number): True if a token, or adjacent numeric tokens, read as number.
+    """
+    max_join = 4
+
+    def __init__(self, tokens):
+        """
+        Args:
+            tokens (list): OCR result, [{'text': 'WORD'}, ...] in reading order.
+        """
+        texts = [entry['text'] for entry in tokens]
+        self.tokens = set(texts)
+        self.digit_tokens = {digits_only(text) for text in texts}
+        self.joined_digits = set()
+
+        digit_runs = [digits_only(text) for text in texts]
+        for start in range(len(digit_runs)):
+            joined = digit_runs[start]
+            if not joined:
+                continue
+            for digits in digit_runs[start + 1:start + self.max_join]:
+                if not digits:
+                    break
+                joined += digits
+                self.joined_digits.add(joined)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def has_token(self, text):
+        return text in self.tokens
+
+    def has_number(self, number):
+        digits = digits_only(number)
+        return digits in self.digit_tokens or digits in self.joined_digits
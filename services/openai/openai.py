@@ -1,12 +1,33 @@
+import threading
 import openai
 from config import Config
 
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the OpenAI client shared by the process, created on first use.
+    Its HTTP connections are reused between calls.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = openai.OpenAI(
+                api_key=Config.OPENAI_API_KEY,
+                timeout=Config.OPENAI_TIMEOUT,
+                max_retries=Config.OPENAI_MAX_RETRIES,
+            )
+        return _client
+
+
 class OpenAIService:
     """
     A service class to handle OpenAI API interactions.
     """
     @staticmethod
-    def generate_completion(prompt: str, max_tokens: int = 2000, temperature: float = 0.7) -> str:
+    def generate_completion(prompt: str, max_tokens: int = 2000, temperature: float = 0.7, timeout: float = None) -> str:
         """
         Generate a completion for the given prompt using the OpenAI API.
 
@@ -14,14 +35,15 @@ class OpenAIService:
             prompt (str): The input prompt.
             max_tokens (int): The maximum number of tokens to include in the completion.
             temperature (float): Sampling temperature to control randomness (0.0 to 1.0).
+            timeout (float): Seconds before the request is abandoned, Config.OPENAI_TIMEOUT by default.
 
         Returns:
             str: The generated text completion.
         """
         try:
-            openai.api_key = Config.OPENAI_API_KEY
+            client = get_client() if timeout is None else get_client().with_options(timeout=timeout)
             model = Config.OPENAI_API_MODEL
-            response = openai.chat.completions.create(
+            response = client.chat.completions.create(
                 model=model,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=max_tokens,
@@ -45,9 +67,8 @@ class OpenAIService:
             str: The generated text completion.
         """
         try:
-            openai.api_key = Config.OPENAI_API_KEY
             model = Config.OPENAI_API_MODEL
-            response = openai.chat.completions.create(
+            response = get_client().chat.completions.create(
                 model=model,
                 messages=messages,
                 max_tokens=max_tokens,
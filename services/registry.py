@@ -0,0 +1,69 @@
+import threading
+
+_MISSING = object()
+
+
+class ServiceRegistry:
+    """
+    Builds shared clients and services on first use instead of at import time.
+
+    Factories import their heavy dependencies (boto3, pandas, openai...) inside
+    their own body, so starting a worker only costs the imports of the modules
+    that are actually used. Each service is built once per process; a factory
+    may return None for a feature that is turned off.
+
+    Methods:
+        register(name, factory): Declares how to build a service.
+        get(name): Returns the service, building it on first use.
+        built(name): True if the service was already built.
+    """
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name):
+        instance = self._instances.get(name, _MISSING)
+        if instance is not _MISSING:
+            return instance
+
+        with self._lock:
+            instance = self._instances.get(name, _MISSING)
+            if instance is _MISSING:
+                if name not in self._factories:
+                    raise KeyError(f"Unknown service: {name}")
+                instance = self._factories[name]()
+                self._instances[name] = instance
+            return instance
+
+    def built(self, name):
+        return name in self._instances
+
+
+def _database():
+    from services.database.mongodb import get_database
+    return get_database()
+
+
+def _aws():
+    from services.database.aws_s3 import AWSService
+    return AWSService()
+
+
+def _ledger():
+    from services.ledger.ledger_store import get_ledger
+    return get_ledger()
+
+
+registry = ServiceRegistry()
+registry.register('database', _database)
+registry.register('webhook_collection', lambda: registry.get('database')['webhook_data'])
+registry.register('aws', _aws)
+registry.register('ledger', _ledger)
+# Registered by the manage.py commands only: reconciliation never runs on a webhook request
+registry.register('reconciler', lambda: None)
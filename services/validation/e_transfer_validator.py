@@ -22,6 +22,8 @@ def validate_e_transfer(payer_full_name, amount_of_payment, e_transfer_file_uplo
 
     if validation['success']:
         result['E_Transfer_Success'] = True
+        # The claimed payment, so it can be given back if the submission fails
+        result['E_Transfer_Reference'] = validation.get('reference')
     else:
         result['E_Transfer_Success'] = False
         result['E_Transfer_Error'] = validation['message']
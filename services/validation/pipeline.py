@@ -0,0 +1,141 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+import logging
+from services.validation.pr_card_validator import validate_pr_card
+from services.validation.e_transfer_validator import validate_e_transfer
+from services.jotForm.request_processor import process_request_data
+from services.email.email_service import send_email, create_email_draft, create_email_draft_later
+from services.database.mongodb import save_to_mongodb
+from services.email.imapTools import IMAP
+from services import metrics
+from config import Config
+
+# Shared pool for the e-transfer check; the PR-card check runs on the calling thread.
+_executor = ThreadPoolExecutor(max_workers=Config.VALIDATION_WORKERS, thread_name_prefix='validation')
+
+
+def run_validations(res):
+    """
+    Runs the PR card and e-transfer validations and merges their results into res.
+
+    When Config.CONCURRENT_VALIDATION is enabled both checks run at the same time,
+    otherwise they run one after the other. In both modes res is updated with the
+    PR card result first and the e-transfer result second, so the merged dictionary
+    is identical. In concurrent mode an exception in one check does not stop the
+    other one; both are awaited and the PR card exception takes precedence. The
+    payment claimed by the e-transfer check is then given back, so in both modes
+    a submission whose PR card check raises leaves no payment used.
+
+    :param res: Dictionary returned by process_request_data.
+    :return: The updated res dictionary.
+    """
+    pr_args = (
+        res.get('PR_Status'),
+        res.get('PR_Card_Number'),
+        res.get('Full_Name'),
+        res.get('PR_File_Upload_URLs'),
+    )
+    e_transfer_args = (
+        res.get('Payer_Full_Name'),
+        res.get('Amount_of_Payment'),
+        res.get('E_Transfer_File_Upload_URLs'),
+    )
+
+    if not Config.CONCURRENT_VALIDATION:
+        res.update(_timed_pr_card(*pr_args))
+        res.update(_timed_e_transfer(*e_transfer_args))
+        return res
+
+    e_transfer_future = _executor.submit(metrics.propagate(_timed_e_transfer), *e_transfer_args)
+    try:
+        pr_validation_result = _timed_pr_card(*pr_args)
+    except Exception:
+        # Wait for the e-transfer check even if the PR card check raised
+        wait([e_transfer_future])
+        _unclaim_payment(e_transfer_future)
+        raise
+    e_transfer_validation_result = e_transfer_future.result()
+
+    res.update(pr_validation_result)
+    res.update(e_transfer_validation_result)
+    return res
+
+
+def _unclaim_payment(e_transfer_future):
+    """
+    Gives back the payment claimed by a finished e-transfer check, so the
+    retried submission can claim it again.
+    """
+    if e_transfer_future.exception() is not None:
+        return
+    result = e_transfer_future.result()
+    reference = result.get('E_Transfer_Reference')
+    if not result.get('E_Transfer_Success') or not reference:
+        return
+    try:
+        if not IMAP.ledger().unclaim(reference):
+            logging.warning(f"Payment {reference} could not be given back after the PR card check failed.")
+    except Exception as e:
+        logging.error(f"Error giving back payment {reference}: {e}")
+
+
+def _timed_pr_card(*args):
+    with metrics.stage('validate_pr_card'):
+        return validate_pr_card(*args)
+
+
+def _timed_e_transfer(*args):
+    with metrics.stage('validate_e_transfer'):
+        return validate_e_transfer(*args)
+
+
+def process_submission(data, pr_amount, normal_amount, mail, collection, outbox=None, writer=None, dedup=None, claim=None):
+    """
+    Runs the full pipeline for one JotForm submission: parsing, validation,
+    notification emails, the customer draft and the MongoDB save.
+
+    Flask-Mail needs an application context, so callers outside a request
+    (e.g. job workers) must wrap this call in app.app_context().
+
+    :param data: Parsed JotForm submission.
+    :param pr_amount: The payment amount for PR status.
+    :param normal_amount: The payment amount for normal status.
+    :param mail: Flask-Mail instance.
+    :param collection: MongoDB collection for the submission documents.
+    :param outbox: EmailOutbox for the notification email, or None to send it inline.
+    :param writer: BulkWriter for the submission document, or None to insert it now.
+    :param dedup: SubmissionDedup the submission was claimed with, or None.
+    :param claim: (document_id, dedup key) returned for the claim; the result replaces the claim document.
+    :return: The result of save_to_mongodb.
+
+    The time spent in each stage and outbound call is saved with the submission
+    under 'timings' and exported on /metrics.
+    """
+    with metrics.track_submission() as timings:
+        # Process request data
+        with metrics.stage('process_request_data'):
+            res = process_request_data(data, pr_amount, normal_amount)
+        if claim is not None:
+            res['_id'], res['Dedup_Key'] = claim
+
+        # Validate PR card and e-transfer (concurrently if CONCURRENT_VALIDATION is set)
+        with metrics.stage('validation'):
+            run_validations(res)
+
+        # Send email
+        with metrics.stage('send_email'):
+            send_email(res.get('PR_Status'), mail, res, outbox)
+
+        # Generate a professional email draft in Sponsor email to inform a customer about issues with their course registration submitted
+        if res['PR_Success'] == False or res['E_Transfer_Success'] == False:
+            with metrics.stage('email_draft'):
+                if Config.BACKGROUND_DRAFTS:
+                    create_email_draft_later(res, collection)
+                else:
+                    create_email_draft(res)
+
+        # Save to MongoDB, with the timings measured so far
+        res['timings'] = timings.as_document()
+        with metrics.stage('save'):
+            if claim is not None:
+                return dedup.complete(res['_id'], res, Config.WEBHOOK_WRITE_CONCERN)
+            return save_to_mongodb(collection, res, writer, Config.WEBHOOK_WRITE_CONCERN)
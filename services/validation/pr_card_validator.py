@@ -1,28 +1,73 @@
-from services.ocr.image_to_text import image_To_Text
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import Config
+from services import metrics
+from services.ocr.image_to_text import image_to_tokens
+from services.ocr.ocr_document import OcrDocument
+
+# Shared pool for the per-upload checks; each submission uses at most Config.PR_IMAGE_CONCURRENCY of it.
+_executor = ThreadPoolExecutor(max_workers=Config.PR_IMAGE_WORKERS, thread_name_prefix='pr-image')
 
 
 def validate_pr_card(pr_status, pr_card_number, full_name, pr_file_upload_urls):
     """
     Validates the PR card information.
 
+    The uploads are downloaded and read concurrently, at most
+    Config.PR_IMAGE_CONCURRENCY at a time. As soon as one upload validates, the
+    uploads that have not started are cancelled and the running ones are ignored.
+
     :param pr_status: Boolean indicating PR status.
     :param pr_card_number: PR card number.
     :param full_name: Full name of the individual.
     :param pr_file_upload_urls: List of file URLs for the PR card.
-    :param image_validator: Validator service for PR card validation.
-    :return: Dictionary with PR card validation results.
+    :return: Dictionary with PR card validation results, including PR_Image_Results,
+        one {'url', 'status', 'error'} entry per upload with status 'passed', 'failed',
+        'error' (the check raised) or 'skipped' (not needed after another upload passed).
     """
     result = {'PR_Success': None, 'PR_Error': None}
     if not pr_status:
         return result
 
+    urls = list(pr_file_upload_urls or [])
+    outcomes = [{'url': url, 'status': 'skipped', 'error': None} for url in urls]
+    first_exception = None
     is_pr_card_valid = False
-    for url in pr_file_upload_urls:
-        validation = check_PR_Card(pr_card_number, full_name, url)
-        if validation['success']:
-            is_pr_card_valid = True
-            break
 
+    next_url = 0
+    pending = {}
+    try:
+        while not is_pr_card_valid and (next_url < len(urls) or pending):
+            while next_url < len(urls) and len(pending) < Config.PR_IMAGE_CONCURRENCY:
+                pending[_executor.submit(metrics.propagate(check_PR_Card), pr_card_number, full_name, urls[next_url])] = next_url
+                next_url += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                position = pending.pop(future)
+                try:
+                    validation = future.result()
+                except Exception as e:
+                    logging.warning(f"PR card check failed for {urls[position]}: {e}")
+                    outcomes[position].update(status='error', error=str(e))
+                    first_exception = first_exception or e
+                    continue
+
+                if validation['success']:
+                    outcomes[position]['status'] = 'passed'
+                    is_pr_card_valid = True
+                else:
+                    outcomes[position].update(status='failed', error=validation.get('error'))
+    finally:
+        # Uploads still queued are not needed any more; running ones finish in the background
+        for future in pending:
+            future.cancel()
+
+    if not is_pr_card_valid and first_exception is not None:
+        # Same as checking the uploads one by one: an unreadable upload fails the request
+        raise first_exception
+
+    result['PR_Image_Results'] = outcomes
     if is_pr_card_valid:
         result['PR_Success'] = True
     else:
@@ -47,20 +92,14 @@ def check_PR_Card(prNumber, fullName, imgURL):
     - 'PR_Success' (bool): True if PR card validation is successful, False otherwise.
     - 'PR_Error' (str, optional): Error message if validation fails.
     """
-    json_res = image_To_Text(imgURL)
+    document = OcrDocument(image_to_tokens(imgURL))
 
     list_name = [name.upper() for name in fullName.split(' ')]
 
     # List of text items to look for
     text_looking_for = list_name + ["Government", "of", "Canada", "PERMANENT", "RESIDENT", "CARD", "CARTE"]
 
-    text_validation = []
-
-    # Check each item in text_looking_for against the text fields in json_res
-    for item in text_looking_for:
-        found = any(entry['text'] == item for entry in json_res)
-        text_validation.append("true" if found else "false")
-
+    text_validation = ["true" if document.has_token(item) else "false" for item in text_looking_for]
 
     print("PR card text_validation: ", text_validation)
 
@@ -68,17 +107,10 @@ def check_PR_Card(prNumber, fullName, imgURL):
     text_validation_result = True if all(r == "true" for r in text_validation) else False
 
     if(text_validation_result):
-        # List of number to look for
+        # List of number to look for, also found when the OCR split it across adjacent words
         number_looking_for = [prNumber]
 
-        number_validation = []
-
-        def normalize(text):
-            return ''.join(filter(str.isdigit, text))
-        
-        for item in number_looking_for:
-            number_validation.append("true" if normalize(item) in [normalize(entry["text"]) for entry in json_res] else "false")
-
+        number_validation = ["true" if document.has_number(item) else "false" for item in number_looking_for]
 
         print("PR card number_validation: ", number_validation)
 
@@ -90,4 +122,4 @@ def check_PR_Card(prNumber, fullName, imgURL):
         else:
             return { 'success': False, 'error': 'PR card number dosn not match' }
     else:
-        return { 'success': False, 'error': 'PR card text dosn not match' }
\ No newline at end of file
+        return { 'success': False, 'error': 'PR card text dosn not match' }
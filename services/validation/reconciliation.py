@@ -0,0 +1,226 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from pymongo import ReturnDocument
+from services.email.imapTools import IMAP
+from services.ledger.ledger_store import LedgerNotFound
+from services.ledger.payer_index import PayerIndex
+from services.registry import registry
+from config import Config
+
+PENDING_FIELDS = ['Payer_Full_Name', 'Amount_of_Payment', 'created_at']
+
+# Submissions saved with a buffered write may carry a created_at slightly older
+# than documents already read; this much overlap is re-read on every refresh.
+_REFRESH_OVERLAP = timedelta(minutes=1)
+
+
+def create_reconciler(app, mail):
+    """
+    Builds the Reconciler that marks waiting submissions paid and sends their
+    confirmation with the app's mail settings (and outbox, if enabled), or
+    None when RECONCILE_PAYMENTS is off. Registered as the 'reconciler' service.
+    """
+    if not Config.RECONCILE_PAYMENTS:
+        return None
+    from services.email.email_service import send_confirmation
+
+    collection = registry.get('webhook_collection')
+    outbox = registry.get('outbox')
+
+    def confirm(submission):
+        with app.app_context():
+            send_confirmation(submission, mail, collection, outbox)
+
+    return Reconciler(
+        collection, registry.get('ledger'), confirm,
+        window_days=Config.RECONCILE_WINDOW_DAYS, rebuild_seconds=Config.RECONCILE_REBUILD_SECONDS,
+    )
+
+
+class PendingSubmissions:
+    """
+    Submissions waiting for their payment, grouped by expected amount, with a
+    PayerIndex over the payer names of each group. A new payment is matched
+    with one index lookup for its amount, using the same fuzzy rule as
+    IMAP.validate_reference_by_name; the oldest submission wins a tie.
+    """
+    def __init__(self):
+        self._by_amount = {}    # amount -> PayerIndex keyed by submission _id
+        self._amounts = {}      # submission _id -> amount
+
+    def __len__(self):
+        return len(self._amounts)
+
+    def __contains__(self, submission_id):
+        return submission_id in self._amounts
+
+    def add(self, submission):
+        name = (submission.get('Payer_Full_Name') or '').lower()
+        amount = submission.get('Amount_of_Payment')
+        if not name or amount is None or submission['_id'] in self._amounts:
+            return
+        amount = IMAP.clean_amount(str(amount))
+        index = self._by_amount.get(amount)
+        if index is None:
+            index = self._by_amount[amount] = PayerIndex(pd.DataFrame(columns=['Sent_From', 'Amount', 'Reference']))
+        index.add(submission['_id'], name, amount, None)
+        self._amounts[submission['_id']] = amount
+
+    def discard(self, submission_id):
+        amount = self._amounts.pop(submission_id, None)
+        if amount is not None:
+            self._by_amount[amount].discard(submission_id)
+
+    def match(self, name, amount):
+        """
+        Returns:
+            The _id of the submission that paid `amount` under payer `name`, or None.
+        """
+        index = self._by_amount.get(amount)
+        if index is None:
+            return None
+        best_match = index.best_match(name)
+        return best_match['row_key'] if best_match else None
+
+
+class Reconciler:
+    """
+    Matches newly ingested ledger rows to the submissions that failed because
+    their payment had not arrived yet. In the manage.py commands that register
+    it, IMAP.add_payments calls it with the rows it added; sweep() catches the
+    payments ingested by web workers, which do not reconcile.
+
+    A matched submission is marked paid (E_Transfer_Success, Reconciled_At,
+    Reconciled_Reference), the ledger row is claimed like a webhook would, and
+    the confirmation is handed to `confirm` when the submission has no other
+    failing check. The pending index is read from webhook_data incrementally
+    before each batch of rows and rebuilt every rebuild_seconds, which also
+    drops submissions cleared by other means.
+
+    Methods:
+        reconcile(rows): Matches new ledger rows, returns the reconciled submission ids.
+        refresh(): Loads the submissions saved since the last refresh.
+        sweep(): Matches every unused ledger row.
+    """
+    def __init__(self, collection, ledger, confirm=None, window_days=30, rebuild_seconds=3600):
+        """
+        Args:
+            collection (Collection): The webhook_data collection.
+            ledger: The payment ledger (services/ledger/ledger_store.py).
+            confirm (callable): Called with the updated submission document to send its confirmation.
+            window_days (int): Age of the oldest submission still waiting for a payment.
+            rebuild_seconds (int): Interval between full reloads of the pending submissions.
+        """
+        self.collection = collection
+        self.ledger = ledger
+        self.confirm = confirm
+        self.window_days = window_days
+        self.rebuild_seconds = rebuild_seconds
+        self.pending = PendingSubmissions()
+        self._loaded_until = None
+        self._built_at = None
+        # Webhook requests may sync the mailbox concurrently
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        now = datetime.now(timezone.utc)
+        if self._built_at is None or time.monotonic() - self._built_at > self.rebuild_seconds:
+            self.pending = PendingSubmissions()
+            self._loaded_until = now - timedelta(days=self.window_days)
+            self._built_at = time.monotonic()
+            since = self._loaded_until
+        else:
+            since = self._loaded_until - _REFRESH_OVERLAP
+
+        # Uses the created_at index of webhook_data
+        cursor = self.collection.find(
+            {'created_at': {'$gt': since}, 'E_Transfer_Success': False},
+            {field: 1 for field in PENDING_FIELDS},
+        ).sort('created_at', 1)
+        for submission in cursor:
+            self.pending.add(submission)
+        self._loaded_until = now
+
+    def reconcile(self, rows):
+        """
+        Args:
+            rows (list): Ledger rows just added, as built by IMAP.parse_payment.
+
+        Returns:
+            list: The _id of every submission marked paid.
+        """
+        reconciled = []
+        with self._lock:
+            self.refresh()
+            for row in rows:
+                submission_id = self._reconcile_row(row)
+                if submission_id is not None:
+                    reconciled.append(submission_id)
+        if reconciled:
+            logging.info(f"Reconciled {len(reconciled)} submissions with new payments.")
+        return reconciled
+
+    def sweep(self):
+        """
+        Reconciles against all the unused payments of the ledger, including the
+        ones added by a webhook's mailbox fallback.
+
+        Returns:
+            list: The _id of every submission marked paid.
+        """
+        try:
+            rows = self.ledger.unused().to_dict('records')
+        except LedgerNotFound as e:
+            logging.error(f"Reconciliation sweep skipped: {e}")
+            return []
+        return self.reconcile(rows) if rows else []
+
+    def _reconcile_row(self, row):
+        reference = row.get('Reference')
+        if reference is None or pd.isna(reference):
+            # The payment could not be claimed by reference
+            return None
+        name = str(row['Sent_From']).lower()
+        amount = IMAP.clean_amount(str(row['Amount']))
+
+        while True:
+            submission_id = self.pending.match(name, amount)
+            if submission_id is None:
+                return None
+            self.pending.discard(submission_id)
+
+            fields = {
+                'E_Transfer_Success': True,
+                'E_Transfer_Error': None,
+                'Reconciled_At': datetime.now(timezone.utc),
+                'Reconciled_Reference': reference,
+            }
+            before = self.collection.find_one_and_update(
+                {'_id': submission_id, 'E_Transfer_Success': False},
+                {'$set': fields},
+                return_document=ReturnDocument.BEFORE,
+            )
+            if before is None:
+                # Paid or expired in the meantime, try the next best submission
+                continue
+
+            if not self.ledger.claim_reference(reference):
+                # A webhook used the payment first
+                self.collection.update_one(
+                    {'_id': submission_id},
+                    {'$set': {'E_Transfer_Success': False, 'E_Transfer_Error': before.get('E_Transfer_Error')},
+                     '$unset': {'Reconciled_At': '', 'Reconciled_Reference': ''}},
+                )
+                self.pending.add(before)
+                return None
+
+            submission = {**before, **fields}
+            if self.confirm is not None and (not submission.get('PR_Status') or submission.get('PR_Success')):
+                try:
+                    self.confirm(submission)
+                except Exception as e:
+                    logging.error(f"Confirmation for reconciled submission {submission_id} not sent: {e}")
+            return submission_id
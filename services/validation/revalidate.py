@@ -0,0 +1,207 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from services.email.imapTools import IMAP
+from services.ledger.ledger_store import LedgerNotFound
+from services.ledger.payer_index import PayerIndex
+from services.validation.pr_card_validator import validate_pr_card
+from config import Config
+
+FIELDS = [
+    'Full_Name', 'PR_Status', 'PR_Card_Number', 'PR_File_Upload_URLs', 'PR_Success',
+    'Payer_Full_Name', 'Amount_of_Payment', 'E_Transfer_File_Upload_URLs', 'E_Transfer_Success',
+]
+
+
+def failed_submissions(collection, since, until=None, limit=None):
+    """
+    Returns the submissions saved in [since, until) whose PR card or e-transfer check failed.
+    """
+    created_at = {'$gte': since}
+    if until is not None:
+        created_at['$lt'] = until
+    cursor = collection.find(
+        {'created_at': created_at, '$or': [{'E_Transfer_Success': False}, {'PR_Success': False}]},
+        {field: 1 for field in FIELDS},
+    ).sort('created_at', 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    return list(cursor)
+
+
+def match_payments(submissions, ledger):
+    """
+    Matches the submissions to unused payments the way
+    IMAP.validate_reference_by_name does, on one index built for the batch,
+    then claims all the matched payments with one ledger write. Submissions
+    are matched oldest first, and a payment matched once is not offered to
+    the next ones.
+
+    Returns:
+        dict: _id -> e-transfer fields for each submission.
+    """
+    results = {}
+    if not submissions:
+        return results
+
+    try:
+        index = PayerIndex(ledger.unused())
+    except LedgerNotFound as e:
+        return {submission['_id']: {'E_Transfer_Success': False, 'E_Transfer_Error': str(e)} for submission in submissions}
+
+    matched = {}
+    for submission in submissions:
+        name = (submission.get('Payer_Full_Name') or '').lower()
+        if not submission.get('E_Transfer_File_Upload_URLs'):
+            results[submission['_id']] = {'E_Transfer_Success': False, 'E_Transfer_Error': 'No e-transfer files provided'}
+            continue
+        if len(index) == 0:
+            results[submission['_id']] = {'E_Transfer_Success': False, 'E_Transfer_Error': 'No unused records found.'}
+            continue
+
+        amount = IMAP.clean_amount(submission.get('Amount_of_Payment'))
+        best_match = index.best_match(name)
+        if best_match is None:
+            results[submission['_id']] = {'E_Transfer_Success': False, 'E_Transfer_Error': f"No payment found for {name}."}
+        elif str(best_match['amount']) != amount:
+            results[submission['_id']] = {'E_Transfer_Success': False, 'E_Transfer_Error': f"Payment amount mismatch. Expected: {amount}, Found: {best_match['amount']}."}
+        else:
+            matched[submission['_id']] = (best_match['row_key'], best_match['reference'], name)
+            index.discard(best_match['row_key'])
+
+    claimed = ledger.claim_many([(row_key, reference) for row_key, reference, _ in matched.values()]) if matched else set()
+    for submission_id, (row_key, _, name) in matched.items():
+        if row_key in claimed:
+            results[submission_id] = {'E_Transfer_Success': True, 'E_Transfer_Error': None}
+        else:
+            # Used by a webhook while the batch ran; the next run looks again
+            results[submission_id] = {'E_Transfer_Success': False, 'E_Transfer_Error': f"Payment for {name} was used by another submission."}
+    return results
+
+
+def revalidate_pr_card(submission):
+    return validate_pr_card(
+        submission.get('PR_Status'),
+        submission.get('PR_Card_Number'),
+        submission.get('Full_Name'),
+        submission.get('PR_File_Upload_URLs'),
+    )
+
+
+def revalidate(collection, since, until=None, workers=None, limit=None, days=44, confirm=None):
+    """
+    Re-validates the failed submissions of a time window in one batch: one
+    incremental Interac sync, one ledger load matched in memory with a single
+    ledger write for the claims, a parallel pass over the PR card uploads and
+    one bulk update of the submissions. The submissions this batch cleared
+    are then handed to `confirm`, like the reconciler does with the ones it pays.
+
+    Args:
+        collection (Collection): The webhook_data collection.
+        since (datetime): Start of the window (created_at).
+        until (datetime): End of the window, now by default.
+        workers (int): Submissions checked at the same time, Config.VALIDATION_WORKERS by default.
+        limit (int): Maximum number of submissions, all by default.
+        days (int): Size of the mailbox window used when no sync cursor exists.
+        confirm (callable): Called with each cleared submission document to send its confirmation, or None.
+
+    Returns:
+        dict: Counts, time spent per step and throughput.
+    """
+    report = {'selected': 0, 'cleared': 0, 'still_failing': 0, 'errors': 0, 'updated': 0, 'confirmed': 0}
+    timings = {}
+    start = time.perf_counter()
+
+    submissions = failed_submissions(collection, since, until, limit)
+    report['selected'] = len(submissions)
+    timings['select'] = time.perf_counter() - start
+    if not submissions:
+        return _report(report, timings, start)
+
+    fields = {submission['_id']: {} for submission in submissions}
+    unpaid = [submission for submission in submissions if submission.get('E_Transfer_Success') is False]
+    if unpaid:
+        step = time.perf_counter()
+        synced = IMAP.sync_mailbox(days)
+        report['new_payments'] = None if synced is None else len(synced)
+        timings['sync'] = time.perf_counter() - step
+
+        if synced:
+            # The sync hands new payments to the reconciler, which may have paid some of these already
+            still_unpaid = {document['_id'] for document in collection.find(
+                {'_id': {'$in': [submission['_id'] for submission in unpaid]}, 'E_Transfer_Success': False}, {'_id': 1},
+            )}
+            for submission in unpaid:
+                if submission['_id'] not in still_unpaid:
+                    submission['E_Transfer_Success'] = True
+            unpaid = [submission for submission in unpaid if submission['_id'] in still_unpaid]
+
+        step = time.perf_counter()
+        for submission_id, result in match_payments(unpaid, IMAP.ledger()).items():
+            fields[submission_id].update(result)
+        timings['payments'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    failed = set()
+    pr_failures = [submission for submission in submissions if submission.get('PR_Success') is False]
+
+    def check(submission):
+        try:
+            return submission, revalidate_pr_card(submission), None
+        except Exception as e:
+            return submission, None, e
+
+    with ThreadPoolExecutor(max_workers=workers or Config.VALIDATION_WORKERS, thread_name_prefix='revalidate') as executor:
+        for submission, result, error in executor.map(check, pr_failures):
+            if error is not None:
+                logging.error(f"PR card re-validation of {submission['_id']} failed: {error}")
+                failed.add(submission['_id'])
+                continue
+            fields[submission['_id']].update(result)
+    timings['pr_cards'] = time.perf_counter() - step
+
+    updates = []
+    cleared = []
+    now = datetime.now(timezone.utc)
+    for submission in submissions:
+        changes = fields[submission['_id']]
+        if submission['_id'] in failed:
+            report['errors'] += 1
+        merged = {**submission, **changes}
+        if merged.get('E_Transfer_Success') is not False and merged.get('PR_Success') is not False:
+            report['cleared'] += 1
+            if changes:
+                # Without changes it was cleared by the reconciler, which confirmed it
+                cleared.append(submission['_id'])
+        else:
+            report['still_failing'] += 1
+        if changes:
+            changes['Revalidated_At'] = now
+            updates.append(UpdateOne({'_id': submission['_id']}, {'$set': changes}))
+
+    if updates:
+        step = time.perf_counter()
+        report['updated'] = collection.bulk_write(updates, ordered=False).modified_count
+        timings['update'] = time.perf_counter() - step
+
+    if confirm is not None and cleared:
+        step = time.perf_counter()
+        for submission in collection.find({'_id': {'$in': cleared}}):
+            try:
+                confirm(submission)
+                report['confirmed'] += 1
+            except Exception as e:
+                logging.error(f"Confirmation for re-validated submission {submission['_id']} not sent: {e}")
+        timings['confirm'] = time.perf_counter() - step
+
+    return _report(report, timings, start)
+
+
+def _report(report, timings, start):
+    seconds = time.perf_counter() - start
+    report['seconds'] = round(seconds, 3)
+    report['steps'] = {name: round(value, 3) for name, value in timings.items()}
+    report['per_second'] = round(report['selected'] / seconds, 1) if seconds else None
+    return report
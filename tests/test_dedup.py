@@ -0,0 +1,123 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from services.jobs.dedup import SubmissionDedup, submission_key
+
+
+class Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeCollection:
+    """The few webhook_data calls SubmissionDedup makes, with the unique Dedup_Key index."""
+    def __init__(self):
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def with_options(self, **kwargs):
+        return self
+
+    def _matches(self, document, query):
+        for field, value in query.items():
+            if isinstance(value, dict) and '$ne' in value:
+                if document.get(field) == value['$ne']:
+                    return False
+            elif document.get(field) != value:
+                return False
+        return True
+
+    def insert_one(self, document):
+        with self.lock:
+            key = document.get('Dedup_Key')
+            if isinstance(key, str) and any(d.get('Dedup_Key') == key for d in self.documents.values()):
+                raise DuplicateKeyError('Dedup_Key')
+            document.setdefault('_id', ObjectId())
+            self.documents[document['_id']] = dict(document)
+            return Result(inserted_id=document['_id'])
+
+    def find_one(self, query, projection=None):
+        with self.lock:
+            for document in self.documents.values():
+                if self._matches(document, query):
+                    return dict(document)
+
+    def find_one_and_update(self, query, update, projection=None, return_document=None):
+        with self.lock:
+            for document in self.documents.values():
+                if self._matches(document, query):
+                    document.update(update['$set'])
+                    return dict(document)
+
+    def replace_one(self, query, replacement):
+        with self.lock:
+            if query['_id'] not in self.documents:
+                return Result(matched_count=0)
+            self.documents[query['_id']] = dict(replacement)
+            return Result(matched_count=1)
+
+    def delete_one(self, query):
+        with self.lock:
+            document = self.documents.get(query['_id'])
+            if document is not None and self._matches(document, query):
+                del self.documents[query['_id']]
+
+
+def test_submission_key_prefers_the_submission_id():
+    assert submission_key({'q1': 'a'}, '123') == 'submission:123'
+    assert submission_key({'q1': 'a'}) == submission_key({'q1': 'a'})
+    assert submission_key({'q1': 'a'}).startswith('sha256:')
+    assert submission_key({'q1': 'a'}) != submission_key({'q1': 'b'})
+
+
+def test_first_delivery_claims_and_a_duplicate_gets_the_result():
+    dedup = SubmissionDedup(FakeCollection(), wait_seconds=1)
+    document_id, result = dedup.claim('submission:1')
+    assert document_id is not None and result is None
+
+    dedup.complete(document_id, {'Dedup_Key': 'submission:1', 'E_Transfer_Success': True})
+    duplicate_id, result = dedup.claim('submission:1')
+    assert duplicate_id is None
+    assert result['status'] == 'done' and result['document_id'] == str(document_id)
+
+
+def test_local_duplicate_waits_for_the_original():
+    dedup = SubmissionDedup(FakeCollection(), wait_seconds=5)
+    document_id, _ = dedup.claim('submission:2')
+    threading.Timer(0.1, dedup.complete, (document_id, {'Dedup_Key': 'submission:2'})).start()
+
+    duplicate_id, result = dedup.claim('submission:2')
+    assert duplicate_id is None and result['status'] == 'done'
+
+
+def test_duplicate_of_a_job_does_not_wait():
+    dedup = SubmissionDedup(FakeCollection(), wait_seconds=5)
+    dedup.claim('submission:3', local=False)
+
+    start = time.monotonic()
+    duplicate_id, result = dedup.claim('submission:3', local=False)
+    assert duplicate_id is None and result['status'] == 'processing'
+    assert time.monotonic() - start < 1
+
+
+def test_expired_claim_is_taken_over():
+    collection = FakeCollection()
+    dedup = SubmissionDedup(collection, wait_seconds=0, lease_seconds=60)
+    document_id, _ = dedup.claim('submission:4', local=False)
+    collection.documents[document_id]['Dedup_Claimed_At'] = datetime.now(timezone.utc) - timedelta(seconds=120)
+
+    taken_id, result = dedup.claim('submission:4', local=False)
+    assert taken_id == document_id and result is None
+    # The claim is fresh again, so a third delivery is a duplicate
+    assert dedup.claim('submission:4', local=False)[0] is None
+
+
+def test_released_claim_is_processed_again():
+    dedup = SubmissionDedup(FakeCollection(), wait_seconds=0)
+    document_id, _ = dedup.claim('submission:5')
+    dedup.release(document_id, 'submission:5')
+
+    retry_id, result = dedup.claim('submission:5')
+    assert retry_id is not None and retry_id != document_id and result is None
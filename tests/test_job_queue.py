@@ -0,0 +1,132 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from services.jobs.job_queue import JobQueue
+
+
+class Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def matches(document, query):
+    for field, condition in query.items():
+        if field == '$or':
+            if not any(matches(document, option) for option in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = document.get(field)
+            if '$lt' in condition and not (value is not None and value < condition['$lt']):
+                return False
+            if '$gte' in condition and not (value is not None and value >= condition['$gte']):
+                return False
+        elif document.get(field) != condition:
+            return False
+    return True
+
+
+def apply(document, update):
+    document.update(update.get('$set', {}))
+    for field, step in update.get('$inc', {}).items():
+        document[field] = document.get(field, 0) + step
+    for field in update.get('$unset', {}):
+        document.pop(field, None)
+
+
+class FakeCollection:
+    """The few webhook_jobs calls JobQueue makes."""
+    def __init__(self):
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def insert_one(self, document):
+        with self.lock:
+            document['_id'] = ObjectId()
+            self.documents[document['_id']] = dict(document)
+            return Result(inserted_id=document['_id'])
+
+    def find_one(self, query, projection=None):
+        with self.lock:
+            document = self.documents.get(query['_id'])
+            if document is None:
+                return None
+            return {field: value for field, value in document.items() if field not in (projection or {})}
+
+    def find_one_and_update(self, query, update, sort=None, return_document=None):
+        with self.lock:
+            candidates = sorted((d for d in self.documents.values() if matches(d, query)), key=lambda d: d['created_at'])
+            if not candidates:
+                return None
+            apply(candidates[0], update)
+            return dict(candidates[0])
+
+    def update_one(self, query, update):
+        with self.lock:
+            apply(self.documents[query['_id']], update)
+
+    def update_many(self, query, update):
+        with self.lock:
+            for document in self.documents.values():
+                if matches(document, query):
+                    apply(document, update)
+
+
+def wait_for(queue, job_id, statuses=('done', 'failed'), timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} is still {job['status']}")
+
+
+def test_job_runs_and_stores_its_result():
+    queue = JobQueue(FakeCollection(), handler=lambda payload: {'sum': payload['a'] + payload['b']}, workers=1, poll_interval=0.05)
+    queue.start()
+    job = wait_for(queue, queue.enqueue({'a': 1, 'b': 2}))
+    assert job['status'] == 'done' and job['result'] == {'sum': 3} and job['attempts'] == 1
+    assert 'payload' not in job and 'lease_until' not in job
+
+
+def test_failing_handler_marks_the_job_failed():
+    def handler(payload):
+        raise ValueError('bad submission')
+
+    queue = JobQueue(FakeCollection(), handler=handler, workers=1, poll_interval=0.05)
+    queue.start()
+    job = wait_for(queue, queue.enqueue({}))
+    assert job['status'] == 'failed' and job['error'] == 'bad submission'
+
+
+def test_expired_lease_is_claimed_again():
+    collection = FakeCollection()
+    queue = JobQueue(collection, handler=lambda payload: 'ok', workers=1, poll_interval=0.05)
+    job_id = queue.enqueue({})
+    # A worker of a process that died
+    assert queue._claim()['_id'] == ObjectId(job_id)
+    collection.documents[ObjectId(job_id)]['lease_until'] = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+    queue.start()
+    job = wait_for(queue, job_id)
+    assert job['status'] == 'done' and job['attempts'] == 2
+
+
+def test_job_is_abandoned_after_max_attempts():
+    collection = FakeCollection()
+    queue = JobQueue(collection, handler=lambda payload: 'ok', max_attempts=1, poll_interval=0.05)
+    job_id = queue.enqueue({})
+    queue._claim()
+    collection.documents[ObjectId(job_id)]['lease_until'] = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+    assert queue._claim() is None
+    queue._abandon_expired()
+    job = queue.get(job_id)
+    assert job['status'] == 'failed' and 'abandoned' in job['error']
+
+
+def test_get_unknown_job():
+    queue = JobQueue(FakeCollection(), handler=None)
+    assert queue.get('not-an-id') is None
+    assert queue.get(str(ObjectId())) is None
@@ -0,0 +1,100 @@
+from datetime import datetime, timezone
+import pandas as pd
+import pytest
+from benchmarks.local_s3 import LocalS3
+from services.ledger.ledger_archive import LedgerArchive
+from services.ledger.ledger_store import S3CsvLedger, SqliteLedger
+
+BUCKET = 'ledger-bucket'
+NOW = datetime(2026, 10, 18, tzinfo=timezone.utc)
+ROWS = [
+    {'Reference': 'A1', 'Sent_From': 'ann lee', 'Date': 'Mon, 01 Jan 2024 10:00:00 -0500', 'Amount': '50', 'Used': True},
+    {'Reference': 'A2', 'Sent_From': 'bob ray', 'Date': 'Tue, 02 Jan 2024 10:00:00 -0500', 'Amount': '50', 'Used': False},
+    {'Reference': 'A3', 'Sent_From': 'cat kim', 'Date': 'Fri, 10 Oct 2026 10:00:00 -0400', 'Amount': '50', 'Used': True},
+    {'Reference': 'A4', 'Sent_From': 'dan oak', 'Date': '2026-10-12', 'Amount': '60', 'Used': False},
+    {'Reference': 'A5', 'Sent_From': 'eve fox', 'Date': 'not a date', 'Amount': '70', 'Used': False},
+]
+
+
+def s3_ledger(rows=ROWS):
+    s3 = LocalS3()
+    s3.put_object(Bucket=BUCKET, Key='ledger.csv', Body=pd.DataFrame(rows).to_csv(index=False))
+    return S3CsvLedger(s3, BUCKET, 'ledger.csv', LedgerArchive(s3, BUCKET, 'ledger_archive/'))
+
+
+def sqlite_ledger(rows=ROWS):
+    ledger = SqliteLedger(':memory:')
+    ledger.add_unique_rows([dict(row) for row in rows])
+    return ledger
+
+
+@pytest.fixture(params=[s3_ledger, sqlite_ledger], ids=['s3', 'sqlite'])
+def ledger(request):
+    return request.param()
+
+
+def test_claim_uses_a_payment_once(ledger):
+    match = ledger.payer_index().best_match('dan oak')
+    assert match['reference'] == 'A4'
+
+    assert ledger.claim(match['row_key'], 'A4')
+    assert not ledger.claim(match['row_key'], 'A4')
+    assert not ledger.claim_reference('A4')
+    assert ledger.payer_index().best_match('dan oak') is None
+
+
+def test_claim_checks_the_reference():
+    # Compaction renumbers the rows of the S3 ledger, so a claim names its reference too
+    ledger = s3_ledger()
+    match = ledger.payer_index().best_match('dan oak')
+    assert not ledger.claim(match['row_key'], 'A2')
+    assert ledger.payer_index().best_match('dan oak') is not None
+
+
+def test_unclaim_gives_the_payment_back(ledger):
+    assert ledger.claim_reference('A4')
+    assert ledger.unclaim('A4')
+    assert not ledger.unclaim('A4')
+    assert ledger.payer_index().best_match('dan oak')['reference'] == 'A4'
+    assert ledger.claim_reference('A4')
+
+
+def test_add_unique_rows_skips_known_references(ledger):
+    new_row = {'Reference': 'A6', 'Sent_From': 'fay ito', 'Date': '2026-10-17', 'Amount': '10', 'Used': False}
+    added = ledger.add_unique_rows([dict(ROWS[1]), new_row])
+    assert [row['Reference'] for row in added] == ['A6']
+    assert ledger.payer_index().best_match('fay ito')['reference'] == 'A6'
+
+
+def test_compact_moves_used_and_old_rows_to_the_archive():
+    ledger = s3_ledger()
+    assert ledger.compact(60, NOW) == {'archived': 3, 'hot_rows': 2}
+
+    # Recent unused rows and rows without a parsable date stay hot
+    assert sorted(ledger.load()['Reference']) == ['A4', 'A5']
+    assert sorted(ledger.archive.load_month('2024-01')['Reference']) == ['A1', 'A2']
+    assert list(ledger.archive.load_month('2026-10')['Reference']) == ['A3']
+    assert ledger.archive.references() == {'A1', 'A2', 'A3'}
+    assert ledger.payer_index().best_match('dan oak')['reference'] == 'A4'
+
+    # Nothing left to move
+    assert ledger.compact(60, NOW) == {'archived': 0, 'hot_rows': 2}
+
+
+def test_archived_references_are_not_added_again():
+    ledger = s3_ledger()
+    ledger.compact(60, NOW)
+    assert ledger.add_unique_rows([dict(ROWS[0], Used=False)]) == []
+    assert 'A1' not in set(ledger.load()['Reference'])
+
+
+def test_interrupted_compaction_does_not_archive_twice():
+    ledger = s3_ledger()
+    df = ledger.load()
+    cold = df['Used'] == True
+    # The archive was written but the hot ledger was not saved
+    ledger.archive.add(df[cold], pd.to_datetime(['2024-01-01', '2026-10-10'], utc=True))
+
+    assert ledger.compact(60, NOW)['archived'] == 3
+    assert sorted(ledger.archive.load_month('2024-01')['Reference']) == ['A1', 'A2']
+    assert len(ledger.archive.load_month('2026-10')) == 1
@@ -0,0 +1,67 @@
+import random
+import string
+import pandas as pd
+import pytest
+from thefuzz import fuzz, process
+from services.ledger.payer_index import PayerIndex
+
+FIRST = ['john', 'jane', 'mohammad', 'ali', 'sara', 'li', 'wei', 'ana', 'jose', 'marie', "o'neil", 'jean-luc', 'zoë', 'abc', 'abd']
+LAST = ['smith', 'doe', 'farzam', 'nav', 'mohajeri', 'chen', 'garcia', 'tremblay', 'nguyen', 'smyth', 'smithe']
+
+
+def payer_name(rng):
+    name = ' '.join(rng.choice(FIRST + LAST) for _ in range(rng.randint(1, 4)))
+    if rng.random() < 0.3:
+        # A typo
+        i = rng.randrange(len(name))
+        name = name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1:]
+    return name
+
+
+def ledger(names):
+    return pd.DataFrame({
+        'Sent_From': names,
+        'Amount': ['50'] * len(names),
+        'Reference': [f'REF{i}' for i in range(len(names))],
+        'Used': [False] * len(names),
+    })
+
+
+def extract_one(name, df):
+    """The lookup PayerIndex replaces."""
+    match = process.extractOne(name, df['Sent_From'], scorer=fuzz.token_set_ratio)
+    return match[0] if match and match[1] >= PayerIndex.threshold else None
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_best_match_equals_extract_one(seed):
+    rng = random.Random(seed)
+    for _ in range(300):
+        df = ledger([payer_name(rng) for _ in range(rng.randint(1, 30))])
+        query = payer_name(rng)
+        match = PayerIndex(df).best_match(query)
+        assert (match['name'] if match else None) == extract_one(query, df)
+
+
+def test_best_match_returns_the_first_row_of_a_repeated_name():
+    df = ledger(['ann lee', 'bob ray', 'ann lee'])
+    match = PayerIndex(df).best_match('ann lee')
+    assert (match['row_key'], match['reference']) == (0, 'REF0')
+
+
+def test_discard_and_add_follow_the_ledger():
+    rng = random.Random(42)
+    df = ledger([payer_name(rng) for _ in range(50)])
+    index = PayerIndex(df)
+    used = rng.sample(list(df.index), 20)
+    for row_key in used:
+        index.discard(row_key)
+    unused = df.drop(used)
+    for _ in range(200):
+        query = payer_name(rng)
+        match = index.best_match(query)
+        assert (match['name'] if match else None) == extract_one(query, unused)
+
+    index.add(used[0], df.loc[used[0], 'Sent_From'], '50', df.loc[used[0], 'Reference'])
+    assert index.best_match(df.loc[used[0], 'Sent_From']) is not None
+    assert len(index) == 31